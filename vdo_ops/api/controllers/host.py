@@ -4,7 +4,7 @@ from common import log
 from flask_rebar import errors
 from schemas.error import ErrorResponseSchema
 from schemas.header import GlobalHeadersSchema
-from schemas.host import NetworkCopySchema
+from schemas.host import NetworkCopySchema, NetworkCopyPlanResponseSchema
 from schemas.common import GenericSuccessResponseSchema
 from server.rebar import registry
 import boto3
@@ -24,6 +24,7 @@ BASE_URL = "/host/<int:device_id>"
     headers_schema=GlobalHeadersSchema(),
     request_body_schema=NetworkCopySchema(),
     response_body_schema={
+        200: NetworkCopyPlanResponseSchema(),
         202: GenericSuccessResponseSchema(),
         500: ErrorResponseSchema,
     },
@@ -32,8 +33,13 @@ def network_copy(device_id):
     body = flask_rebar.get_validated_body()
 
     to_host_device = body["toHost"]
+    dry_run = body["dryRun"]
 
-    payload = {"from_host_id": device_id, "to_host_device": to_host_device}
+    payload = {
+        "from_device": device_id,
+        "to_device": to_host_device,
+        "dry_run": dry_run,
+    }
 
     function_name = f"{constants.STAGE}-vdo-ops-network_copy"
     response = lambda_client.invoke(
@@ -41,4 +47,6 @@ def network_copy(device_id):
     )
     if "FunctionError" in response:
         raise errors.InternalError(response["FunctionError"])
+    if dry_run:
+        return json.loads(response["Payload"].read()), 200
     return {"success": "successfully copied network settings"}, 202
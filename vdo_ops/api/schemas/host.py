@@ -1,6 +1,25 @@
-from flask_rebar import RequestSchema
-from marshmallow import fields
+from flask_rebar import RequestSchema, ResponseSchema
+from marshmallow import fields, Schema
 
 
 class NetworkCopySchema(RequestSchema):
     toHost = fields.String()
+    dryRun = fields.Boolean(missing=False)
+
+
+class PortgroupChangeSchema(Schema):
+    name = fields.String()
+    vswitch_name = fields.String()
+
+
+class SkippedPortgroupSchema(Schema):
+    name = fields.String()
+    reason = fields.String()
+
+
+class NetworkCopyPlanResponseSchema(ResponseSchema):
+    source_host = fields.String()
+    destination_host = fields.String()
+    vswitches_to_add = fields.List(fields.String())
+    portgroups_to_add = fields.Nested(PortgroupChangeSchema, many=True)
+    portgroups_skipped = fields.Nested(SkippedPortgroupSchema, many=True)
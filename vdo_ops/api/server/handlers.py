@@ -11,6 +11,7 @@ from flask_dotenv import DotEnv
 from flask_rebar import errors
 
 from common import log, constants
+from common.deadline import lambda_deadline
 from controllers import job, host  # noqa: F401
 from schemas.error import ErrorResponseSchema
 from server.rebar import rebar
@@ -123,4 +124,5 @@ def handler(event: Dict[str, Any], context: object) -> Any:
 
     app = create_app()
     base64_types = ["image/png"]
-    return awsgi.response(app, event, context, base64_content_types=base64_types)
+    with lambda_deadline(context):
+        return awsgi.response(app, event, context, base64_content_types=base64_types)
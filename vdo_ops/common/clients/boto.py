@@ -1,13 +1,19 @@
 import os
+import threading
 from enum import unique, Enum
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 import boto3
 import botocore
+from botocore.config import Config
 
-from common import constants, log
+from common import constants, deadline, log
 
 REGION = os.environ.get("REGION", "us-west-2")
+BOTO_CONNECT_TIMEOUT = 60  # botocore defaults
+BOTO_READ_TIMEOUT = 60
+# Timeouts of clients used under a deadline, the longest that fits is used
+DEADLINE_TIMEOUTS = (1, 2, 5, 10)
 
 
 @unique
@@ -65,9 +71,48 @@ def get_boto_session() -> boto3.Session:
     return boto3.Session(**env_kwargs)
 
 
+_clients: Dict[Any, Any] = {}
+_clients_lock = threading.Lock()
+
+
+def _deadline_timeout() -> Optional[float]:
+    """
+    The timeout of clients for the active deadline, or None without one. It
+    is the longest of DEADLINE_TIMEOUTS that fits the time left, so a few
+    clients are enough for every deadline.
+    """
+    if deadline.current() is None:
+        return None
+    remaining = deadline.clamp(BOTO_READ_TIMEOUT)
+    fitting = [timeout for timeout in DEADLINE_TIMEOUTS if timeout <= remaining]
+    return fitting[-1] if fitting else DEADLINE_TIMEOUTS[0]
+
+
 def get_client(client_type: ClientType) -> botocore.client:
-    session = get_boto_session()
-    return session.client(client_type.value)
+    """
+    A client of the given type, made once per container and timeout. Under a
+    deadline, the deadline is checked and the client gets a timeout that fits
+    what is left of it. Clients are thread safe, sessions are not, so clients
+    are made under a lock.
+    """
+    timeout = _deadline_timeout()
+    key = (client_type, timeout)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            session = get_boto_session()
+            if timeout is None:
+                client = session.client(client_type.value)
+            else:
+                config = Config(connect_timeout=timeout, read_timeout=timeout)
+                client = session.client(client_type.value, config=config)
+            _clients[key] = client
+        return client
+
+
+def clear_clients() -> None:
+    with _clients_lock:
+        _clients.clear()
 
 
 def make_arn(resource_type: str, resource_descriptor: str) -> str:
@@ -3,6 +3,8 @@ from typing import Any, Optional
 import arrow
 from requests import Session
 
+from common import deadline
+
 
 class IdentityAccount:
     def __init__(
@@ -86,8 +88,8 @@ class BaseSession(Session):
     def request(self, method: str, url: str, **kwargs: Any):  # type: ignore
         if "timeout" not in kwargs:
             kwargs["timeout"] = (
-                self.__session_config.connect_timeout,
-                self.__session_config.read_timeout,
+                deadline.clamp(self.__session_config.connect_timeout),
+                deadline.clamp(self.__session_config.read_timeout),
             )
 
         return super().request(method, url, **kwargs)
@@ -0,0 +1,193 @@
+"""
+Compact VM records for Zamboni listings.
+
+A Zamboni VM carries the custom field definitions of its vCenter, the same
+list for every VM. VmRecord keeps one FieldTable per vCenter instead, its own
+custom values by field key, and interned copies of the strings repeated across
+VMs.
+"""
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+def _intern(value: Any) -> Any:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _bounds(fields: Sequence[Dict[str, Any]]) -> Any:
+    if not fields:
+        return None
+    return fields[0].get("key", None), fields[-1].get("key", None)
+
+
+class FieldTable:
+    """
+    The custom field definitions of a vCenter, indexed by name and key.
+    """
+
+    __slots__ = ("definitions", "_bounds", "_keys_by_name", "_service_keys")
+
+    def __init__(self, available_fields: Iterable[Dict[str, Any]]):
+        self.definitions: Tuple[Dict[str, Any], ...] = tuple(
+            {name: _intern(value) for name, value in field.items()}
+            for field in available_fields
+        )
+        self._bounds = _bounds(self.definitions)
+        keys_by_name: Dict[str, Any] = {}
+        for field in self.definitions:
+            # The first definition of a name wins, like vCenter does
+            keys_by_name.setdefault(field.get("name", None), field.get("key", None))
+        self._keys_by_name = keys_by_name
+        self._service_keys: Optional[Dict[Any, int]] = None
+
+    def matches(self, available_fields: List[Dict[str, Any]]) -> bool:
+        """
+        Cheap check that a VM has the same definitions as the table: the same
+        number, with the same first and last keys.
+        """
+        return (
+            len(available_fields) == len(self.definitions)
+            and _bounds(available_fields) == self._bounds
+        )
+
+    def key_for(self, name: str) -> Any:
+        return self._keys_by_name.get(name, None)
+
+    def service_keys(self, services_list: List[Tuple[str, int]]) -> Dict[Any, int]:
+        """
+        Maps the keys of the given service fields to their bits, computed once.
+        """
+        if self._service_keys is None:
+            self._service_keys = {
+                self._keys_by_name[name]: bit
+                for name, bit in services_list
+                if name in self._keys_by_name
+            }
+        return self._service_keys
+
+
+class FieldTables:
+    """
+    Shares a FieldTable among the VMs of each vCenter.
+    """
+
+    def __init__(self) -> None:
+        self.__tables: Dict[Any, FieldTable] = {}
+
+    def table_for(
+        self, location: Any, available_fields: List[Dict[str, Any]]
+    ) -> FieldTable:
+        table = self.__tables.get(location)
+        if table is not None and table.matches(available_fields):
+            return table
+        table = FieldTable(available_fields)
+        # A VM with other definitions than its vCenter's gets a table of its
+        # own; the shared one is only replaced when there is none
+        self.__tables.setdefault(location, table)
+        return table
+
+
+class VmRecord:
+    __slots__ = (
+        "id",
+        "name",
+        "location",
+        "provider_account_id",
+        "instance_uuid",
+        "uuid",
+        "rackspace",
+        "metadata",
+        "guest",
+        "fields",
+        "values",
+        "service_value",
+        "org_id",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        name: str,
+        location: str,
+        provider_account_id: Optional[str] = None,
+        instance_uuid: Optional[str] = None,
+        uuid: Optional[str] = None,
+        rackspace: Optional[Dict[str, Any]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        guest: Optional[Dict[str, Any]] = None,
+        fields: Optional[FieldTable] = None,
+        values: Optional[Dict[Any, Any]] = None,
+        service_value: int = 0,
+        org_id: Optional[str] = None,
+    ):
+        self.id = id
+        self.name = name
+        self.location = _intern(location)
+        self.provider_account_id = _intern(provider_account_id)
+        self.instance_uuid = instance_uuid
+        self.uuid = uuid
+        self.rackspace = rackspace
+        self.metadata = metadata
+        self.guest = guest
+        self.fields = fields
+        self.values = values or {}
+        self.service_value = service_value
+        self.org_id = _intern(org_id)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(name={self.name!r}, location={self.location!r})"
+
+    @classmethod
+    def from_dict(cls, vm: Dict[str, Any], tables: FieldTables) -> "VmRecord":
+        """
+        Builds a record from a Zamboni VM, sharing the field table of its
+        vCenter through tables.
+        """
+        location = vm.get("location", None)
+        return cls(
+            vm.get("id", None),
+            vm.get("name", None),
+            location,
+            provider_account_id=vm.get("provider_account_id", None),
+            instance_uuid=vm.get("config$instanceUuid", None),
+            uuid=vm.get("config$uuid", None),
+            rackspace=vm.get("_rackspace", None),
+            metadata=vm.get("_metadata", None),
+            guest=vm.get("guest", None),
+            fields=tables.table_for(location, vm.get("availableField", None) or []),
+            values={
+                value.get("key", None): _intern(value.get("value", None))
+                for value in vm.get("value", None) or []
+            },
+        )
+
+    def custom_attribute(self, name: str) -> Any:
+        """
+        The value of the custom field with the given name, if the VM has one.
+        """
+        if self.fields is None:
+            return None
+        return self.values.get(self.fields.key_for(name), None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        The VM in the shape Zamboni returns it, with the enrichment applied.
+        """
+        metadata = dict(self.metadata or {})
+        metadata["orgId"] = self.org_id
+        return {
+            "id": self.id,
+            "name": self.name,
+            "location": self.location,
+            "provider_account_id": self.provider_account_id,
+            "_rackspace": self.rackspace,
+            "_metadata": metadata,
+            "availableField": list(self.fields.definitions) if self.fields else [],
+            "value": [
+                {"key": key, "value": value} for key, value in self.values.items()
+            ],
+            "config$instanceUuid": self.instance_uuid,
+            "config$uuid": self.uuid,
+            "guest": self.guest,
+            "service_value": self.service_value,
+        }
@@ -1,13 +1,21 @@
+import http.client
 import socket
+import ssl
 import threading
+import time
 from contextlib import contextmanager
 
 from pyVim import connect
-from pyVmomi import vim
+from pyVmomi import vim, vmodl
 
-from common import log, secrets
+from common import deadline, log, secrets
+from common.clients.vsphere_limiter import VcenterLimiter, get_limiter
+from common.clients.vsphere_metrics import SoapMetrics, instrument_stub
+from common.network_profile import NetworkProfile
 
-socket.setdefaulttimeout(15)  # Lambda max execution time is 20
+# pyVmomi 6.7 has no timeout for the login; calls on a logged in session get
+# theirs from the active deadline instead
+socket.setdefaulttimeout(deadline.DEFAULT_TIMEOUT)
 logger = log.get_logger(__name__)
 
 AUTOMATION_ADMIN_USERNAME = secrets.get_parameter(
@@ -17,51 +25,519 @@ AUTOMATION_ADMIN_PASSWORD = secrets.get_parameter(
     "/vdo/global/vsphere_admin_automation_password"
 )
 
+MAX_SESSIONS_PER_VCENTER = 4
+SESSION_ACQUIRE_TIMEOUT = 10  # seconds to wait for a free session slot
+SESSION_CHECK_INTERVAL = 60  # sessions used more recently are not pinged
+# Errors after which a session is logged out rather than pooled again
+SESSION_ERRORS = (vim.fault.NotAuthenticated, OSError, http.client.HTTPException)
+TASK_WAIT_TIMEOUT = 20  # seconds to wait for vCenter tasks, Lambda timeout is 30
+
+HOST_NETWORK_PROPERTIES = [
+    "config.network.vswitch",
+    "config.network.portgroup",
+    "config.network.vnic",
+    "config.network.consoleVnic",
+]
+
+
+class HostNetworkSnapshot:
+    """
+    Immutable copy of the network configuration of a host system, fetched in a
+    single round trip. Every query is answered locally.
+    """
+
+    __slots__ = (
+        "host_name",
+        "vswitches",
+        "portgroups",
+        "vnics",
+        "console_vnics",
+        "_vswitch_names",
+        "_portgroup_names",
+        "_do_not_copy_names",
+    )
+
+    def __init__(
+        self, host_name, vswitches=(), portgroups=(), vnics=(), console_vnics=()
+    ):
+        set_attr = super().__setattr__
+        set_attr("host_name", host_name)
+        set_attr("vswitches", tuple(vswitches))
+        set_attr("portgroups", tuple(portgroups))
+        set_attr("vnics", tuple(vnics))
+        set_attr("console_vnics", tuple(console_vnics))
+        set_attr("_vswitch_names", frozenset(v.name for v in self.vswitches))
+        set_attr("_portgroup_names", frozenset(p.spec.name for p in self.portgroups))
+        set_attr(
+            "_do_not_copy_names",
+            frozenset(vnic.portgroup for vnic in self.get_do_not_copy_list()),
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self):
+        return (
+            f"{type(self).__name__}(host_name={self.host_name!r}, "
+            f"vswitches={len(self.vswitches)}, portgroups={len(self.portgroups)}, "
+            f"vnics={len(self.vnics)}, console_vnics={len(self.console_vnics)})"
+        )
+
+    @classmethod
+    def from_properties(cls, host_name, properties):
+        """
+        Builds a snapshot from PropertyCollector results keyed by property path.
+        Properties that are unset on the host are left out by vCenter.
+        """
+        return cls(
+            host_name,
+            vswitches=properties.get("config.network.vswitch", []),
+            portgroups=properties.get("config.network.portgroup", []),
+            vnics=properties.get("config.network.vnic", []),
+            console_vnics=properties.get("config.network.consoleVnic", []),
+        )
+
+    def get_portgroups_by_vswitch(self, vswitch_name):
+        """
+        Finds the port groups that are on the given virtual switch.
+        """
+        return [
+            portgroup
+            for portgroup in self.portgroups
+            if portgroup.vswitch is not None
+            and portgroup.vswitch.split("-")[2] == vswitch_name
+        ]
+
+    def get_do_not_copy_list(self):
+        """
+        Makes a list of all virtual nics and console virtual nics.
+        """
+        return [*self.vnics, *self.console_vnics]
+
+    def is_in_do_not_copy_list(self, portgroup_name):
+        """
+        Checks to see if the given port group is used by a virtual nic.
+        """
+        return portgroup_name in self._do_not_copy_names
+
+    @property
+    def vswitch_names(self):
+        return self._vswitch_names
+
+    @property
+    def portgroup_names(self):
+        return self._portgroup_names
+
+    @property
+    def do_not_copy_names(self):
+        return self._do_not_copy_names
+
+    def has_virtual_switch(self, vswitch_name):
+        return vswitch_name in self._vswitch_names
+
+    def has_portgroup(self, portgroup_name):
+        return portgroup_name in self._portgroup_names
+
+
+def _view_object_spec(container):
+    """
+    Object spec selecting every object in a container view, but not the view.
+    """
+    traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(
+        name="traverseView", path="view", skip=False, type=vim.view.ContainerView
+    )
+    return vmodl.query.PropertyCollector.ObjectSpec(
+        obj=container, skip=True, selectSet=[traversal_spec]
+    )
+
+
+def _filter_spec(object_spec, vimtype, path_set):
+    return vmodl.query.PropertyCollector.FilterSpec(
+        objectSet=[object_spec],
+        propSet=[
+            vmodl.query.PropertyCollector.PropertySpec(
+                type=vimtype, pathSet=path_set, all=False
+            )
+        ],
+    )
+
+
+def _dvs_portgroup_spec(config, config_version=None):
+    """
+    Builds the spec to create a distributed port group like the given one, or
+    to reconfigure one to match it when config_version is given.
+    """
+    return vim.dvs.DistributedVirtualPortgroup.ConfigSpec(
+        configVersion=config_version,
+        name=config.name,
+        type=config.type,
+        numPorts=config.numPorts,
+        autoExpand=config.autoExpand,
+        description=config.description,
+        defaultPortConfig=config.defaultPortConfig,
+        policy=config.policy,
+    )
+
+
+def _login(host_name, limiter=None):
+    deadline.check(f"log in to {host_name}")
+    with (limiter or get_limiter(host_name)).limit("login"):
+        return connect.SmartConnectNoSSL(
+            host=host_name,
+            user=AUTOMATION_ADMIN_USERNAME,
+            pwd=AUTOMATION_ADMIN_PASSWORD,
+            port=443,
+        )
+
+
+def _bind_deadline(stub):
+    """
+    Makes the calls of a pyVmomi stub follow the active deadline: a call is not
+    started when the deadline is spent, and its socket timeout is what is left.
+    """
+    if "_deadline_bound" in vars(stub):
+        return
+    stub._deadline_bound = True
+    invoke_method = stub.InvokeMethod
+
+    def deadline_invoke_method(mo, info, args, *rest):
+        deadline.check(f"call {info.wsdlName}")
+        return invoke_method(mo, info, args, *rest)
+
+    stub.InvokeMethod = deadline_invoke_method
+
+    # SoapStubAdapter only: pooled connections keep the timeout they were
+    # opened with, so it is set again on every checkout
+    if hasattr(stub, "GetConnection"):
+        get_connection = stub.GetConnection
+
+        def deadline_get_connection():
+            call_timeout = deadline.timeout()
+            stub.schemeArgs["timeout"] = call_timeout
+            connection = get_connection()
+            connection.timeout = call_timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(call_timeout)
+            return connection
+
+        stub.GetConnection = deadline_get_connection
+
+
+class _PooledSession:
+    __slots__ = ("si", "session_manager", "last_used")
+
+    def __init__(self, si):
+        self.si = si
+        self.session_manager = si.content.sessionManager
+        self.last_used = time.monotonic()
+
+    def is_active(self):
+        """
+        Checks if vCenter still knows the session. Reading currentSession is a
+        single small round trip and is unset once the session has expired.
+        """
+        if time.monotonic() - self.last_used < SESSION_CHECK_INTERVAL:
+            return True
+        try:
+            return self.session_manager.currentSession is not None
+        except Exception:
+            logger.debug("Session liveness check failed", exc_info=True)
+            return False
+
+
+class VsphereSessionPool:
+    """
+    Keeps vCenter sessions logged in between uses, keyed by vCenter host name,
+    so a warm Lambda container does not log in on every invocation. At most
+    max_sessions sessions are checked out per vCenter at the same time.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = MAX_SESSIONS_PER_VCENTER,
+        acquire_timeout: float = SESSION_ACQUIRE_TIMEOUT,
+    ):
+        self.__max_sessions = max_sessions
+        self.__acquire_timeout = acquire_timeout
+        self.__lock = threading.Lock()
+        self.__slots = {}
+        self.__idle = {}
+        self.__checked_out = {}
+
+    def _get_slots(self, host_name):
+        with self.__lock:
+            if host_name not in self.__slots:
+                self.__slots[host_name] = threading.BoundedSemaphore(
+                    self.__max_sessions
+                )
+                self.__idle[host_name] = []
+            return self.__slots[host_name]
+
+    def acquire(self, host_name: str) -> vim.ServiceInstance:
+        """
+        Checks out a session for the given vCenter, reusing an idle one when it
+        is still active and logging in otherwise.
+        """
+        slots = self._get_slots(host_name)
+        if not slots.acquire(timeout=deadline.clamp(self.__acquire_timeout)):
+            raise Exception(f"No vCenter session available for {host_name}")
+
+        try:
+            pooled = self._pop_active(host_name)
+            if pooled is None:
+                logger.debug("Opening pooled session", vcenter=host_name)
+                pooled = _PooledSession(_login(host_name))
+            else:
+                logger.debug("Reusing pooled session", vcenter=host_name)
+        except Exception:
+            slots.release()
+            raise
+
+        with self.__lock:
+            self.__checked_out[id(pooled.si)] = pooled
+        return pooled.si
+
+    def _pop_active(self, host_name):
+        while True:
+            with self.__lock:
+                if not self.__idle[host_name]:
+                    return None
+                pooled = self.__idle[host_name].pop()
+            if pooled.is_active():
+                return pooled
+            logger.debug("Pooled session has expired", vcenter=host_name)
+
+    def release(self, host_name: str, si: vim.ServiceInstance) -> None:
+        """
+        Returns a session to the pool so the next caller can reuse it.
+        """
+        with self.__lock:
+            pooled = self.__checked_out.pop(id(si))
+            pooled.last_used = time.monotonic()
+            self.__idle[host_name].append(pooled)
+        self._get_slots(host_name).release()
+
+    def discard(self, host_name: str, si: vim.ServiceInstance) -> None:
+        """
+        Logs out a checked out session instead of returning it to the pool.
+        """
+        with self.__lock:
+            self.__checked_out.pop(id(si), None)
+        try:
+            connect.Disconnect(si)
+        except Exception:
+            logger.debug("Failed to disconnect session", exc_info=True)
+        self._get_slots(host_name).release()
+
+    def close(self) -> None:
+        """
+        Logs out every idle session.
+        """
+        with self.__lock:
+            idle = [pooled for sessions in self.__idle.values() for pooled in sessions]
+            for sessions in self.__idle.values():
+                sessions.clear()
+        for pooled in idle:
+            try:
+                connect.Disconnect(pooled.si)
+            except Exception:
+                logger.debug("Failed to disconnect session", exc_info=True)
+
+
+# Module level so that sessions survive warm Lambda invocations
+SESSION_POOL = VsphereSessionPool()
+
 
 class VsphereClient:
-    def __init__(self, host_name: str, si: vim.ServiceInstance = None):
+    """
+    Client for a single vCenter. The thread that opens the session owns the
+    primary login; any other thread using the client gets its own session,
+    cloned from the primary one with a clone ticket, so the client can be
+    shared by a thread pool.
+    """
+
+    def __init__(
+        self,
+        host_name: str,
+        si: vim.ServiceInstance = None,
+        session_pool: VsphereSessionPool = None,
+        metrics: SoapMetrics = None,
+        limiter: VcenterLimiter = None,
+    ):
         self.__host = host_name
+        self.__session_pool = session_pool
+        self.metrics = metrics or SoapMetrics()
+        self.limiter = limiter or get_limiter(host_name)
+        self.__primary_si = si
+        self.__generation = 0
+        self.__clones = []
+        self.__clone_lock = threading.Lock()
         self.__local_data = threading.local()
+        self.__reset_local_data(si)
+
+    def __reset_local_data(self, si):
+        self.__local_data.generation = self.__generation
         self.__local_data.si = si
+        self.__local_data.content = None
+        self.__local_data.inventory = {}
 
     def init_connection(self) -> None:
         logger.debug("Opening session")
-        self.__local_data.si = connect.SmartConnectNoSSL(
-            host=self.__host,
-            user=AUTOMATION_ADMIN_USERNAME,
-            pwd=AUTOMATION_ADMIN_PASSWORD,
-            port=443,
-        )
+        if self.__session_pool is not None:
+            si = self.__session_pool.acquire(self.__host)
+        else:
+            si = _login(self.__host, self.limiter)
+        _bind_deadline(si._stub)
+        instrument_stub(si._stub, self.metrics)
+        self.__primary_si = si
+        self.__generation += 1
+        self.__reset_local_data(si)
         logger.debug("Session is granted")
 
-    def close_connection(self) -> None:
+    def close_connection(self, discard: bool = False) -> None:
+        """
+        Ends the session. A pooled session is returned to the pool, or logged
+        out when discard is set because it may no longer be usable.
+        """
         logger.debug("Closing session")
-        connect.Disconnect(self.__local_data.si)
-        self.__local_data.si = None
+        self._logout_clones()
+        if self.__session_pool is not None and discard:
+            self.__session_pool.discard(self.__host, self.__primary_si)
+        elif self.__session_pool is not None:
+            self.__session_pool.release(self.__host, self.__primary_si)
+        else:
+            connect.Disconnect(self.__primary_si)
+        self.__primary_si = None
+        self.__generation += 1
+        self.__reset_local_data(None)
         logger.debug("Session is closed")
 
+    def _clone_session(self) -> vim.ServiceInstance:
+        """
+        Logs a new session in with a clone ticket of the primary session, so
+        worker threads never re-send the admin credentials.
+        """
+        logger.debug("Cloning session for worker thread")
+        ticket = self.__primary_si.content.sessionManager.AcquireCloneTicket()
+        # Unverified like the SmartConnectNoSSL login it clones, vCenter
+        # certificates are self-signed
+        context = ssl._create_unverified_context()  # nosec
+        stub = connect.SmartStubAdapter(host=self.__host, port=443, sslContext=context)
+        _bind_deadline(stub)
+        instrument_stub(stub, self.metrics)
+        si = vim.ServiceInstance("ServiceInstance", stub)
+        with self.limiter.limit("login"):
+            si.content.sessionManager.CloneSession(ticket)
+
+        with self.__clone_lock:
+            self.__clones.append(si)
+        return si
+
+    def _logout_clones(self) -> None:
+        with self.__clone_lock:
+            clones = self.__clones
+            self.__clones = []
+        for si in clones:
+            try:
+                si.content.sessionManager.Logout()
+            except Exception:
+                logger.debug("Failed to log out cloned session", exc_info=True)
+
+    def _get_local_data(self):
+        """
+        Gets the session data of the calling thread, cloning the primary session
+        the first time a thread uses the client during a session.
+        """
+        if getattr(self.__local_data, "generation", None) != self.__generation:
+            si = None
+            if self.__primary_si is not None:
+                si = self._clone_session()
+            self.__reset_local_data(si)
+        return self.__local_data
+
     @contextmanager
     def open_session(self):
         self.init_connection()
+        discard = False
         try:
             yield self
+        except SESSION_ERRORS:
+            # The session may be dead, a retry must not get it from the pool
+            discard = True
+            raise
         finally:
-            self.close_connection()
+            self.close_connection(discard=discard)
 
-    def _get_obj(self, vimtype, name):
+    def _get_content(self):
         """
-        Get the vsphere object associated with a given text name
+        Gets the service content of the current session. It is fetched once per
+        session since every call to RetrieveContent is a round trip.
         """
-        content = self.__local_data.si.RetrieveContent()
+        local_data = self._get_local_data()
+        if local_data.content is None:
+            local_data.content = local_data.si.RetrieveContent()
+        return local_data.content
+
+    def _retrieve_properties(self, vimtype, path_set, root=None):
+        """
+        Retrieves the given properties of every object of the given type below
+        root (the root folder by default) with a single PropertyCollector call.
+        The container view used for the traversal is destroyed before returning.
+
+        Returns a list of (object, {property path: value}) tuples.
+        """
+        content = self._get_content()
         container = content.viewManager.CreateContainerView(
-            content.rootFolder, [vimtype], True
+            root or content.rootFolder, [vimtype], True
+        )
+        try:
+            return self._collect(_view_object_spec(container), vimtype, path_set)
+        finally:
+            container.Destroy()
+
+    def _collect(self, object_spec, vimtype, path_set):
+        """
+        Runs a RetrievePropertiesEx call for the given object spec, following the
+        continuation token until every page of results is read.
+        """
+        collector = self._get_content().propertyCollector
+        filter_spec = _filter_spec(object_spec, vimtype, path_set)
+        result = collector.RetrievePropertiesEx(
+            [filter_spec], vmodl.query.PropertyCollector.RetrieveOptions()
         )
-        obj = None
-        for c in container.view:
-            if c.name == name:
-                obj = c
+
+        objects = []
+        while result is not None:
+            for object_content in result.objects:
+                properties = {prop.name: prop.val for prop in object_content.propSet}
+                objects.append((object_content.obj, properties))
+            if not result.token:
                 break
-        return obj
+            result = collector.ContinueRetrievePropertiesEx(result.token)
+        return objects
+
+    def _get_inventory(self, vimtype):
+        """
+        Gets the name to managed object map for the given type. The map is built
+        on first use and reused for the rest of the session.
+        """
+        inventory = self._get_local_data().inventory
+        if vimtype not in inventory:
+            logger.debug(f"Indexing {vimtype.__name__} inventory")
+            index = {}
+            for obj, properties in self._retrieve_properties(vimtype, ["name"]):
+                index.setdefault(properties["name"], obj)
+            inventory[vimtype] = index
+        return inventory[vimtype]
+
+    def _get_obj(self, vimtype, name):
+        """
+        Get the vsphere object associated with a given text name
+        """
+        return self._get_inventory(vimtype).get(name)
 
     # HOST SYSTEM
     def get_host_system(self, name):
@@ -70,83 +546,380 @@ class VsphereClient:
         """
         return self._get_obj(vim.HostSystem, name)
 
+    def get_host_network_snapshot(self, host_name):
+        """
+        Fetches the virtual switches, port groups, virtual nics and console
+        virtual nics of a host system with a single RetrievePropertiesEx call.
+        """
+        host = self.get_host_system(host_name)
+        if host is None:
+            raise Exception(f"Host system {host_name} not found")
+
+        object_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=host, skip=False)
+        properties = {}
+        for obj, obj_properties in self._collect(
+            object_spec, vim.HostSystem, HOST_NETWORK_PROPERTIES
+        ):
+            properties.update(obj_properties)
+
+        return HostNetworkSnapshot.from_properties(host_name, properties)
+
+    def export_network_profile(self, host_name):
+        """
+        Captures the virtual switches and port groups of a host system as a
+        NetworkProfile, without the port groups of its virtual nics.
+        """
+        return NetworkProfile.from_snapshot(self.get_host_network_snapshot(host_name))
+
+    def get_cluster_network_snapshots(self, cluster_name):
+        """
+        Fetches the network configuration of every host system in a cluster
+        with one container view and a single PropertyCollector retrieval.
+
+        Returns a dict of host name to HostNetworkSnapshot.
+        """
+        cluster = self._get_obj(vim.ClusterComputeResource, cluster_name)
+        if cluster is None:
+            raise Exception(f"Cluster {cluster_name} not found")
+
+        return {
+            properties["name"]: HostNetworkSnapshot.from_properties(
+                properties["name"], properties
+            )
+            for obj, properties in self._retrieve_properties(
+                vim.HostSystem, ["name", *HOST_NETWORK_PROPERTIES], root=cluster
+            )
+        }
+
     def get_host_portgroups(self, host_name):
         """
         Gets all the portgroups for a given host system name.
         """
-        return self._get_obj(vim.HostSystem, host_name).config.network.portgroup
+        return self.get_host_network_snapshot(host_name).portgroups
 
     def get_host_virtual_switches(self, host_name):
         """
         Gets all the virtual switches for a given host system name.
         """
-        return self._get_obj(vim.HostSystem, host_name).config.network.vswitch
+        return self.get_host_network_snapshot(host_name).vswitches
 
     def get_portgroup_by_vswitch(self, host_name, vswitch_name):
         """
         For a given host system, finds the port group that has the given virtual switch.
         """
-        host = self.get_host_system(host_name)
-
-        portgroup_list = []
-
-        for portgroup in host.config.network.portgroup:
-            if (
-                portgroup.vswitch is not None
-                and portgroup.vswitch.split("-")[2] == vswitch_name
-            ):
-                portgroup_list.append(portgroup)
-
-        return portgroup_list
+        snapshot = self.get_host_network_snapshot(host_name)
+        return snapshot.get_portgroups_by_vswitch(vswitch_name)
 
     def get_do_not_copy_list(self, host_name):
         """
         Makes a list of all virtual nics and console virtual
         nics for a given host system.
         """
-        host = self.get_host_system(host_name)
-        return [*host.config.network.vnic, *host.config.network.consoleVnic]
+        return self.get_host_network_snapshot(host_name).get_do_not_copy_list()
 
     def is_in_do_not_copy_list(self, host_name, portgroup_name):
         """
         Checks to see if the given port group is in the do not
         copy list of the given host.
         """
-        for vnic in self.get_do_not_copy_list(host_name):
-            if vnic.portgroup == portgroup_name:
-                return True
-        return False
+        snapshot = self.get_host_network_snapshot(host_name)
+        return snapshot.is_in_do_not_copy_list(portgroup_name)
 
     def has_virtual_switch(self, host_name, vswitch_name):
         """
         Checks to see if the given host system has the given virtual switch.
         """
-        host = self.get_host_system(host_name)
-        for vswitch in host.config.network.vswitch:
-            if vswitch.name == vswitch_name:
-                return True
-        return False
+        snapshot = self.get_host_network_snapshot(host_name)
+        return snapshot.has_virtual_switch(vswitch_name)
 
     def has_portgroup(self, host_name, portgroup_name):
         """
         Checks to see if the given host system has the given port group.
         """
-        host = self.get_host_system(host_name)
-        for portgroup in host.config.network.portgroup:
-            if portgroup.spec.name == portgroup_name:
-                return True
-        return False
+        return self.get_host_network_snapshot(host_name).has_portgroup(portgroup_name)
 
     def add_host_vswitch(self, host_name, vswitch_name, vswitch_spec):
         """
         Adds the given virtual switch to the host system.
         """
         host = self.get_host_system(host_name)
-        host.configManager.networkSystem.AddVirtualSwitch(vswitch_name, vswitch_spec)
+        with self.limiter.limit("reconfigure"):
+            host.configManager.networkSystem.AddVirtualSwitch(
+                vswitch_name, vswitch_spec
+            )
 
     def add_host_portgroup(self, host_name, portgroup_spec):
         """
         Adds the given port group to the given host system.
         """
         host = self.get_host_system(host_name)
-        host.configManager.networkSystem.AddPortGroup(portgroup_spec)
+        with self.limiter.limit("reconfigure"):
+            host.configManager.networkSystem.AddPortGroup(portgroup_spec)
+
+    def update_host_network(self, host_name, vswitches, portgroup_specs):
+        """
+        Adds the given virtual switches, as (name, spec) pairs, and port groups
+        to the host system with a single UpdateNetworkConfig call.
+        """
+        host = self.get_host_system(host_name)
+        config = vim.host.NetworkConfig(
+            vswitch=[
+                vim.host.VirtualSwitch.Config(
+                    changeOperation="add", name=name, spec=spec
+                )
+                for name, spec in vswitches
+            ],
+            portgroup=[
+                vim.host.PortGroup.Config(changeOperation="add", spec=spec)
+                for spec in portgroup_specs
+            ],
+        )
+        with self.limiter.limit("reconfigure"):
+            host.configManager.networkSystem.UpdateNetworkConfig(config, "modify")
+
+    # DISTRIBUTED VIRTUAL SWITCH
+    def get_dvs_portgroups(self, switch_name):
+        """
+        Fetches the configuration of every port group of a distributed virtual
+        switch with a single RetrievePropertiesEx call.
+
+        Returns a dict of port group name to DVPortgroupConfigInfo.
+        """
+        switch = self._get_obj(vim.DistributedVirtualSwitch, switch_name)
+        if switch is None:
+            raise Exception(f"Distributed virtual switch {switch_name} not found")
+
+        object_spec = vmodl.query.PropertyCollector.ObjectSpec(
+            obj=switch,
+            skip=True,
+            selectSet=[
+                vmodl.query.PropertyCollector.TraversalSpec(
+                    name="portgroups",
+                    type=vim.DistributedVirtualSwitch,
+                    path="portgroup",
+                    skip=False,
+                )
+            ],
+        )
+        return {
+            properties["config"].name: properties["config"]
+            for obj, properties in self._collect(
+                object_spec, vim.dvs.DistributedVirtualPortgroup, ["config"]
+            )
+        }
+
+    def create_dvs_portgroup(self, switch_name, config):
+        """
+        Starts creating a port group like the given one on the distributed
+        virtual switch. Returns the vCenter task.
+        """
+        switch = self._get_obj(vim.DistributedVirtualSwitch, switch_name)
+        with self.limiter.limit("reconfigure"):
+            return switch.AddPortgroup(_dvs_portgroup_spec(config))
+
+    def reconfigure_dvs_portgroup(self, current_config, config):
+        """
+        Starts reconfiguring the port group with the current configuration to
+        match the given one. Returns the vCenter task.
+        """
+        portgroup = vim.dvs.DistributedVirtualPortgroup(
+            current_config.key, self._get_local_data().si._stub
+        )
+        with self.limiter.limit("reconfigure"):
+            return portgroup.Reconfigure(
+                _dvs_portgroup_spec(config, current_config.configVersion)
+            )
+
+    def wait_for_tasks(self, tasks, timeout=TASK_WAIT_TIMEOUT):
+        """
+        Waits for all the given tasks to complete, for at most timeout seconds
+        or what is left of the active deadline. Every task is watched by the
+        same PropertyCollector filter, so each WaitForUpdatesEx round trip
+        reports the progress of all of them.
+
+        Returns the error of each task, None when it succeeded, in task order.
+        """
+        if not tasks:
+            return []
+
+        collector = self._get_content().propertyCollector
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+            objectSet=[
+                vmodl.query.PropertyCollector.ObjectSpec(obj=task) for task in tasks
+            ],
+            propSet=[
+                vmodl.query.PropertyCollector.PropertySpec(
+                    type=vim.Task, pathSet=["info.state", "info.error"]
+                )
+            ],
+        )
+        property_filter = collector.CreateFilter(filter_spec, partialUpdates=True)
+
+        done = (vim.TaskInfo.State.success, vim.TaskInfo.State.error)
+        pending = {task._moId for task in tasks}
+        errors = {}
+        version = ""
+        wait_until = time.monotonic() + deadline.clamp(timeout)
+        try:
+            while pending:
+                remaining = wait_until - time.monotonic()
+                if remaining <= 0:
+                    raise Exception(f"Timed out waiting for {len(pending)} tasks")
+                options = vmodl.query.PropertyCollector.WaitOptions(
+                    maxWaitSeconds=max(1, int(remaining))
+                )
+                update_set = collector.WaitForUpdatesEx(version, options)
+                if update_set is None:
+                    continue
+                version = update_set.version
+                for filter_update in update_set.filterSet or []:
+                    for object_update in filter_update.objectSet or []:
+                        moid = object_update.obj._moId
+                        for change in object_update.changeSet or []:
+                            if change.name == "info.error":
+                                errors[moid] = change.val
+                            elif change.name == "info.state" and change.val in done:
+                                pending.discard(moid)
+        finally:
+            property_filter.DestroyPropertyFilter()
+
+        return [errors.get(task._moId) for task in tasks]
+
+
+class VsphereInventoryCache:
+    """
+    In-memory copy of the host systems of a vCenter with their names and network
+    configuration. One PropertyCollector fetch loads it, then refresh applies
+    the incremental changes reported by WaitForUpdatesEx, so lookups never go
+    to vCenter. version goes up every time changes are applied, so readers can
+    tell whether what they read before is stale.
+
+    The client session must stay open for as long as the cache is used.
+    """
+
+    def __init__(self, client: VsphereClient):
+        self.__client = client
+        self.__lock = threading.RLock()
+        self.__collector = None
+        self.__view = None
+        self.__update_version = ""
+        self.__version = 0
+        self.__hosts = {}
+        self.__properties = {}
+        self.__names = {}
+        self.__by_name = {}
+        self.__snapshots = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def version(self):
+        return self.__version
+
+    def start(self) -> None:
+        """
+        Creates a dedicated PropertyCollector watching every host system and
+        loads the initial inventory.
+        """
+        content = self.__client._get_content()
+        self.__collector = content.propertyCollector.CreatePropertyCollector()
+        self.__view = content.viewManager.CreateContainerView(
+            content.rootFolder, [vim.HostSystem], True
+        )
+        self.__collector.CreateFilter(
+            _filter_spec(
+                _view_object_spec(self.__view),
+                vim.HostSystem,
+                ["name", *HOST_NETWORK_PROPERTIES],
+            ),
+            partialUpdates=False,
+        )
+        self.refresh()
+
+    def stop(self) -> None:
+        """
+        Destroys the PropertyCollector and the container view on vCenter.
+        """
+        if self.__collector is not None:
+            self.__collector.DestroyPropertyCollector()
+            self.__collector = None
+        if self.__view is not None:
+            self.__view.Destroy()
+            self.__view = None
+
+    def refresh(self, max_wait_seconds: int = 0) -> int:
+        """
+        Applies the changes made since the last refresh, waiting up to
+        max_wait_seconds for one when there is none. Returns the version.
+        """
+        options = vmodl.query.PropertyCollector.WaitOptions(
+            maxWaitSeconds=max_wait_seconds
+        )
+        update_set = self.__collector.WaitForUpdatesEx(self.__update_version, options)
+        while update_set is not None:
+            self._apply_update_set(update_set)
+            self.__update_version = update_set.version
+            if not update_set.truncated:
+                break
+            update_set = self.__collector.WaitForUpdatesEx(
+                self.__update_version, options
+            )
+        return self.__version
+
+    def _apply_update_set(self, update_set):
+        with self.__lock:
+            for filter_update in update_set.filterSet or []:
+                for object_update in filter_update.objectSet or []:
+                    self._apply_object_update(object_update)
+            self.__version += 1
+
+    def _apply_object_update(self, object_update):
+        moid = object_update.obj._moId
+        old_name = self.__names.get(moid)
+        if old_name is not None:
+            self.__by_name.pop(old_name, None)
+            self.__snapshots.pop(old_name, None)
+
+        if object_update.kind == "leave":
+            self.__hosts.pop(moid, None)
+            self.__properties.pop(moid, None)
+            self.__names.pop(moid, None)
+            return
+
+        properties = self.__properties.setdefault(moid, {})
+        for change in object_update.changeSet or []:
+            if change.op in ("remove", "indirectRemove"):
+                properties.pop(change.name, None)
+            else:
+                properties[change.name] = change.val
+
+        name = properties.get("name")
+        self.__hosts[moid] = object_update.obj
+        self.__names[moid] = name
+        self.__by_name[name] = moid
+        self.__snapshots[name] = HostNetworkSnapshot.from_properties(name, properties)
+
+    def get_host_system(self, name):
+        with self.__lock:
+            moid = self.__by_name.get(name)
+            return self.__hosts.get(moid)
+
+    def get_host_network_snapshot(self, host_name):
+        with self.__lock:
+            snapshot = self.__snapshots.get(host_name)
+        if snapshot is None:
+            raise Exception(f"Host system {host_name} not found")
+        return snapshot
+
+    def has_virtual_switch(self, host_name, vswitch_name):
+        return self.get_host_network_snapshot(host_name).has_virtual_switch(
+            vswitch_name
+        )
+
+    def has_portgroup(self, host_name, portgroup_name):
+        return self.get_host_network_snapshot(host_name).has_portgroup(portgroup_name)
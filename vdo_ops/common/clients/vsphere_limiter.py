@@ -0,0 +1,340 @@
+"""
+Concurrency and rate limits per vCenter.
+
+vCenter slows down for everyone when it gets bursts of logins and network
+reconfigurations. Every client of a vCenter in the process shares one limiter
+that caps the calls in flight and spaces them out with a token bucket.
+
+A Lambda container runs one invocation at a time, so those limits only hold
+the threads of that invocation back. When VCENTER_LIMITER_TABLE names a
+DynamoDB table, whole operations, such as a network copy, also take one of the
+operation slots of the vCenter kept there, shared by every container. Slots
+are taken once per operation, not per call. Without the table, or when it
+cannot be reached, operations are only limited per container.
+"""
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from common import deadline, log
+from common.clients import boto
+
+VCENTER_CALL_RATE = float(os.environ.get("VCENTER_CALL_RATE", "10"))  # per second
+VCENTER_CALL_BURST = int(os.environ.get("VCENTER_CALL_BURST", "20"))
+VCENTER_MAX_CONCURRENT_CALLS = int(os.environ.get("VCENTER_MAX_CONCURRENT_CALLS", "4"))
+LIMITER_WAIT_TIMEOUT = 10  # seconds a call waits for its turn at most
+
+LIMITER_TABLE = os.environ.get("VCENTER_LIMITER_TABLE")
+VCENTER_MAX_CONCURRENT_OPERATIONS = int(
+    os.environ.get("VCENTER_MAX_CONCURRENT_OPERATIONS", "4")
+)
+LIMITER_LEASE = 60  # seconds a shared slot is held at most, should its holder die
+LIMITER_ITEM_TTL = 24 * 60 * 60  # seconds before the item of an idle vCenter expires
+LIMITER_POLL_INTERVAL = 0.2  # seconds between looks at a full shared limiter
+
+logger = log.get_logger(__name__)
+
+
+class TokenBucket:
+    """
+    Allows rate calls per second on average and bursts of up to capacity
+    calls. Tokens are reserved in arrival order, so waiting callers are served
+    first in, first out without polling.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.__rate = rate
+        self.__capacity = capacity
+        self.__tokens = float(capacity)
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def reserve(self, max_wait: float) -> Any:
+        """
+        Takes a token. Returns the seconds to wait before using it, or None,
+        without taking it, when that is longer than max_wait.
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(
+                self.__capacity, self.__tokens + (now - self.__updated) * self.__rate
+            )
+            self.__updated = now
+            wait = max(0.0, (1 - self.__tokens) / self.__rate)
+            if wait > max_wait:
+                return None
+            self.__tokens -= 1
+            return wait
+
+
+class WaitStats:
+    __slots__ = ("count", "wait_seconds", "max_wait_seconds", "rejected")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.rejected = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "wait_seconds": round(self.wait_seconds, 4),
+            "max_wait_seconds": round(self.max_wait_seconds, 4),
+            "rejected": self.rejected,
+        }
+
+
+class DynamoDbLimitStore:
+    """
+    Keeps the operation slots of each vCenter in a DynamoDB item, as a set of
+    leases. A slot is taken with one conditional update that only adds a
+    lease while the set has room. A lease carries its expiry, so a container
+    killed during an operation does not hold its slot for good: expired
+    leases are removed when the set is found full.
+    """
+
+    def __init__(
+        self,
+        table_name: str = LIMITER_TABLE,
+        lease: float = LIMITER_LEASE,
+        ttl: int = LIMITER_ITEM_TTL,
+    ):
+        self.__table_name = table_name
+        self.__lease = lease
+        self.__ttl = ttl
+
+    def _get_client(self) -> Any:
+        # Cached per container, with a timeout that fits the current deadline
+        return boto.get_client(boto.ClientType.DDB)
+
+    @staticmethod
+    def _key(host_name: str) -> Dict[str, Any]:
+        return {"vcenter": {"S": host_name}}
+
+    def acquire(
+        self, host_name: str, max_operations: int, max_wait: float
+    ) -> Optional[str]:
+        """
+        Takes an operation slot, waiting for at most max_wait seconds. Returns
+        the lease of the slot, or None when none was free in time. Errors of
+        the table are raised.
+        """
+        give_up_at = time.time() + max_wait
+        while True:
+            now = time.time()
+            lease = f"{now + self.__lease:.3f}:{uuid.uuid4().hex}"
+            try:
+                self._get_client().update_item(
+                    TableName=self.__table_name,
+                    Key=self._key(host_name),
+                    UpdateExpression="ADD leases :lease SET expires_at = :expires_at",
+                    ConditionExpression=(
+                        "attribute_not_exists(leases) OR size(leases) < :max"
+                    ),
+                    ExpressionAttributeValues={
+                        ":lease": {"SS": [lease]},
+                        ":max": {"N": str(max_operations)},
+                        ":expires_at": {"N": str(int(now) + self.__ttl)},
+                    },
+                )
+                return lease
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise e
+
+            if self._remove_expired(host_name):
+                continue
+            if time.time() + LIMITER_POLL_INTERVAL > give_up_at:
+                return None
+            time.sleep(LIMITER_POLL_INTERVAL)
+
+    def _remove_expired(self, host_name: str) -> bool:
+        """
+        Removes the expired leases of a full vCenter. Returns whether there
+        were any.
+        """
+        item = (
+            self._get_client()
+            .get_item(
+                TableName=self.__table_name,
+                Key=self._key(host_name),
+                ConsistentRead=True,
+            )
+            .get("Item", {})
+        )
+        now = time.time()
+        expired = [
+            lease
+            for lease in item.get("leases", {}).get("SS", [])
+            if float(lease.split(":")[0]) < now
+        ]
+        if expired:
+            self._delete_leases(host_name, expired)
+        return bool(expired)
+
+    def _delete_leases(self, host_name: str, leases: List[str]) -> None:
+        self._get_client().update_item(
+            TableName=self.__table_name,
+            Key=self._key(host_name),
+            UpdateExpression="DELETE leases :leases",
+            ExpressionAttributeValues={":leases": {"SS": leases}},
+        )
+
+    def release(self, host_name: str, lease: str) -> None:
+        """
+        Gives the slot of the lease back. Failing to is only logged, the lease
+        expires anyway.
+        """
+        try:
+            self._delete_leases(host_name, [lease])
+        except Exception:
+            logger.warning(
+                "Failed to release vCenter operation slot",
+                vcenter=host_name,
+                exc_info=True,
+            )
+
+
+class VcenterLimiter:
+    """
+    Limits the calls made to one vCenter. Time spent waiting for a turn is
+    recorded per kind of call. With a store, whole operations are also limited
+    across containers.
+    """
+
+    def __init__(
+        self,
+        host_name: str,
+        rate: float = VCENTER_CALL_RATE,
+        burst: int = VCENTER_CALL_BURST,
+        max_concurrent: int = VCENTER_MAX_CONCURRENT_CALLS,
+        wait_timeout: float = LIMITER_WAIT_TIMEOUT,
+        store: Optional[DynamoDbLimitStore] = None,
+        max_operations: int = VCENTER_MAX_CONCURRENT_OPERATIONS,
+    ):
+        self.__host_name = host_name
+        self.__store = store
+        self.__max_operations = max_operations
+        self.__bucket = TokenBucket(rate, burst)
+        self.__slots = threading.BoundedSemaphore(max_concurrent)
+        self.__wait_timeout = wait_timeout
+        self.__lock = threading.Lock()
+        self.__stats: Dict[str, WaitStats] = {}
+        self.__in_flight = 0
+
+    @contextmanager
+    def limit(self, kind: str) -> Iterator[None]:
+        """
+        Waits for a free slot and a token, for at most the wait timeout or what
+        is left of the active deadline, and holds the slot while the call runs.
+        """
+        start = time.monotonic()
+        max_wait = deadline.clamp(self.__wait_timeout)
+        if not self.__slots.acquire(timeout=max_wait):
+            self._record(kind, time.monotonic() - start, rejected=True)
+            raise Exception(f"Too many concurrent calls to vCenter {self.__host_name}")
+
+        try:
+            wait = self.__bucket.reserve(
+                max(0.0, max_wait - (time.monotonic() - start))
+            )
+            if wait is None:
+                self._record(kind, time.monotonic() - start, rejected=True)
+                raise Exception(f"Call rate to vCenter {self.__host_name} exceeded")
+            time.sleep(wait)
+            self._record(kind, time.monotonic() - start)
+
+            with self.__lock:
+                self.__in_flight += 1
+            try:
+                yield
+            finally:
+                with self.__lock:
+                    self.__in_flight -= 1
+        finally:
+            self.__slots.release()
+
+    @contextmanager
+    def operation(self, kind: str) -> Iterator[None]:
+        """
+        Holds one of the operation slots shared with other containers while a
+        whole operation runs, waiting for one like limit does. Without a
+        store it does nothing. When the store cannot be reached, the operation
+        goes ahead with a warning rather than failing.
+        """
+        if self.__store is None:
+            yield
+            return
+
+        start = time.monotonic()
+        lease = None
+        try:
+            lease = self.__store.acquire(
+                self.__host_name,
+                self.__max_operations,
+                deadline.clamp(self.__wait_timeout),
+            )
+            if lease is None:
+                self._record(kind, time.monotonic() - start, rejected=True)
+                raise Exception(
+                    f"Too many operations on vCenter {self.__host_name} "
+                    "across invocations"
+                )
+        except (BotoCoreError, ClientError) as e:
+            logger.warning(
+                "vCenter limiter table unavailable, operation not limited",
+                vcenter=self.__host_name,
+                error=str(e),
+            )
+        self._record(kind, time.monotonic() - start)
+
+        try:
+            yield
+        finally:
+            if lease is not None:
+                self.__store.release(self.__host_name, lease)
+
+    def _record(self, kind: str, waited: float, rejected: bool = False) -> None:
+        with self.__lock:
+            stats = self.__stats.setdefault(kind, WaitStats())
+            stats.wait_seconds += waited
+            stats.max_wait_seconds = max(stats.max_wait_seconds, waited)
+            if rejected:
+                stats.rejected += 1
+            else:
+                stats.count += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Queue wait totals per kind of call, and the calls in flight.
+        """
+        with self.__lock:
+            return {
+                "in_flight": self.__in_flight,
+                "calls": {
+                    kind: stats.to_dict() for kind, stats in self.__stats.items()
+                },
+            }
+
+
+_limiters: Dict[str, VcenterLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(host_name: str) -> VcenterLimiter:
+    """
+    The limiter shared by every client of the given vCenter in this process.
+    Its operations are limited across containers when VCENTER_LIMITER_TABLE
+    is set.
+    """
+    with _limiters_lock:
+        if host_name not in _limiters:
+            store = DynamoDbLimitStore() if LIMITER_TABLE else None
+            _limiters[host_name] = VcenterLimiter(host_name, store=store)
+        return _limiters[host_name]
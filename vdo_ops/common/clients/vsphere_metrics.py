@@ -0,0 +1,223 @@
+"""
+Round trip accounting for pyVmomi stubs.
+
+Every managed method call and property read made through an instrumented stub
+is counted per vSphere method name with its latency and payload sizes.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+
+class CallStats:
+    __slots__ = ("count", "seconds", "max_seconds", "request_bytes", "response_bytes")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "seconds": round(self.seconds, 4),
+            "max_seconds": round(self.max_seconds, 4),
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+        }
+
+
+class SoapMetrics:
+    """
+    Collects the calls of every stub instrumented with it, and the high level
+    operations they were made for.
+    """
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__methods: Dict[str, CallStats] = {}
+        self.__operations: Dict[str, CallStats] = {}
+
+    def _current(self) -> Any:
+        return getattr(self.__local, "stats", None)
+
+    @contextmanager
+    def call(self, name: str) -> Iterator[None]:
+        """
+        Times one round trip. Payload bytes seen on this thread while it runs are
+        added to the method. Calls nested in another one, like the method call
+        pyVmomi makes to read a property, are part of the outer call.
+        """
+        if self._current() is not None:
+            yield
+            return
+
+        stats = CallStats()
+        self.__local.stats = stats
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.__local.stats = None
+            with self.__lock:
+                total = self.__methods.setdefault(name, CallStats())
+                total.count += 1
+                total.seconds += elapsed
+                total.max_seconds = max(total.max_seconds, elapsed)
+                total.request_bytes += stats.request_bytes
+                total.response_bytes += stats.response_bytes
+
+    def add_request_bytes(self, size: int) -> None:
+        stats = self._current()
+        if stats is not None:
+            stats.request_bytes += size
+
+    def add_response_bytes(self, size: int) -> None:
+        stats = self._current()
+        if stats is not None:
+            stats.response_bytes += size
+
+    @contextmanager
+    def operation(self, name: str) -> Iterator[Dict[str, Any]]:
+        """
+        Records a high level operation. The yielded dict is filled with the
+        summary of the calls made while the operation ran once it is done.
+        """
+        summary: Dict[str, Any] = {}
+        before = self.snapshot()
+        start = time.perf_counter()
+        try:
+            yield summary
+        finally:
+            elapsed = time.perf_counter() - start
+            calls = _diff(self.snapshot(), before)
+            round_trips = sum(stats["count"] for stats in calls.values())
+            with self.__lock:
+                total = self.__operations.setdefault(name, CallStats())
+                total.count += 1
+                total.seconds += elapsed
+                total.max_seconds = max(total.max_seconds, elapsed)
+            summary.update(
+                {
+                    "operation": name,
+                    "seconds": round(elapsed, 4),
+                    "round_trips": round_trips,
+                    "calls": calls,
+                }
+            )
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Totals per vSphere method name.
+        """
+        with self.__lock:
+            return {name: stats.to_dict() for name, stats in self.__methods.items()}
+
+    def operations(self) -> Dict[str, Dict[str, Any]]:
+        with self.__lock:
+            return {name: stats.to_dict() for name, stats in self.__operations.items()}
+
+    def round_trips(self, name: str = None) -> int:
+        """
+        Number of calls made for the given method name, or for all of them.
+        """
+        with self.__lock:
+            if name is not None:
+                return self.__methods[name].count if name in self.__methods else 0
+            return sum(stats.count for stats in self.__methods.values())
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.__methods.clear()
+            self.__operations.clear()
+
+
+def _diff(
+    after: Dict[str, Dict[str, Any]], before: Dict[str, Dict[str, Any]]
+) -> Dict[str, Dict[str, Any]]:
+    calls = {}
+    for name, stats in after.items():
+        previous = before.get(name, {})
+        count = stats["count"] - previous.get("count", 0)
+        if count:
+            calls[name] = {
+                "count": count,
+                "seconds": round(stats["seconds"] - previous.get("seconds", 0.0), 4),
+                "request_bytes": stats["request_bytes"]
+                - previous.get("request_bytes", 0),
+                "response_bytes": stats["response_bytes"]
+                - previous.get("response_bytes", 0),
+            }
+    return calls
+
+
+def instrument_stub(stub: Any, metrics: SoapMetrics) -> None:
+    """
+    Routes the round trips of a pyVmomi stub through the given metrics. A stub
+    is only wrapped once; instrumenting it again switches its metrics.
+    """
+    already_wrapped = "_soap_metrics" in vars(stub)
+    stub._soap_metrics = metrics
+    if already_wrapped:
+        return
+
+    invoke_method = stub.InvokeMethod
+    invoke_accessor = stub.InvokeAccessor
+
+    def instrumented_invoke_method(mo: Any, info: Any, args: Any, *rest: Any) -> Any:
+        with stub._soap_metrics.call(info.wsdlName):
+            return invoke_method(mo, info, args, *rest)
+
+    def instrumented_invoke_accessor(mo: Any, info: Any) -> Any:
+        with stub._soap_metrics.call(f"{type(mo).__name__}.{info.name}"):
+            return invoke_accessor(mo, info)
+
+    stub.InvokeMethod = instrumented_invoke_method
+    stub.InvokeAccessor = instrumented_invoke_accessor
+
+    # SoapStubAdapter only: count the bytes going over the wire
+    if hasattr(stub, "SerializeRequest"):
+        serialize_request = stub.SerializeRequest
+
+        def instrumented_serialize_request(*args: Any) -> Any:
+            request = serialize_request(*args)
+            stub._soap_metrics.add_request_bytes(len(request))
+            return request
+
+        stub.SerializeRequest = instrumented_serialize_request
+
+    if hasattr(stub, "GetConnection"):
+        get_connection = stub.GetConnection
+
+        def instrumented_get_connection() -> Any:
+            connection = get_connection()
+            _instrument_connection(connection, stub)
+            return connection
+
+        stub.GetConnection = instrumented_get_connection
+
+
+def _instrument_connection(connection: Any, stub: Any) -> None:
+    if vars(connection).get("_soap_metrics_wrapped"):
+        return
+    connection._soap_metrics_wrapped = True
+    get_response = connection.getresponse
+
+    def instrumented_get_response(*args: Any, **kwargs: Any) -> Any:
+        response = get_response(*args, **kwargs)
+        read = response.read
+
+        def instrumented_read(*read_args: Any, **read_kwargs: Any) -> Any:
+            data = read(*read_args, **read_kwargs)
+            stub._soap_metrics.add_response_bytes(len(data))
+            return data
+
+        response.read = instrumented_read
+        return response
+
+    connection.getresponse = instrumented_get_response
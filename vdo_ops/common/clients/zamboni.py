@@ -1,18 +1,168 @@
 """
 https://resources.rackspace.net/docs#section/Getting-started/Quick-start:-CLI-SDK-tools
 """
-from typing import Any, List, Dict, Tuple, Optional
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, List, Dict, Iterable, Iterator, Optional, Tuple
 
 from common import log
 from common.clients.identity import IdentityAccount, IdentitySession
+from common.clients.vm_record import FieldTables, VmRecord
+from common.utils.json_stream import iter_array_items
+from common.vm_inventory import FileInventoryStore, VmInventory
 
 logger = log.get_logger(__name__)
 
+# Query parameters asking Zamboni for the page after the one in a response meta.
+# The token is a page cursor, not a credential.
+NEXT_TOKEN_PARAM = "next_token"  # nosec
+NEXT_PAGE_PARAM = "page"
+
+MAX_IDS_PER_REQUEST = 50  # keeps filter query strings well within URL limits
+MAX_CONCURRENT_REQUESTS = 4
+MAX_CONCURRENT_VCENTERS = int(os.environ.get("ZAMBONI_MAX_CONCURRENT_VCENTERS", "4"))
+PAGES_AHEAD_PER_VCENTER = 2  # pages a vCenter is read ahead of the consumer
+
+STREAM_CHUNK_SIZE = 64 * 1024  # bytes read from a streamed response at a time
+# VM fields kept by stream_vms_by_vcenter; availableField, value and guest are
+# only needed to enrich the VM
+STREAMED_VM_FIELDS = (
+    "id",
+    "name",
+    "location",
+    "provider_account_id",
+    "_rackspace",
+    "_metadata",
+    "config$instanceUuid",
+    "config$uuid",
+    "service_value",
+)
+
+CACHE_TTL = 300  # seconds a cached response is used without asking Zamboni
+CACHE_MAX_BYTES = 32 * 1024 * 1024  # response body bytes kept at most
+
+MODIFIED_SINCE_FILTER = "filters[updated_at][gte]"
+SYNC_OVERLAP = 60  # seconds the next sync goes back, for clock skew with Zamboni
+
+
+def _next_page_params(meta: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    The parameters to get the page after the one described by meta, or None
+    when it was the last one. The token is preferred over the page number.
+    """
+    if meta.get("last_page", True):
+        return None
+    if meta.get("next_token"):
+        return {NEXT_TOKEN_PARAM: meta["next_token"]}
+    if meta.get("next_page"):
+        return {NEXT_PAGE_PARAM: meta["next_page"]}
+    return None
+
+
+def _hyp_device_id(hyp: Dict[str, Any]) -> str:
+    return str((hyp.get("_rackspace") or {}).get("deviceId"))
+
+
+class _CacheEntry:
+    __slots__ = ("content", "etag", "last_modified", "expires_at")
+
+    def __init__(self, content, etag, last_modified, expires_at):
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """
+    Raw Zamboni response bodies kept for ttl seconds, the least recently used
+    dropped once they take more than max_bytes. An expired body is revalidated
+    with its ETag or Last-Modified date when Zamboni sent one.
+    """
+
+    def __init__(self, ttl: float = CACHE_TTL, max_bytes: int = CACHE_MAX_BYTES):
+        self.__ttl = ttl
+        self.__max_bytes = max_bytes
+        self.__lock = threading.Lock()
+        self.__entries = OrderedDict()  # type: OrderedDict[Any, _CacheEntry]
+        self.__bytes = 0
+        self.__counters = {"hits": 0, "misses": 0, "revalidated": 0, "evictions": 0}
+
+    def get(self, key: Any) -> Tuple[Optional[_CacheEntry], bool]:
+        """
+        The entry for the key, if any, and whether it is still fresh.
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.__counters["misses"] += 1
+                return None, False
+            self.__entries.move_to_end(key)
+            fresh = time.monotonic() < entry.expires_at
+            self.__counters["hits" if fresh else "misses"] += 1
+            return entry, fresh
+
+    def put(
+        self,
+        key: Any,
+        content: bytes,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        if len(content) > self.__max_bytes:
+            return
+        entry = _CacheEntry(content, etag, last_modified, time.monotonic() + self.__ttl)
+        with self.__lock:
+            previous = self.__entries.pop(key, None)
+            if previous is not None:
+                self.__bytes -= len(previous.content)
+            self.__entries[key] = entry
+            self.__bytes += len(content)
+            while self.__bytes > self.__max_bytes:
+                _, evicted = self.__entries.popitem(last=False)
+                self.__bytes -= len(evicted.content)
+                self.__counters["evictions"] += 1
+
+    def refresh(self, entry: _CacheEntry) -> None:
+        """
+        Keeps an expired entry for another ttl once Zamboni says it has not
+        changed.
+        """
+        with self.__lock:
+            entry.expires_at = time.monotonic() + self.__ttl
+            self.__counters["revalidated"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self.__lock:
+            return {
+                **self.__counters,
+                "entries": len(self.__entries),
+                "bytes": self.__bytes,
+            }
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
 
 class Zamboni:
-    def __init__(self, endpoint: str, identity_account: IdentityAccount):
+    def __init__(
+        self,
+        endpoint: str,
+        identity_account: IdentityAccount,
+        cache: ResponseCache = None,
+    ):
         self.__endpoint = endpoint
         self.__identity_account = identity_account
+        self.__cache = cache
 
         self.fields = [
             "id",  # This fixes a pagination bug in Zamboni
@@ -42,74 +192,387 @@ class Zamboni:
             ("com.rackspace.goss.vm.services.monitoring", 2),
             ("com.rackspace.goss.vm.services.patching", 4),
         ]
+        self.__service_bits = dict(self.services_list)
 
     def _apply_org_to_metadata(self, vms: List[Dict[str, Any]]) -> None:
         for vm in vms:
             vm["_metadata"]["orgId"] = vm.get("provider_account_id", None)
 
-    def _apply_service_value(self, vms: List[Dict[str, Any]]) -> None:
+    def _apply_service_value(
+        self,
+        vms: List[Dict[str, Any]],
+        service_keys_by_location: Dict[Any, Dict[Any, int]] = None,
+    ) -> None:
+        """
+        Sets the GOSS service value of every VM with one pass over its custom
+        attribute values. Custom field definitions are shared by the VMs of a
+        vCenter, so the service field keys are looked up once per vCenter, and
+        kept in service_keys_by_location when it is given. They are only kept
+        once a VM of the vCenter lists its custom fields; until then they are
+        looked up per VM.
+        """
+        if service_keys_by_location is None:
+            service_keys_by_location = {}
         for vm in vms:
-            result = (
-                self._enrolled_in_goss_service(vm, self.services_list[0])
-                | self._enrolled_in_goss_service(vm, self.services_list[1])
-                | self._enrolled_in_goss_service(vm, self.services_list[2])
-            )
-            vm["service_value"] = result
-
-    def _enrolled_in_goss_service(
-        self, vm: Dict[str, Any], service: Tuple[str, int]
-    ) -> int:
-        if self._get_custom_attribute_value(vm, service[0]) == "enrolled":
-            return service[1]
-        return 0
-
-    def _get_custom_attribute_value(self, vm: Dict[str, Any], definition: str) -> Any:
-        result = None
-        attr = next(
-            (
-                field
-                for field in vm.get("availableField", [])
-                if field.get("name", None) == definition
-            ),
-            None,
-        )
-        if attr:
-            result = next(  # type: ignore
-                (
-                    val
-                    for val in vm.get("value", [])
-                    if val.get("key", None) == attr.get("key", None)
-                ),
-                {},
-            ).get("value", None)
+            location = vm.get("location", None)
+            service_keys = service_keys_by_location.get(location)
+            if service_keys is None:
+                service_keys = self._get_service_keys(vm)
+                if vm.get("availableField"):
+                    service_keys_by_location[location] = service_keys
+            vm["service_value"] = self._get_service_value(vm, service_keys)
+
+    def _get_service_keys(self, vm: Dict[str, Any]) -> Dict[Any, int]:
+        """
+        Maps the keys of the GOSS service custom fields to the service bits.
+        The first field with a service name is used, like vCenter does.
+        """
+        service_keys = {}  # type: Dict[Any, int]
+        found = set()
+        for field in vm.get("availableField", []):
+            name = field.get("name", None)
+            if name in self.__service_bits and name not in found:
+                found.add(name)
+                service_keys[field.get("key", None)] = self.__service_bits[name]
+        return service_keys
+
+    @staticmethod
+    def _get_service_value(vm: Dict[str, Any], service_keys: Dict[Any, int]) -> int:
+        result = 0
+        for val in vm.get("value", []):
+            if val.get("value", None) == "enrolled":
+                result |= service_keys.get(val.get("key", None), 0)
         return result
 
     def get_vms_by_vcenter(self, vcenter: str) -> Optional[List[Dict[str, Any]]]:
         """
         https://resources.rackspace.net/docs#tag/rpcv/paths/~1rpcv~1vsphere~1virtual_machines/get
 
+        Every page is read into one list; use get_vm_pages_by_vcenter to go
+        through a big vCenter without holding all of its VMs.
+
+        :param vcenter:
+        :return:
+        """
+        pages = list(self.get_vm_pages_by_vcenter(vcenter))
+        if not pages:
+            return None
+        return [vm for page in pages for vm in page]
+
+    def get_vm_pages_by_vcenter(self, vcenter: str) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Yields the VMs of the vCenter one page at a time, with their GOSS
+        service values and org ID applied. The next page is fetched in the
+        background while the current one is being used, so at most two pages
+        are held at once. Nothing is yielded when Zamboni does not know the
+        vCenter.
+
+        :param vcenter:
+        :return:
+        """
+        params = {"filters[location]": vcenter, "fields": ",".join(self.fields)}
+
+        with IdentitySession(self.__identity_account) as session, ThreadPoolExecutor(
+            max_workers=1
+        ) as executor:
+            body = self._get_vm_page(session, params)
+            while body is not None:
+                next_params = _next_page_params(body.get("meta", {}))
+                next_page = None
+                if next_params is not None:
+                    # Copied context so the fetch keeps the request deadline
+                    next_page = executor.submit(
+                        contextvars.copy_context().run,
+                        self._get_vm_page,
+                        session,
+                        {**params, **next_params},
+                    )
+
+                # Get the data
+                data = body.get("data", [])  # type: List[Dict[str, Any]]
+
+                # Apply the GOSS service values
+                self._apply_service_value(data)
+
+                # Apply the org ID to metadata
+                self._apply_org_to_metadata(data)
+
+                yield data
+                if next_page is None:
+                    return
+                body = next_page.result()
+                if body is None:
+                    raise Exception(
+                        f"Page of the VMs of {vcenter} not found: {next_params}"
+                    )
+
+    def get_vms_by_vcenters(
+        self, vcenters: Iterable[str], max_concurrency: int = MAX_CONCURRENT_VCENTERS
+    ) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        Yields the VM pages of many vCenters as (vcenter, page) in the order
+        they arrive. Up to max_concurrency vCenters are paged at once, so a
+        slow vCenter only holds up its own pages. Pages are read a little
+        ahead of the consumer, not without bound. The first error of any
+        vCenter is raised, and the other vCenters are then no longer read.
+
+        :param vcenters:
+        :param max_concurrency:
+        :return:
+        """
+        vcenters = list(dict.fromkeys(vcenters))
+        if not vcenters:
+            return
+        workers = min(max_concurrency, len(vcenters))
+        pages = queue.Queue(maxsize=workers * PAGES_AHEAD_PER_VCENTER)
+        stop = threading.Event()
+
+        def put(item: Tuple[str, Any]) -> bool:
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def collect(vcenter: str) -> None:
+            if stop.is_set():
+                return
+            vcenter_pages = self.get_vm_pages_by_vcenter(vcenter)
+            try:
+                for page in vcenter_pages:
+                    if not put((vcenter, page)):
+                        return
+            except Exception as e:
+                put((vcenter, e))
+                return
+            finally:
+                vcenter_pages.close()
+            # None marks the end of the vCenter
+            put((vcenter, None))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                for vcenter in vcenters:
+                    executor.submit(contextvars.copy_context().run, collect, vcenter)
+                remaining = len(vcenters)
+                while remaining:
+                    vcenter, page = pages.get()
+                    if page is None:
+                        remaining -= 1
+                    elif isinstance(page, Exception):
+                        raise page
+                    else:
+                        yield vcenter, page
+            finally:
+                stop.set()
+
+    def stream_vms_by_vcenter(
+        self, vcenter: str, keep_fields: Optional[Iterable[str]] = STREAMED_VM_FIELDS
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the VMs of the vCenter one at a time, decoded while each page
+        is being received, so memory does not grow with the page size. Every VM
+        is enriched and then cut down to keep_fields, or kept whole when it is
+        None. Responses are not cached.
+
+        :param vcenter:
+        :param keep_fields:
+        :return:
+        """
+        keep_fields = None if keep_fields is None else tuple(keep_fields)
+        service_keys_by_location = {}  # type: Dict[Any, Dict[Any, int]]
+
+        for vm in self._stream_vms(vcenter):
+            self._apply_service_value([vm], service_keys_by_location)
+            self._apply_org_to_metadata([vm])
+            if keep_fields is not None:
+                vm = {key: vm[key] for key in keep_fields if key in vm}
+            yield vm
+
+    def stream_vm_records_by_vcenter(self, vcenter: str) -> Iterator[VmRecord]:
+        """
+        Yields the VMs of the vCenter as enriched VmRecords, streamed like
+        stream_vms_by_vcenter. The records of a vCenter share one table of its
+        custom field definitions.
+
+        :param vcenter:
+        :return:
+        """
+        tables = FieldTables()
+        for vm in self._stream_vms(vcenter):
+            yield self._enrich_record(VmRecord.from_dict(vm, tables))
+
+    def _enrich_record(self, record: VmRecord) -> VmRecord:
+        service_value = 0
+        if record.fields is not None:
+            service_keys = record.fields.service_keys(self.services_list)
+            for key, bit in service_keys.items():
+                if record.values.get(key, None) == "enrolled":
+                    service_value |= bit
+        record.service_value = service_value
+        record.org_id = record.provider_account_id
+        return record
+
+    def _stream_vms(self, vcenter: str) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the VMs of every page as they are decoded, as Zamboni sends them.
+        """
+        url = f"{self.__endpoint}/rpcv/vsphere/virtual_machines"
+        params = {"filters[location]": vcenter, "fields": ",".join(self.fields)}
+
+        with IdentitySession(self.__identity_account) as session:
+            page_params = {}  # type: Optional[Dict[str, Any]]
+            while page_params is not None:
+                response = session.get(
+                    url, params={**params, **page_params}, stream=True
+                )
+                try:
+                    if response.status_code == 404:
+                        if page_params:
+                            raise Exception(
+                                f"Page of the VMs of {vcenter} not found: "
+                                f"{page_params}"
+                            )
+                        return
+                    response.raise_for_status()
+
+                    top_level = {}  # type: Dict[str, Any]
+                    yield from iter_array_items(
+                        response.iter_content(STREAM_CHUNK_SIZE), "data", top_level
+                    )
+                finally:
+                    response.close()
+                page_params = _next_page_params(top_level.get("meta", {}))
+
+    def sync_vms(
+        self, vcenter: str, since: Any = None, store: Any = None
+    ) -> VmInventory:
+        """
+        Brings the stored inventory of the vCenter up to date and saves it.
+        Only the VMs changed since the watermark, since when it is given, are
+        read, along with the IDs of every VM to find the removed ones. Every VM
+        is listed when there is no stored inventory or watermark.
+
         :param vcenter:
+        :param since: datetime or ISO 8601 time overriding the stored watermark
+        :param store: where inventories are kept, FileInventoryStore by default
         :return:
         """
+        store = store if store is not None else FileInventoryStore()
+        inventory = store.load(vcenter)
+        if isinstance(since, datetime):
+            since = since.isoformat()
+        if since is None and inventory is not None:
+            since = inventory.watermark
+        started = datetime.now(timezone.utc)
+
+        path = "rpcv/vsphere/virtual_machines"
+        params = {"filters[location]": vcenter, "fields": ",".join(self.fields)}
         with IdentitySession(self.__identity_account) as session:
-            response = session.get(
-                f"{self.__endpoint}/rpcv/vsphere/virtual_machines",
-                params={"filters[location]": vcenter, "fields": ",".join(self.fields)},
-            )
+            if inventory is None or since is None:
+                vms = self._get_all_pages(session, path, params)
+                self._apply_service_value(vms)
+                self._apply_org_to_metadata(vms)
+                inventory = inventory or VmInventory(vcenter)
+                changes = inventory.replace(vms)
+            else:
+                # Listed before the changes, so a VM added in between is kept
+                present = self._get_all_pages(
+                    session, path, {"filters[location]": vcenter, "fields": "id"}
+                )
+                changed = self._get_all_pages(
+                    session, path, {**params, MODIFIED_SINCE_FILTER: since}
+                )
+                if len(present) > 1 and len(changed) >= len(present):
+                    # Every VM changing at once is more likely a filter Zamboni
+                    # ignored, which would make each sync a full listing
+                    logger.warning(
+                        "Every VM reported changed, modified since filter may "
+                        "be ignored",
+                        vcenter=vcenter,
+                        since=since,
+                        vms=len(present),
+                    )
+                self._apply_service_value(changed)
+                self._apply_org_to_metadata(changed)
+                changes = inventory.merge(changed, (vm["id"] for vm in present))
+
+        inventory.watermark = (started - timedelta(seconds=SYNC_OVERLAP)).isoformat()
+        store.save(inventory)
+        logger.info(
+            "VM inventory synced",
+            vcenter=vcenter,
+            since=since,
+            vms=len(inventory.vms),
+            **changes,
+        )
+        return inventory
+
+    def _get_vm_page(
+        self, session: IdentitySession, params: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        return self._get_page(session, "rpcv/vsphere/virtual_machines", params)
 
+    def _get_page(
+        self, session: IdentitySession, path: str, params: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        url = f"{self.__endpoint}/{path}"
+        if self.__cache is None:
+            response = session.get(url, params=params)
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            return response.json()
+
+        key = (url, tuple(sorted(params.items())))
+        # Bodies are decoded on every hit, so callers never share them
+        entry, fresh = self.__cache.get(key)
+        if fresh:
+            return json.loads(entry.content)
+
+        headers = {}
+        if entry is not None and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        if headers:
+            response = session.get(url, params=params, headers=headers)
+        else:
+            response = session.get(url, params=params)
+
+        if response.status_code == 304 and entry is not None:
+            self.__cache.refresh(entry)
+            return json.loads(entry.content)
         if response.status_code == 404:
             return None
         response.raise_for_status()
 
-        # Get the data
-        data = response.json().get("data", [])  # type: List[Dict[str, Any]]
-
-        # Apply the GOSS service values
-        self._apply_service_value(data)
-
-        # Apply the org ID to metadata
-        self._apply_org_to_metadata(data)
+        self.__cache.put(
+            key,
+            response.content,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+        return json.loads(response.content)
 
+    def _get_all_pages(
+        self, session: IdentitySession, path: str, params: Dict[str, Any]
+    ) -> List[Dict[str, Any]]:
+        """
+        The data of every page of a listing, or an empty list on a 404.
+        """
+        data = []  # type: List[Dict[str, Any]]
+        body = self._get_page(session, path, params)
+        while body is not None:
+            data.extend(body.get("data", []))
+            next_params = _next_page_params(body.get("meta", {}))
+            if next_params is None:
+                break
+            body = self._get_page(session, path, {**params, **next_params})
+            if body is None:
+                raise Exception(f"Page of {path} not found: {next_params}")
         return data
 
     def get_hyps_by_device_id(self, device_id: str) -> Optional[List[Dict[str, Any]]]:
@@ -119,20 +582,20 @@ class Zamboni:
         (It is likely that they are the only ones with a device ID)
         """
         with IdentitySession(self.__identity_account) as session:
-            response = session.get(
-                f"{self.__endpoint}/managedvirt/vsphere/host_systems",
-                params={
+            body = self._get_page(
+                session,
+                "managedvirt/vsphere/host_systems",
+                {
                     "filters[body._rackspace.deviceId]": device_id,
                     "fields": ",".join(self.host_fields),
                 },
             )
 
-        if response.status_code == 404:
+        if body is None:
             return None
-        response.raise_for_status()
 
         # Get the data
-        data = response.json().get("data", [])  # type: List[Dict[str, Any]]
+        data = body.get("data", [])  # type: List[Dict[str, Any]]
 
         if len(data) == 1:
             return data[0]
@@ -142,3 +605,93 @@ class Zamboni:
             )
         else:
             return None
+
+    def get_hyps_by_device_ids(
+        self, device_ids: Iterable[str]
+    ) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Resolves many hypervisors at once, with one request per chunk of
+        MAX_IDS_PER_REQUEST device IDs and the chunks fetched concurrently.
+
+        A chunk is asked for with its IDs comma-joined in the device ID filter,
+        assuming Zamboni matches the filter against a list of values. Should
+        it ignore the filter instead, the chunk gets hypervisors of other
+        device IDs, and its IDs are then looked up one at a time, also
+        concurrently.
+
+        :param device_ids:
+        :return: every given device ID, as a string, to its hypervisor, or None
+            when Zamboni has none
+        """
+        unique_ids = list(dict.fromkeys(str(device_id) for device_id in device_ids))
+        hyps = {
+            device_id: None for device_id in unique_ids
+        }  # type: Dict[str, Optional[Dict[str, Any]]]
+        chunks = []
+        for start in range(0, len(unique_ids), MAX_IDS_PER_REQUEST):
+            end = start + MAX_IDS_PER_REQUEST
+            chunks.append(unique_ids[start:end])
+
+        found = []  # type: List[Dict[str, Any]]
+        unfiltered = []  # type: List[List[str]]
+        for chunk, chunk_hyps in zip(chunks, self._get_hyps_chunks(chunks)):
+            if len(chunk) > 1 and any(
+                _hyp_device_id(hyp) not in chunk for hyp in chunk_hyps
+            ):
+                unfiltered.extend([device_id] for device_id in chunk)
+            else:
+                found.extend(chunk_hyps)
+        if unfiltered:
+            logger.warning(
+                "Zamboni ignored the device ID filter, looking hypervisors up "
+                "one at a time",
+                device_ids=len(unfiltered),
+            )
+            for chunk_hyps in self._get_hyps_chunks(unfiltered):
+                found.extend(chunk_hyps)
+
+        for hyp in found:
+            device_id = _hyp_device_id(hyp)
+            if device_id not in hyps:
+                continue
+            if hyps[device_id] is not None:
+                raise Exception(
+                    f"More than one Hypervisor with device ID {device_id} found"
+                )
+            hyps[device_id] = hyp
+
+        return hyps
+
+    def _get_hyps_chunks(self, chunks: List[List[str]]) -> List[List[Dict[str, Any]]]:
+        """
+        The hypervisors of every chunk of device IDs, fetched concurrently.
+        """
+        if not chunks:
+            return []
+        with ThreadPoolExecutor(
+            max_workers=min(MAX_CONCURRENT_REQUESTS, len(chunks))
+        ) as executor:
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run, self._get_hyps_chunk, chunk
+                )
+                for chunk in chunks
+            ]
+            return [future.result() for future in futures]
+
+    def _get_hyps_chunk(self, device_ids: List[str]) -> List[Dict[str, Any]]:
+        # A session per chunk, requests sessions are not shared across threads
+        with IdentitySession(self.__identity_account) as session:
+            return self._get_hyps_page(session, ",".join(device_ids))
+
+    def _get_hyps_page(
+        self, session: IdentitySession, device_id_filter: str
+    ) -> List[Dict[str, Any]]:
+        return self._get_all_pages(
+            session,
+            "managedvirt/vsphere/host_systems",
+            {
+                "filters[body._rackspace.deviceId]": device_id_filter,
+                "fields": ",".join(self.host_fields),
+            },
+        )
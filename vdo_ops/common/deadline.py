@@ -0,0 +1,110 @@
+"""
+Request scoped time budget. A Lambda handler activates a deadline built from
+the time the invocation has left, and the vSphere, HTTP and AWS calls made
+while it is active get what is left of it as their timeout. A call is not
+started when too little time remains, so work stops between two calls instead
+of being killed in the middle of one.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+DEFAULT_TIMEOUT = 15  # seconds per call when no deadline is active
+SAFETY_MARGIN = 3  # seconds kept to log, save progress and return
+MIN_CALL_TIME = 1  # seconds a call needs at least to be worth starting
+
+_current: contextvars.ContextVar = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds: float, margin: float = SAFETY_MARGIN):
+        self.__expires_at = time.monotonic() + seconds - margin
+
+    @classmethod
+    def from_lambda_context(
+        cls, context: Any, margin: float = SAFETY_MARGIN
+    ) -> "Deadline":
+        return cls(context.get_remaining_time_in_millis() / 1000, margin)
+
+    def remaining(self) -> float:
+        return max(0.0, self.__expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() < MIN_CALL_TIME
+
+    def check(self, action: str = "continue") -> None:
+        """
+        Raises DeadlineExceeded when there is not enough time left for action.
+        """
+        if self.expired:
+            raise DeadlineExceeded(f"Not enough time left to {action}")
+
+    @contextmanager
+    def activate(self) -> Iterator["Deadline"]:
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+
+def current() -> Optional[Deadline]:
+    return _current.get()
+
+
+@contextmanager
+def lambda_deadline(context: Any) -> Iterator[Optional[Deadline]]:
+    """
+    Activates the deadline of a Lambda invocation. Without a context, when the
+    handler runs locally, no deadline is set.
+    """
+    if context is None:
+        yield None
+        return
+    with Deadline.from_lambda_context(context).activate() as deadline:
+        yield deadline
+
+
+@contextmanager
+def grace_period() -> Iterator[Deadline]:
+    """
+    Activates a short deadline of its own, taken from the time SAFETY_MARGIN
+    keeps, to save progress once the active deadline is spent.
+    """
+    with Deadline(SAFETY_MARGIN - MIN_CALL_TIME, margin=0).activate() as grace:
+        yield grace
+
+
+def check(action: str = "continue") -> None:
+    deadline = current()
+    if deadline is not None:
+        deadline.check(action)
+
+
+def timeout(default: float = DEFAULT_TIMEOUT) -> float:
+    """
+    Timeout for the next call: the time left of the active deadline, or the
+    default when there is none.
+    """
+    deadline = current()
+    if deadline is None:
+        return default
+    deadline.check("start a call")
+    return deadline.remaining()
+
+
+def clamp(seconds: float) -> float:
+    """
+    Shortens a timeout to the time left of the active deadline.
+    """
+    deadline = current()
+    if deadline is None:
+        return seconds
+    deadline.check("start a call")
+    return min(seconds, deadline.remaining())
@@ -0,0 +1,186 @@
+"""
+Progress checkpoints of network copies. A copy that is retried after a timeout
+resumes from its checkpoint and only applies what is left.
+"""
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Iterable, List, Optional, Set
+
+from common import log
+from common.clients import boto
+from common.network_plan import (
+    NetworkCopyPlan,
+    PortgroupChange,
+    SkippedPortgroup,
+    SkipReason,
+    VswitchChange,
+)
+
+STAGE = os.environ.get("STAGE", "dev")
+CHECKPOINT_TABLE = os.environ.get(
+    "NETWORK_COPY_CHECKPOINT_TABLE", f"{STAGE}-vdo-ops-network-copy-checkpoints"
+)
+CHECKPOINT_TTL = 24 * 60 * 60  # seconds before an abandoned checkpoint expires
+
+logger = log.get_logger(__name__)
+
+
+@dataclass
+class NetworkCopyCheckpoint:
+    """
+    The names in a network copy plan and the ones already applied. Specs are
+    left out; they are read again from the source host on resume.
+    """
+
+    source_host: str
+    destination_host: str
+    vswitches: List[str] = field(default_factory=list)
+    portgroups: List[List[str]] = field(default_factory=list)
+    skipped: List[List[str]] = field(default_factory=list)
+    applied_vswitches: Set[str] = field(default_factory=set)
+    applied_portgroups: Set[str] = field(default_factory=set)
+
+    @classmethod
+    def from_plan(cls, plan: NetworkCopyPlan) -> "NetworkCopyCheckpoint":
+        return cls(
+            plan.source_host,
+            plan.destination_host,
+            vswitches=[change.name for change in plan.vswitches_to_add],
+            portgroups=[
+                [change.name, change.vswitch_name] for change in plan.portgroups_to_add
+            ],
+            skipped=[
+                [skipped.name, skipped.reason.value]
+                for skipped in plan.portgroups_skipped
+            ],
+        )
+
+    def to_plan(self, source: Any) -> Optional[NetworkCopyPlan]:
+        """
+        Rebuilds the full plan with the specs of the source host snapshot, or
+        None when the source no longer has everything the plan copies.
+        """
+        vswitch_specs = {vswitch.name: vswitch.spec for vswitch in source.vswitches}
+        portgroup_specs = {
+            portgroup.spec.name: portgroup.spec for portgroup in source.portgroups
+        }
+        if not (
+            vswitch_specs.keys() >= set(self.vswitches)
+            and portgroup_specs.keys() >= {name for name, _ in self.portgroups}
+        ):
+            return None
+
+        return NetworkCopyPlan(
+            self.source_host,
+            self.destination_host,
+            vswitches_to_add=[
+                VswitchChange(name, vswitch_specs[name]) for name in self.vswitches
+            ],
+            portgroups_to_add=[
+                PortgroupChange(name, vswitch_name, portgroup_specs[name])
+                for name, vswitch_name in self.portgroups
+            ],
+            portgroups_skipped=[
+                SkippedPortgroup(name, SkipReason(reason))
+                for name, reason in self.skipped
+            ],
+        )
+
+    def remaining(self, plan: NetworkCopyPlan) -> NetworkCopyPlan:
+        """
+        The part of the plan that is not applied yet.
+        """
+        return NetworkCopyPlan(
+            plan.source_host,
+            plan.destination_host,
+            vswitches_to_add=[
+                change
+                for change in plan.vswitches_to_add
+                if change.name not in self.applied_vswitches
+            ],
+            portgroups_to_add=[
+                change
+                for change in plan.portgroups_to_add
+                if change.name not in self.applied_portgroups
+            ],
+            portgroups_skipped=plan.portgroups_skipped,
+        )
+
+    def mark_applied(
+        self, vswitch_names: Iterable[str], portgroup_names: Iterable[str]
+    ) -> None:
+        self.applied_vswitches.update(vswitch_names)
+        self.applied_portgroups.update(portgroup_names)
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "source_host": self.source_host,
+                "destination_host": self.destination_host,
+                "vswitches": self.vswitches,
+                "portgroups": self.portgroups,
+                "skipped": self.skipped,
+                "applied_vswitches": sorted(self.applied_vswitches),
+                "applied_portgroups": sorted(self.applied_portgroups),
+            },
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def from_json(cls, data: str) -> "NetworkCopyCheckpoint":
+        values = json.loads(data)
+        values["applied_vswitches"] = set(values["applied_vswitches"])
+        values["applied_portgroups"] = set(values["applied_portgroups"])
+        return cls(**values)
+
+
+def _checkpoint_key(source_host: str, destination_host: str) -> str:
+    return f"{source_host}/{destination_host}"
+
+
+class DynamoDbCheckpointStore:
+    """
+    Keeps one checkpoint per source and destination host pair in a DynamoDB
+    table. Items expire through the table TTL once the copy is abandoned.
+    """
+
+    def __init__(self, table_name: str = CHECKPOINT_TABLE, ttl: int = CHECKPOINT_TTL):
+        self.__table_name = table_name
+        self.__ttl = ttl
+
+    def _get_client(self) -> Any:
+        # Cached per container, with a timeout that fits the current deadline
+        return boto.get_client(boto.ClientType.DDB)
+
+    def load(
+        self, source_host: str, destination_host: str
+    ) -> Optional[NetworkCopyCheckpoint]:
+        response = self._get_client().get_item(
+            TableName=self.__table_name,
+            Key={"copy_key": {"S": _checkpoint_key(source_host, destination_host)}},
+            ConsistentRead=True,
+        )
+        item = response.get("Item")
+        if item is None:
+            return None
+        return NetworkCopyCheckpoint.from_json(item["checkpoint"]["S"])
+
+    def save(self, checkpoint: NetworkCopyCheckpoint) -> None:
+        key = _checkpoint_key(checkpoint.source_host, checkpoint.destination_host)
+        logger.debug("Saving network copy checkpoint", copy_key=key)
+        self._get_client().put_item(
+            TableName=self.__table_name,
+            Item={
+                "copy_key": {"S": key},
+                "checkpoint": {"S": checkpoint.to_json()},
+                "expires_at": {"N": str(int(time.time()) + self.__ttl)},
+            },
+        )
+
+    def delete(self, source_host: str, destination_host: str) -> None:
+        self._get_client().delete_item(
+            TableName=self.__table_name,
+            Key={"copy_key": {"S": _checkpoint_key(source_host, destination_host)}},
+        )
@@ -0,0 +1,285 @@
+from dataclasses import dataclass, field
+from enum import Enum, unique
+from typing import Any, Dict, List, Optional
+
+
+@unique
+class SkipReason(Enum):
+    DO_NOT_COPY = "do_not_copy"
+    ALREADY_EXISTS = "already_exists"
+    UPLINK = "uplink"
+
+
+@dataclass(frozen=True)
+class VswitchChange:
+    name: str
+    spec: Any
+
+
+@dataclass(frozen=True)
+class PortgroupChange:
+    name: str
+    vswitch_name: str
+    spec: Any
+
+
+@dataclass(frozen=True)
+class SkippedPortgroup:
+    name: str
+    reason: SkipReason
+
+
+@dataclass
+class NetworkCopyPlan:
+    """
+    Ordered list of the changes needed to copy the networks of the source host
+    to the destination host. Virtual switches come before the port groups that
+    are placed on them.
+    """
+
+    source_host: str
+    destination_host: str
+    vswitches_to_add: List[VswitchChange] = field(default_factory=list)
+    portgroups_to_add: List[PortgroupChange] = field(default_factory=list)
+    portgroups_skipped: List[SkippedPortgroup] = field(default_factory=list)
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.vswitches_to_add and not self.portgroups_to_add
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Summary of the plan without the vSphere specs, fit for a JSON response.
+        """
+        return {
+            "source_host": self.source_host,
+            "destination_host": self.destination_host,
+            "vswitches_to_add": [change.name for change in self.vswitches_to_add],
+            "portgroups_to_add": [
+                {"name": change.name, "vswitch_name": change.vswitch_name}
+                for change in self.portgroups_to_add
+            ],
+            "portgroups_skipped": [
+                {"name": skipped.name, "reason": skipped.reason.value}
+                for skipped in self.portgroups_skipped
+            ],
+        }
+
+
+@dataclass(frozen=True)
+class DvsPortgroupChange:
+    name: str
+    config: Any
+    # Configuration of the destination port group, when it is reconfigured
+    current_config: Any = None
+
+
+@dataclass
+class DvsPortgroupCopyPlan:
+    """
+    Port groups to create or reconfigure on the destination distributed virtual
+    switch so it carries the port groups of the source switch.
+    """
+
+    source_switch: str
+    destination_switch: str
+    portgroups_to_create: List[DvsPortgroupChange] = field(default_factory=list)
+    portgroups_to_reconfigure: List[DvsPortgroupChange] = field(default_factory=list)
+    portgroups_skipped: List[SkippedPortgroup] = field(default_factory=list)
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.portgroups_to_create and not self.portgroups_to_reconfigure
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "source_switch": self.source_switch,
+            "destination_switch": self.destination_switch,
+            "portgroups_to_create": [
+                change.name for change in self.portgroups_to_create
+            ],
+            "portgroups_to_reconfigure": [
+                change.name for change in self.portgroups_to_reconfigure
+            ],
+            "portgroups_skipped": [
+                {"name": skipped.name, "reason": skipped.reason.value}
+                for skipped in self.portgroups_skipped
+            ],
+        }
+
+
+@dataclass
+class NetworkCopyResult:
+    """
+    Outcome of a network copy to one destination host.
+    """
+
+    host_name: str
+    plan: Optional[NetworkCopyPlan] = None
+    error: Optional[str] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "host_name": self.host_name,
+            "succeeded": self.succeeded,
+            "plan": self.plan.to_dict() if self.plan is not None else None,
+            "error": self.error,
+        }
+
+
+@dataclass
+class NetworkDrift:
+    """
+    Differences between the networks of a host and those of a reference host.
+    Port groups used by virtual nics are host specific and never reported.
+    """
+
+    host_name: str
+    missing_vswitches: List[str] = field(default_factory=list)
+    extra_vswitches: List[str] = field(default_factory=list)
+    missing_portgroups: List[str] = field(default_factory=list)
+    extra_portgroups: List[str] = field(default_factory=list)
+
+    @property
+    def conformant(self) -> bool:
+        return not (
+            self.missing_vswitches
+            or self.extra_vswitches
+            or self.missing_portgroups
+            or self.extra_portgroups
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "host_name": self.host_name,
+            "conformant": self.conformant,
+            "missing_vswitches": self.missing_vswitches,
+            "extra_vswitches": self.extra_vswitches,
+            "missing_portgroups": self.missing_portgroups,
+            "extra_portgroups": self.extra_portgroups,
+        }
+
+
+def diff_networks(reference: Any, host: Any) -> NetworkDrift:
+    """
+    Compares the snapshot of a host against the snapshot of a reference host.
+
+    :param reference:
+    :param host:
+    :return:
+    """
+    reference_portgroups = reference.portgroup_names - reference.do_not_copy_names
+    host_portgroups = host.portgroup_names - host.do_not_copy_names
+
+    return NetworkDrift(
+        host.host_name,
+        missing_vswitches=sorted(reference.vswitch_names - host.vswitch_names),
+        extra_vswitches=sorted(host.vswitch_names - reference.vswitch_names),
+        missing_portgroups=sorted(reference_portgroups - host.portgroup_names),
+        extra_portgroups=sorted(host_portgroups - reference.portgroup_names),
+    )
+
+
+def _vswitch_name(portgroup: Any) -> Any:
+    # The key of the switch, e.g. key-vim.host.VirtualSwitch-vSwitch0
+    if portgroup.vswitch is None:
+        return None
+    return portgroup.vswitch.split("-")[2]
+
+
+def plan_network_copy(source: Any, destination: Any) -> NetworkCopyPlan:
+    """
+    Computes what the destination host is missing from the source host.
+
+    Both arguments are HostNetworkSnapshot instances. Every lookup is a hash set
+    check, so planning is linear in the number of switches and port groups.
+
+    :param source:
+    :param destination:
+    :return:
+    """
+    plan = NetworkCopyPlan(source.host_name, destination.host_name)
+
+    portgroups_by_vswitch: Dict[str, List[Any]] = {}
+    for portgroup in source.portgroups:
+        portgroups_by_vswitch.setdefault(_vswitch_name(portgroup), []).append(portgroup)
+
+    for vswitch in source.vswitches:
+        if not destination.has_virtual_switch(vswitch.name):
+            plan.vswitches_to_add.append(VswitchChange(vswitch.name, vswitch.spec))
+
+        for portgroup in portgroups_by_vswitch.get(vswitch.name, []):
+            name = portgroup.spec.name
+
+            if source.is_in_do_not_copy_list(name):
+                plan.portgroups_skipped.append(
+                    SkippedPortgroup(name, SkipReason.DO_NOT_COPY)
+                )
+            elif destination.has_portgroup(name):
+                plan.portgroups_skipped.append(
+                    SkippedPortgroup(name, SkipReason.ALREADY_EXISTS)
+                )
+            else:
+                plan.portgroups_to_add.append(
+                    PortgroupChange(name, vswitch.name, portgroup.spec)
+                )
+
+    return plan
+
+
+def _vlan_settings(vlan: Any) -> Any:
+    if vlan is None:
+        return None
+    vlan_id = getattr(vlan, "vlanId", None)
+    if isinstance(vlan_id, list):
+        # Trunk ranges
+        vlan_id = tuple((vlan_range.start, vlan_range.end) for vlan_range in vlan_id)
+    return type(vlan).__name__, vlan_id, getattr(vlan, "pvlanId", None)
+
+
+def _dvs_portgroup_settings(config: Any) -> Any:
+    port_config = config.defaultPortConfig
+    vlan = port_config.vlan if port_config is not None else None
+    return config.type, _vlan_settings(vlan)
+
+
+def plan_dvs_portgroup_copy(
+    source_switch: str,
+    destination_switch: str,
+    source: Dict[str, Any],
+    destination: Dict[str, Any],
+) -> DvsPortgroupCopyPlan:
+    """
+    Computes the port groups to create on the destination switch, and the ones
+    to reconfigure because their binding type or VLAN differs. Uplink port
+    groups belong to their switch and are never copied.
+
+    :param source_switch:
+    :param destination_switch:
+    :param source: port group name to configuration of the source switch
+    :param destination: port group name to configuration of the destination
+    :return:
+    """
+    plan = DvsPortgroupCopyPlan(source_switch, destination_switch)
+
+    for name, config in sorted(source.items()):
+        current_config = destination.get(name)
+
+        if getattr(config, "uplink", False):
+            plan.portgroups_skipped.append(SkippedPortgroup(name, SkipReason.UPLINK))
+        elif current_config is None:
+            plan.portgroups_to_create.append(DvsPortgroupChange(name, config))
+        elif _dvs_portgroup_settings(config) == _dvs_portgroup_settings(current_config):
+            plan.portgroups_skipped.append(
+                SkippedPortgroup(name, SkipReason.ALREADY_EXISTS)
+            )
+        else:
+            plan.portgroups_to_reconfigure.append(
+                DvsPortgroupChange(name, config, current_config)
+            )
+
+    return plan
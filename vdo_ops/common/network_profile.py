@@ -0,0 +1,229 @@
+"""
+Golden network profiles. The virtual switches and port groups of a host are
+captured once, stored, and used as the source of any number of network copies
+without reading the source host again.
+"""
+import base64
+import json
+import os
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Iterable, Optional, Tuple
+
+from pyVmomi import SoapAdapter, vim
+
+from common import log, secrets
+from common.clients import boto
+
+PROFILE_VERSION = 1
+SSM_MAX_VALUE_SIZE = 8192  # bytes, advanced parameter tier
+PROFILE_FILE_SUFFIX = ".profile"
+
+logger = log.get_logger(__name__)
+
+
+def _vswitch_key(vswitch_name: Optional[str]) -> Optional[str]:
+    if vswitch_name is None:
+        return None
+    return f"key-vim.host.VirtualSwitch-{vswitch_name}"
+
+
+def _vswitch_name(vswitch_key: Optional[str]) -> Optional[str]:
+    # A port group may have no switch, e.g. while the host reconfigures it
+    if vswitch_key is None:
+        return None
+    return vswitch_key.split("-")[2]
+
+
+def _serialize(spec: Any) -> str:
+    return SoapAdapter.Serialize(spec).decode("utf-8")
+
+
+def _deserialize(data: str, spec_type: Any) -> Any:
+    return SoapAdapter.Deserialize(data.encode("utf-8"), spec_type)
+
+
+class NetworkProfile:
+    """
+    The virtual switch and port group specs of a host, without the port groups
+    used by its virtual nics. A profile can be used as the source of a network
+    copy in place of a HostNetworkSnapshot.
+    """
+
+    __slots__ = (
+        "host_name",
+        "captured_at",
+        "vswitches",
+        "portgroups",
+        "_vswitch_names",
+        "_portgroup_names",
+    )
+
+    def __init__(
+        self,
+        host_name: str,
+        vswitches: Iterable[Any] = (),
+        portgroups: Iterable[Any] = (),
+        captured_at: Optional[str] = None,
+    ):
+        self.host_name = host_name
+        self.captured_at = captured_at or datetime.now(timezone.utc).isoformat()
+        self.vswitches: Tuple[Any, ...] = tuple(vswitches)
+        self.portgroups: Tuple[Any, ...] = tuple(portgroups)
+        self._vswitch_names = frozenset(v.name for v in self.vswitches)
+        self._portgroup_names = frozenset(p.spec.name for p in self.portgroups)
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(host_name={self.host_name!r}, "
+            f"vswitches={len(self.vswitches)}, portgroups={len(self.portgroups)})"
+        )
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Any) -> "NetworkProfile":
+        """
+        Captures the profile of a HostNetworkSnapshot, leaving out the port
+        groups of its virtual nics.
+        """
+        return cls(
+            snapshot.host_name,
+            vswitches=[
+                vim.host.VirtualSwitch(name=vswitch.name, spec=vswitch.spec)
+                for vswitch in snapshot.vswitches
+            ],
+            portgroups=[
+                vim.host.PortGroup(spec=portgroup.spec, vswitch=portgroup.vswitch)
+                for portgroup in snapshot.portgroups
+                if not snapshot.is_in_do_not_copy_list(portgroup.spec.name)
+            ],
+        )
+
+    @property
+    def vswitch_names(self) -> frozenset:
+        return self._vswitch_names
+
+    @property
+    def portgroup_names(self) -> frozenset:
+        return self._portgroup_names
+
+    def has_virtual_switch(self, vswitch_name: str) -> bool:
+        return vswitch_name in self._vswitch_names
+
+    def has_portgroup(self, portgroup_name: str) -> bool:
+        return portgroup_name in self._portgroup_names
+
+    def is_in_do_not_copy_list(self, portgroup_name: str) -> bool:
+        # Filtered out when the profile was captured
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            "version": PROFILE_VERSION,
+            "host_name": self.host_name,
+            "captured_at": self.captured_at,
+            "vswitches": [
+                {"name": vswitch.name, "spec": _serialize(vswitch.spec)}
+                for vswitch in self.vswitches
+            ],
+            "portgroups": [
+                {
+                    "vswitch": _vswitch_name(portgroup.vswitch),
+                    "spec": _serialize(portgroup.spec),
+                }
+                for portgroup in self.portgroups
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "NetworkProfile":
+        version = values.get("version")
+        if version != PROFILE_VERSION:
+            raise Exception(f"Unsupported network profile version {version}")
+
+        return cls(
+            values["host_name"],
+            vswitches=[
+                vim.host.VirtualSwitch(
+                    name=vswitch["name"],
+                    spec=_deserialize(
+                        vswitch["spec"], vim.host.VirtualSwitch.Specification
+                    ),
+                )
+                for vswitch in values["vswitches"]
+            ],
+            portgroups=[
+                vim.host.PortGroup(
+                    spec=_deserialize(
+                        portgroup["spec"], vim.host.PortGroup.Specification
+                    ),
+                    vswitch=_vswitch_key(portgroup["vswitch"]),
+                )
+                for portgroup in values["portgroups"]
+            ],
+            captured_at=values["captured_at"],
+        )
+
+    def dumps(self) -> str:
+        """
+        Compressed text form of the profile, small enough for a parameter store
+        value. The repeated SOAP markup of the specs compresses well.
+        """
+        data = json.dumps(self.to_dict(), separators=(",", ":")).encode("utf-8")
+        return base64.b64encode(zlib.compress(data, 9)).decode("ascii")
+
+    @classmethod
+    def loads(cls, data: str) -> "NetworkProfile":
+        return cls.from_dict(json.loads(zlib.decompress(base64.b64decode(data))))
+
+
+class SsmProfileStore:
+    """
+    Keeps profiles as SSM parameters next to the other settings of the stage.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.__path = path or secrets.get_path("network_profiles")
+
+    def _name(self, profile_name: str) -> str:
+        return f"{self.__path}/{profile_name}"
+
+    def load(self, profile_name: str) -> NetworkProfile:
+        return NetworkProfile.loads(secrets.get_parameter(self._name(profile_name)))
+
+    def save(self, profile_name: str, profile: NetworkProfile) -> None:
+        value = profile.dumps()
+        if len(value) > SSM_MAX_VALUE_SIZE:
+            raise Exception(
+                f"Network profile {profile_name} is {len(value)} bytes, "
+                f"over the {SSM_MAX_VALUE_SIZE} bytes a parameter can hold"
+            )
+        logger.info("Saving network profile", profile=profile_name, size=len(value))
+        ssm_client = boto.get_client(boto.ClientType.SIMPLE_SYSTEMS_MANAGER)
+        ssm_client.put_parameter(
+            Name=self._name(profile_name),
+            Value=value,
+            Type="String",
+            Tier="Intelligent-Tiering",
+            Overwrite=True,
+        )
+
+
+class FileProfileStore:
+    """
+    Keeps profiles as files in a local directory.
+    """
+
+    def __init__(self, directory: str):
+        self.__directory = directory
+
+    def _path(self, profile_name: str) -> str:
+        return os.path.join(self.__directory, f"{profile_name}{PROFILE_FILE_SUFFIX}")
+
+    def load(self, profile_name: str) -> NetworkProfile:
+        with open(self._path(profile_name)) as profile_file:
+            return NetworkProfile.loads(profile_file.read())
+
+    def save(self, profile_name: str, profile: NetworkProfile) -> None:
+        os.makedirs(self.__directory, exist_ok=True)
+        with open(self._path(profile_name), "w") as profile_file:
+            profile_file.write(profile.dumps())
@@ -0,0 +1,127 @@
+"""
+Incremental decoding of JSON documents made of one big array of records, like
+the pages of a Zamboni listing, so records can be used while the rest of the
+body is still being received.
+"""
+import codecs
+import json
+from typing import Any, Dict, Iterable, Iterator
+
+WHITESPACE = " \t\n\r"
+NUMBER_CHARACTERS = "0123456789+-.eE"
+COMPACT_AFTER = 64 * 1024  # characters consumed before the buffer is trimmed
+
+
+class JsonStreamError(Exception):
+    pass
+
+
+class _Reader:
+    def __init__(self, chunks: Iterable[bytes]):
+        self.__chunks = iter(chunks)
+        self.__decoder = codecs.getincrementaldecoder("utf-8")()
+        self.__decode = json.JSONDecoder().raw_decode
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """
+        Appends the next chunk to the buffer. Returns False at the end of the
+        stream.
+        """
+        if self.eof:
+            return False
+        if self.pos > COMPACT_AFTER:
+            start = self.pos
+            self.buffer = self.buffer[start:]
+            self.pos = 0
+        for chunk in self.__chunks:
+            text = self.__decoder.decode(chunk)
+            if text:
+                self.buffer += text
+                return True
+        self.buffer += self.__decoder.decode(b"", final=True)
+        self.eof = True
+        return False
+
+    def peek(self) -> str:
+        """
+        The next character that is not whitespace, or "" at the end.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, characters: str) -> str:
+        character = self.peek()
+        if character == "" or character not in characters:
+            raise JsonStreamError(
+                f"Expected one of {characters!r} but got {character!r} "
+                f"at offset {self.pos}"
+            )
+        self.pos += 1
+        return character
+
+    def value(self) -> Any:
+        """
+        Decodes the next value, reading more of the stream until it is whole.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.__decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise JsonStreamError("Unexpected end of JSON stream")
+                continue
+            # A number cut by the end of the buffer, possibly right after its
+            # "." or exponent, may go on in the next chunk
+            if (
+                isinstance(value, (int, float))
+                and not isinstance(value, bool)
+                and not self.buffer[end:].strip(NUMBER_CHARACTERS)
+                and self._fill()
+            ):
+                continue
+            self.pos = end
+            return value
+
+
+def iter_array_items(
+    chunks: Iterable[bytes], key: str, other_values: Dict[str, Any] = None
+) -> Iterator[Any]:
+    """
+    Yields the items of the array under key in the JSON object read from
+    chunks of bytes, one at a time. Only the item being decoded is held, not
+    the whole document. The other values of the object are put in other_values
+    as they are read, so values after the array are only there once every
+    item has been yielded.
+    """
+    other_values = {} if other_values is None else other_values
+    reader = _Reader(chunks)
+
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.pos += 1
+        return
+    while True:
+        name = reader.value()
+        reader.expect(":")
+        if name == key and reader.peek() == "[":
+            reader.pos += 1
+            if reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.expect(",]") == "]":
+                        break
+        else:
+            other_values[name] = reader.value()
+        if reader.expect(",}") == "}":
+            return
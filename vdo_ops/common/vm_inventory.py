@@ -0,0 +1,149 @@
+"""
+Locally persisted VM inventories. The VMs of a vCenter are listed in full
+once, then kept up to date with the VMs Zamboni reports as changed since the
+last sync.
+"""
+import base64
+import json
+import os
+import tempfile
+import zlib
+from typing import Any, Dict, Iterable, List, Optional
+
+from common import log
+
+INVENTORY_VERSION = 1
+INVENTORY_FILE_SUFFIX = ".inventory"
+# Not a fixed path, which another user of the temp directory could take first
+INVENTORY_DIR = os.environ.get(
+    "ZAMBONI_INVENTORY_DIR",
+    os.path.join(tempfile.gettempdir(), f"zamboni_inventory-{os.getpid()}"),
+)
+
+logger = log.get_logger(__name__)
+
+
+class VmInventory:
+    """
+    The VMs of a vCenter by ID, and the watermark from which the next sync
+    asks for changes.
+    """
+
+    __slots__ = ("vcenter", "vms", "watermark")
+
+    def __init__(
+        self,
+        vcenter: str,
+        vms: Optional[Dict[str, Dict[str, Any]]] = None,
+        watermark: Optional[str] = None,
+    ):
+        self.vcenter = vcenter
+        self.vms = vms or {}
+        self.watermark = watermark
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(vcenter={self.vcenter!r}, vms={len(self.vms)}, "
+            f"watermark={self.watermark!r})"
+        )
+
+    def replace(self, vms: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Replaces every VM with the ones of a full listing.
+        """
+        previous = self.vms
+        self.vms = {vm["id"]: vm for vm in vms}
+        return {
+            "added": len(self.vms.keys() - previous.keys()),
+            "updated": len(self.vms.keys() & previous.keys()),
+            "removed": len(previous.keys() - self.vms.keys()),
+        }
+
+    def merge(
+        self, changed: Iterable[Dict[str, Any]], present_ids: Iterable[str]
+    ) -> Dict[str, int]:
+        """
+        Adds or updates the changed VMs, and removes the VMs that are neither
+        changed nor in present_ids.
+        """
+        changes = {"added": 0, "updated": 0, "removed": 0}
+        present = set(present_ids)
+        for vm in changed:
+            changes["updated" if vm["id"] in self.vms else "added"] += 1
+            self.vms[vm["id"]] = vm
+            present.add(vm["id"])
+        for vm_id in self.vms.keys() - present:
+            del self.vms[vm_id]
+            changes["removed"] += 1
+        return changes
+
+    def vm_list(self) -> List[Dict[str, Any]]:
+        return list(self.vms.values())
+
+    def to_dict(self) -> dict:
+        return {
+            "version": INVENTORY_VERSION,
+            "vcenter": self.vcenter,
+            "watermark": self.watermark,
+            "vms": self.vm_list(),
+        }
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "VmInventory":
+        if values.get("version") != INVENTORY_VERSION:
+            raise Exception(
+                f"Unsupported VM inventory version: {values.get('version')}"
+            )
+        return cls(
+            values["vcenter"],
+            vms={vm["id"]: vm for vm in values.get("vms", [])},
+            watermark=values.get("watermark"),
+        )
+
+    def dumps(self) -> str:
+        """
+        Compact text form of the inventory: compressed JSON, base64 encoded.
+        """
+        data = json.dumps(self.to_dict(), separators=(",", ":")).encode("utf-8")
+        return base64.b64encode(zlib.compress(data, 9)).decode("ascii")
+
+    @classmethod
+    def loads(cls, data: str) -> "VmInventory":
+        return cls.from_dict(json.loads(zlib.decompress(base64.b64decode(data))))
+
+
+class FileInventoryStore:
+    """
+    Keeps inventories as files in a local directory, one per vCenter.
+    """
+
+    def __init__(self, directory: str = INVENTORY_DIR):
+        self.__directory = directory
+
+    def _path(self, vcenter: str) -> str:
+        return os.path.join(self.__directory, f"{vcenter}{INVENTORY_FILE_SUFFIX}")
+
+    def load(self, vcenter: str) -> Optional[VmInventory]:
+        """
+        The stored inventory of the vCenter, or None when there is none or it
+        cannot be read, in which case the next sync lists every VM.
+        """
+        try:
+            with open(self._path(vcenter)) as inventory_file:
+                return VmInventory.loads(inventory_file.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(
+                "Ignoring unreadable VM inventory", vcenter=vcenter, error=str(e)
+            )
+            return None
+
+    def save(self, inventory: VmInventory) -> None:
+        os.makedirs(self.__directory, mode=0o700, exist_ok=True)
+        path = self._path(inventory.vcenter)
+        # Written aside and renamed, so a failed write keeps the previous one
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as inventory_file:
+            inventory_file.write(inventory.dumps())
+        os.replace(temp_path, path)
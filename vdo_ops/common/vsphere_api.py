@@ -1,65 +1,521 @@
-import socket
+import contextlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from typing import Any
 
-from common import log
+from pyVmomi import vmodl
+
+from common import deadline, log
 from common.clients.vsphere import VsphereClient
+from common.network_checkpoint import NetworkCopyCheckpoint
+from common.network_plan import (
+    NetworkCopyResult,
+    PortgroupChange,
+    VswitchChange,
+    diff_networks,
+    plan_dvs_portgroup_copy,
+    plan_network_copy,
+)
 
-socket.setdefaulttimeout(15)  # Lambda max execution time is 20
+MAX_COPY_WORKERS = 8
+DVS_TASK_BATCH_SIZE = 10  # distributed port group tasks running at once
+MAX_CHANGES_PER_UPDATE = 250  # switches and port groups per UpdateNetworkConfig
+CHECKPOINT_EVERY = MAX_CHANGES_PER_UPDATE  # applied changes between two saves
 
 logger = log.get_logger(__name__)
 
 
 class VsphereApi:
-    def __init__(self, hostname):
-        self._client = VsphereClient(hostname)
+    def __init__(self, hostname, session_pool=None):
+        self._client = VsphereClient(hostname, session_pool=session_pool)
 
     def _open_session(f: Any) -> Any:
         @wraps(f)
         def wrapped(instance: Any, *args: Any, **kwargs: Any) -> Any:
-            with instance._client.open_session():
-                return f(instance, *args, **kwargs)
+            try:
+                with instance._client.metrics.operation(f.__name__) as summary:
+                    with instance._client.limiter.operation(f.__name__):
+                        with instance._client.open_session():
+                            return f(instance, *args, **kwargs)
+            finally:
+                # The summary is filled in once the operation has exited
+                logger.info(
+                    "vCenter call summary",
+                    limiter=instance._client.limiter.snapshot(),
+                    **summary,
+                )
 
         return wrapped
 
     @_open_session
-    def copy_networks(self, from_device_name, to_device_name):
+    def copy_networks(
+        self,
+        from_device_name,
+        to_device_name,
+        batch=True,
+        dry_run=False,
+        checkpoint_store=None,
+    ):
         """
         For the give source and destination devices, copies the network info
         from the source device to the destination device in the vCenter.
+
+        With batch set, the missing virtual switches and port groups are
+        applied with as few UpdateNetworkConfig calls as possible, falling back
+        to one call per object when vCenter rejects a batch. With dry_run set,
+        nothing is changed.
+
+        With a checkpoint_store, progress is saved every CHECKPOINT_EVERY
+        applied changes and when the copy fails. A copy that finds a
+        checkpoint skips reading the destination and planning, and only
+        applies what the checkpoint does not list as applied.
+
+        Returns the NetworkCopyPlan that was (or would be) applied.
         """
         logger.info(
             f"Beginning network copy from {from_device_name} to {to_device_name}"
         )
 
-        from_switches = self._client.get_host_virtual_switches(from_device_name)
+        source = self._client.get_host_network_snapshot(from_device_name)
+        plan = self._copy_from_snapshot(
+            source, to_device_name, batch, dry_run, checkpoint_store
+        )
+
+        logger.info("Network copy complete.")
+        return plan
+
+    def copy_networks_from(
+        self,
+        source_api,
+        from_device_name,
+        to_device_name,
+        batch=True,
+        dry_run=False,
+        checkpoint_store=None,
+    ):
+        """
+        Copies the network info of a device in the vCenter of source_api to a
+        device in this vCenter, with the same planning and batching as
+        copy_networks.
+
+        The source vCenter is logged in to and read on a worker thread while
+        this one is logged in to and the destination device is read, so the
+        two logins and the two reads overlap.
+
+        Returns the NetworkCopyPlan that was (or would be) applied.
+        """
+        logger.info(
+            f"Beginning network copy from {from_device_name} to {to_device_name} "
+            f"across vCenters"
+        )
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            source_future = executor.submit(
+                contextvars.copy_context().run,
+                source_api.get_network_snapshot,
+                from_device_name,
+            )
+            plan = self._copy_from_remote(
+                source_future, to_device_name, batch, dry_run, checkpoint_store
+            )
+
+        logger.info("Network copy complete.")
+        return plan
+
+    @_open_session
+    def get_network_snapshot(self, device_name):
+        """
+        Reads the network configuration of the device in a session of its own.
+        """
+        return self._client.get_host_network_snapshot(device_name)
+
+    @_open_session
+    def _copy_from_remote(
+        self, source_future, to_device_name, batch, dry_run, checkpoint_store
+    ):
+        destination = self._client.get_host_network_snapshot(to_device_name)
+        return self._copy_from_snapshot(
+            source_future.result(),
+            to_device_name,
+            batch,
+            dry_run,
+            checkpoint_store,
+            destination=destination,
+        )
+
+    @_open_session
+    def copy_networks_to_many(
+        self,
+        from_device_name,
+        to_device_names,
+        batch=True,
+        dry_run=False,
+        max_workers=MAX_COPY_WORKERS,
+    ):
+        """
+        Copies the network info of the source device to every destination
+        device. The source is read once and the destinations are updated in
+        parallel, each worker thread on its own cloned session.
+
+        Returns a NetworkCopyResult per destination device name. A failure on
+        one destination does not stop the others.
+        """
+        logger.info(
+            f"Beginning network copy from {from_device_name} to "
+            f"{len(to_device_names)} hosts"
+        )
+
+        source = self._client.get_host_network_snapshot(from_device_name)
+        return self._copy_to_many(source, to_device_names, batch, dry_run, max_workers)
+
+    @_open_session
+    def capture_network_profile(self, from_device_name, profile_name, store):
+        """
+        Captures the network profile of the device and saves it in the store
+        under the given name.
+
+        Returns the NetworkProfile.
+        """
+        profile = self._client.export_network_profile(from_device_name)
+        store.save(profile_name, profile)
+        logger.info(
+            f"Captured network profile {profile_name} from {from_device_name}.",
+            vswitches=len(profile.vswitches),
+            portgroups=len(profile.portgroups),
+        )
+        return profile
+
+    @_open_session
+    def apply_network_profile(
+        self,
+        profile,
+        to_device_names,
+        batch=True,
+        dry_run=False,
+        max_workers=MAX_COPY_WORKERS,
+    ):
+        """
+        Copies the networks of a NetworkProfile to every destination device,
+        like copy_networks_to_many but without reading a source device.
+
+        Returns a NetworkCopyResult per destination device name.
+        """
+        logger.info(
+            f"Applying network profile of {profile.host_name} to "
+            f"{len(to_device_names)} hosts"
+        )
+        return self._copy_to_many(profile, to_device_names, batch, dry_run, max_workers)
+
+    def _copy_to_many(self, source, to_device_names, batch, dry_run, max_workers):
+        results = {}
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(max_workers, len(to_device_names)))
+        ) as executor:
+            futures = {
+                # Each worker runs in a copy of the context to keep the deadline
+                to_device_name: executor.submit(
+                    contextvars.copy_context().run,
+                    self._copy_from_snapshot,
+                    source,
+                    to_device_name,
+                    batch,
+                    dry_run,
+                )
+                for to_device_name in to_device_names
+            }
+            for to_device_name, future in futures.items():
+                try:
+                    results[to_device_name] = NetworkCopyResult(
+                        to_device_name, plan=future.result()
+                    )
+                except Exception as e:
+                    logger.exception(f"Network copy to {to_device_name} failed.")
+                    results[to_device_name] = NetworkCopyResult(
+                        to_device_name, error=str(e)
+                    )
+
+        failed = [name for name, result in results.items() if not result.succeeded]
+        logger.info(
+            f"Network copy complete on {len(results) - len(failed)} hosts, "
+            f"failed on {len(failed)}."
+        )
+        return results
+
+    @_open_session
+    def audit_cluster_networks(self, reference_host, cluster):
+        """
+        Checks every host of the cluster against the networks of the reference
+        host. The whole cluster is read in one PropertyCollector retrieval.
+
+        Returns a NetworkDrift per host name, the reference host excluded.
+        """
+        logger.info(f"Auditing networks of cluster {cluster} against {reference_host}")
+
+        snapshots = self._client.get_cluster_network_snapshots(cluster)
+        reference = snapshots.pop(reference_host, None)
+        if reference is None:
+            reference = self._client.get_host_network_snapshot(reference_host)
+
+        drifts = {
+            host_name: diff_networks(reference, snapshot)
+            for host_name, snapshot in sorted(snapshots.items())
+        }
+
+        drifted = [name for name, drift in drifts.items() if not drift.conformant]
+        logger.info(
+            f"Audited {len(drifts)} hosts, {len(drifted)} differ from reference.",
+            drifted_hosts=drifted,
+        )
+        return drifts
+
+    @_open_session
+    def copy_dvs_portgroups(
+        self,
+        from_switch_name,
+        to_switch_name,
+        dry_run=False,
+        batch_size=DVS_TASK_BATCH_SIZE,
+    ):
+        """
+        Copies the port groups of a distributed virtual switch to another one.
+        Missing port groups are created and the ones with another binding type
+        or VLAN are reconfigured. The vCenter tasks are submitted batch_size at
+        a time and each batch is waited for as a whole. With dry_run set,
+        nothing is changed.
+
+        Returns the DvsPortgroupCopyPlan that was (or would be) applied.
+        """
+        logger.info(
+            f"Beginning DVS portgroup copy from {from_switch_name} to {to_switch_name}"
+        )
+
+        plan = plan_dvs_portgroup_copy(
+            from_switch_name,
+            to_switch_name,
+            self._client.get_dvs_portgroups(from_switch_name),
+            self._client.get_dvs_portgroups(to_switch_name),
+        )
+        for skipped in plan.portgroups_skipped:
+            logger.info(f"Skipping portgroup {skipped.name}: {skipped.reason.value}")
+        logger.info(
+            f"{len(plan.portgroups_to_create)} portgroups to create and "
+            f"{len(plan.portgroups_to_reconfigure)} to reconfigure."
+        )
+        if dry_run or plan.is_empty:
+            return plan
+
+        changes = [*plan.portgroups_to_create, *plan.portgroups_to_reconfigure]
+        copied = []
+        failed = []
+        for start in range(0, len(changes), batch_size):
+            end = start + batch_size
+            batch = changes[start:end]
+            tasks = []
+            try:
+                for change in batch:
+                    tasks.append(self._submit_dvs_change(to_switch_name, change))
+            except Exception as e:
+                # The tasks already submitted run on regardless, so they are
+                # still waited for and their outcome reported with the error
+                self._wait_for_submitted(batch, tasks, copied, failed, e)
+                message = (
+                    f"Failed to copy portgroup {batch[len(tasks)].name} to "
+                    f"{to_switch_name}: {str(e)}. Copied: {', '.join(copied) or '-'}. "
+                    f"Failed: {', '.join(failed) or '-'}"
+                )
+                logger.error(message)
+                if isinstance(e, deadline.DeadlineExceeded):
+                    raise
+                raise Exception(message)
+            self._wait_for_dvs_changes(batch, tasks, copied, failed)
+
+        if failed:
+            raise Exception(
+                f"Failed to copy portgroups {', '.join(failed)} to {to_switch_name}"
+            )
+
+        logger.info("DVS portgroup copy complete.")
+        return plan
+
+    def _wait_for_dvs_changes(self, changes, tasks, copied, failed):
+        for change, error in zip(changes, self._client.wait_for_tasks(tasks)):
+            if error is not None:
+                logger.error(f"Failed to copy portgroup {change.name}: {error.msg}")
+                failed.append(change.name)
+            else:
+                copied.append(change.name)
 
-        for from_switch in from_switches:
-            logger.info(f"Checking vSwitch: {from_switch.name}")
+    def _wait_for_submitted(self, changes, tasks, copied, failed, error):
+        # Out of time, the tasks are only given the grace period to finish
+        grace = (
+            deadline.grace_period()
+            if isinstance(error, deadline.DeadlineExceeded)
+            else contextlib.nullcontext()
+        )
+        try:
+            with grace:
+                self._wait_for_dvs_changes(changes, tasks, copied, failed)
+        except Exception:
+            logger.warning(
+                "Failed to wait for the submitted portgroup tasks", exc_info=True
+            )
+            done = set(copied) | set(failed)
+            failed.extend(
+                f"{change.name} (unknown)"
+                for change in changes[: len(tasks)]
+                if change.name not in done
+            )
+
+    def _submit_dvs_change(self, to_switch_name, change):
+        if change.current_config is None:
+            return self._client.create_dvs_portgroup(to_switch_name, change.config)
+        return self._client.reconfigure_dvs_portgroup(
+            change.current_config, change.config
+        )
 
-            if self._client.has_virtual_switch(to_device_name, from_switch.name):
-                logger.info("vSwitch already exists on destination.")
+    def _copy_from_snapshot(
+        self,
+        source,
+        to_device_name,
+        batch,
+        dry_run,
+        checkpoint_store=None,
+        destination=None,
+    ):
+        """
+        Plans and applies the copy of the source snapshot to the device. The
+        destination snapshot is read unless one is given.
+        """
+        if dry_run or checkpoint_store is None:
+            plan = self._plan_copy(source, to_device_name, destination)
+            self._log_plan(plan)
+            if dry_run:
+                logger.info("Dry run, no changes made.")
             else:
-                logger.info("Adding vSwitch to destination.")
-                self._client.add_host_vswitch(
-                    to_device_name, from_switch.name, from_switch.spec
+                self._apply_plan(source, plan, batch)
+            return plan
+
+        checkpoint, plan = self._resume_copy(
+            source, to_device_name, checkpoint_store, destination
+        )
+        self._log_plan(plan)
+
+        unsaved = [0]
+
+        def on_applied(vswitch_names, portgroup_names):
+            checkpoint.mark_applied(vswitch_names, portgroup_names)
+            unsaved[0] += len(vswitch_names) + len(portgroup_names)
+            if unsaved[0] >= CHECKPOINT_EVERY:
+                checkpoint_store.save(checkpoint)
+                unsaved[0] = 0
+
+        try:
+            self._apply_plan(source, checkpoint.remaining(plan), batch, on_applied)
+        except Exception:
+            if unsaved[0]:
+                self._save_on_failure(checkpoint_store, checkpoint)
+            raise
+        checkpoint_store.delete(source.host_name, to_device_name)
+        return plan
+
+    @staticmethod
+    def _save_on_failure(checkpoint_store, checkpoint):
+        """
+        Saves the progress of a failed copy so its retry resumes from there,
+        within the grace period in case the deadline is what stopped it. The
+        error of the copy is the one raised, a failed save is only logged.
+        """
+        try:
+            with deadline.grace_period():
+                checkpoint_store.save(checkpoint)
+        except Exception as e:
+            logger.error("Failed to save the network copy checkpoint.", error=str(e))
+
+    def _plan_copy(self, source, to_device_name, destination=None):
+        if destination is None:
+            destination = self._client.get_host_network_snapshot(to_device_name)
+        return plan_network_copy(source, destination)
+
+    def _resume_copy(self, source, to_device_name, checkpoint_store, destination=None):
+        """
+        Gets the checkpoint of an earlier attempt with the plan it was made for,
+        or plans the copy and saves a new checkpoint for it.
+        """
+        checkpoint = checkpoint_store.load(source.host_name, to_device_name)
+        if checkpoint is not None:
+            plan = checkpoint.to_plan(source)
+            if plan is not None:
+                logger.info(
+                    "Resuming network copy from checkpoint.",
+                    applied_vswitches=len(checkpoint.applied_vswitches),
+                    applied_portgroups=len(checkpoint.applied_portgroups),
                 )
+                return checkpoint, plan
+            logger.warning("Source host changed since the checkpoint, replanning.")
 
-            for from_portgroup in self._client.get_portgroup_by_vswitch(
-                from_device_name, from_switch.name
-            ):
-                logger.info(f"Checking portgroup: {from_portgroup.spec.name}")
+        plan = self._plan_copy(source, to_device_name, destination)
+        checkpoint = NetworkCopyCheckpoint.from_plan(plan)
+        checkpoint_store.save(checkpoint)
+        return checkpoint, plan
 
-                if self._client.is_in_do_not_copy_list(
-                    from_device_name, from_portgroup.spec.name
-                ):
-                    logger.info("Portgroup is in do not copy list.")
-                    continue
+    def _log_plan(self, plan):
+        for skipped in plan.portgroups_skipped:
+            logger.info(f"Skipping portgroup {skipped.name}: {skipped.reason.value}")
+        logger.info(
+            f"{len(plan.vswitches_to_add)} vSwitches and "
+            f"{len(plan.portgroups_to_add)} portgroups to add."
+        )
 
-                if self._client.has_portgroup(to_device_name, from_portgroup.spec.name):
-                    logger.info("Portgroup already exists on destination.")
-                else:
-                    logger.info("Adding portgroup to destination.")
-                    self._client.add_host_portgroup(to_device_name, from_portgroup.spec)
+    def _apply_plan(self, source, plan, batch, on_applied=None):
+        """
+        Applies the plan, calling on_applied with the names of the virtual
+        switches and port groups after each successful vCenter call.
+        """
+        on_applied = on_applied or (lambda vswitch_names, portgroup_names: None)
+        if plan.is_empty:
+            logger.info("Destination already has every network.")
+        elif batch:
+            try:
+                self._update_networks(plan, on_applied)
+            except vmodl.MethodFault as e:
+                logger.warning(
+                    f"Batched network update was rejected, adding one by one. {e.msg}"
+                )
+                destination = self._client.get_host_network_snapshot(
+                    plan.destination_host
+                )
+                self._add_networks(plan_network_copy(source, destination), on_applied)
+        else:
+            self._add_networks(plan, on_applied)
 
-        logger.info("Network copy complete.")
+    def _update_networks(self, plan, on_applied):
+        # Switches come first so port groups only land on switches that exist
+        changes = [*plan.vswitches_to_add, *plan.portgroups_to_add]
+        for start in range(0, len(changes), MAX_CHANGES_PER_UPDATE):
+            end = start + MAX_CHANGES_PER_UPDATE
+            vswitches = [c for c in changes[start:end] if isinstance(c, VswitchChange)]
+            portgroups = [
+                c for c in changes[start:end] if isinstance(c, PortgroupChange)
+            ]
+            self._client.update_host_network(
+                plan.destination_host,
+                [(change.name, change.spec) for change in vswitches],
+                [change.spec for change in portgroups],
+            )
+            on_applied(
+                [change.name for change in vswitches],
+                [change.name for change in portgroups],
+            )
+
+    def _add_networks(self, plan, on_applied):
+        for change in plan.vswitches_to_add:
+            logger.info(f"Adding vSwitch {change.name} to destination.")
+            self._client.add_host_vswitch(
+                plan.destination_host, change.name, change.spec
+            )
+            on_applied([change.name], [])
+
+        for change in plan.portgroups_to_add:
+            logger.info(f"Adding portgroup {change.name} to destination.")
+            self._client.add_host_portgroup(plan.destination_host, change.spec)
+            on_applied([], [change.name])
@@ -1,36 +1,199 @@
 from common import log
+from common.deadline import DeadlineExceeded, lambda_deadline
+from common.clients.vsphere import SESSION_POOL
 from common.constants import CLIENTS
+from common.network_checkpoint import DynamoDbCheckpointStore
+from common.network_plan import NetworkCopyResult
 from common.vsphere_api import VsphereApi
 
 logger = log.get_logger(__name__)
 
+# Lets a retried invocation resume a copy the previous one did not finish
+CHECKPOINT_STORE = DynamoDbCheckpointStore()
+
 
 def _get_vsphere_api(hostname):
-    return VsphereApi(hostname)
+    # The pool is module level so warm invocations reuse the vCenter session
+    return VsphereApi(hostname, session_pool=SESSION_POOL)
+
+
+def _connect(hostname):
+    try:
+        return _get_vsphere_api(hostname)
+    except Exception as e:
+        logger.error(f"There was an error connecting to {hostname}.", e)
+        raise Exception(f"There was an error connecting to {hostname}. {str(e)}")
+
+
+def _get_hyp(hyps, device_number):
+    hyp = hyps.get(str(device_number), None)
+    if hyp is None:
+        raise Exception(f"No hypervisor found for device {device_number}")
+    return hyp
 
 
 def handler(event, context):
+    # Calls stop before the Lambda timeout instead of being killed mid-change
+    with lambda_deadline(context):
+        return _handle(event)
+
+
+def _handle(event):
     logger.debug("Beginning network copy!")
+    if "to_devices" in event:
+        return _copy_to_many(event)
+
     from_device_number = event.get("from_device", None)
     to_device_number = event.get("to_device", None)
-    logger.bind(from_device=from_device_number, to_device=to_device_number)
+    dry_run = event.get("dry_run", False)
+    logger.bind(
+        from_device=from_device_number, to_device=to_device_number, dry_run=dry_run
+    )
 
-    # Get the vms in the vCenter from Zamboni
-    from_hyp = CLIENTS.zamboni_client.get_hyps_by_device_id(from_device_number)
-    to_hyp = CLIENTS.zamboni_client.get_hyps_by_device_id(to_device_number)
+    # Get both hypervisors from Zamboni in one request
+    hyps = CLIENTS.zamboni_client.get_hyps_by_device_ids(
+        [from_device_number, to_device_number]
+    )
+    from_hyp = _get_hyp(hyps, from_device_number)
+    to_hyp = _get_hyp(hyps, to_device_number)
 
     hostname = from_hyp.get("location", None)
-    # Make the call to copy networks
-    try:
-        vsphere_api = _get_vsphere_api(hostname)
-    except Exception as e:
-        logger.error(f"There was an error connecting to {hostname}.", e)
-        raise Exception(f"There was an error connecting to {hostname}. {str(e)}")
+    to_hostname = to_hyp.get("location", None) or hostname
+    vsphere_api = _connect(hostname)
+    to_vsphere_api = vsphere_api if to_hostname == hostname else _connect(to_hostname)
 
+    # Make the call to copy networks
     try:
-        vsphere_api.copy_networks(from_hyp.get("name", None), to_hyp.get("name", None))
+        if to_vsphere_api is vsphere_api:
+            plan = vsphere_api.copy_networks(
+                from_hyp.get("name", None),
+                to_hyp.get("name", None),
+                dry_run=dry_run,
+                checkpoint_store=CHECKPOINT_STORE,
+            )
+        else:
+            logger.info(f"Copying networks from {hostname} to {to_hostname}.")
+            plan = to_vsphere_api.copy_networks_from(
+                vsphere_api,
+                from_hyp.get("name", None),
+                to_hyp.get("name", None),
+                dry_run=dry_run,
+                checkpoint_store=CHECKPOINT_STORE,
+            )
+    except DeadlineExceeded:
+        # Raised as is so a retry can tell it apart, and resume the checkpoint
+        logger.warning("Out of time, the network copy stopped before completion.")
+        raise
     except Exception as e:
         logger.error("There was an error during the network copy process.", e)
         raise Exception(f"There was an error during the network copy process. {str(e)}")
 
     logger.debug("Network copy complete.")
+    return plan.to_dict()
+
+
+def _copy_to_many(event):
+    """
+    Copies the networks of one source device to several destination devices
+    at once. Every destination gets its own result, failed or not, keyed by
+    its device number. The destinations in the vCenter of the source are
+    copied to together; those in other vCenters through a session of their
+    own vCenter. Devices that resolve to the same host are not copied to.
+    """
+    from_device_number = event.get("from_device", None)
+    to_device_numbers = event.get("to_devices", [])
+    dry_run = event.get("dry_run", False)
+    logger.bind(
+        from_device=from_device_number, to_devices=to_device_numbers, dry_run=dry_run
+    )
+
+    hyps = CLIENTS.zamboni_client.get_hyps_by_device_ids(
+        [from_device_number, *to_device_numbers]
+    )
+    from_hyp = _get_hyp(hyps, from_device_number)
+    from_name = from_hyp.get("name", None)
+
+    hostname = from_hyp.get("location", None)
+    vsphere_api = _connect(hostname)
+
+    results = {}
+    device_numbers_by_host = {}
+    for device_number in to_device_numbers:
+        to_hyp = hyps.get(str(device_number), None)
+        if to_hyp is None:
+            results[device_number] = NetworkCopyResult(
+                str(device_number),
+                error=f"No hypervisor found for device {device_number}",
+            ).to_dict()
+            continue
+        host = (to_hyp.get("location", None) or hostname, to_hyp.get("name", None))
+        device_numbers_by_host.setdefault(host, []).append(device_number)
+
+    names_by_location = {}
+    for (location, name), device_numbers in device_numbers_by_host.items():
+        if len(device_numbers) == 1:
+            names_by_location.setdefault(location, []).append(name)
+            continue
+        error = (
+            f"Devices {', '.join(str(number) for number in device_numbers)} "
+            f"resolve to the same host {name}"
+        )
+        for device_number in device_numbers:
+            results[device_number] = NetworkCopyResult(name, error=error).to_dict()
+
+    for location, names in names_by_location.items():
+        try:
+            if location == hostname:
+                copy_results = vsphere_api.copy_networks_to_many(
+                    from_name, names, dry_run=dry_run
+                )
+            else:
+                logger.info(f"Copying networks from {hostname} to {location}.")
+                copy_results = _copy_across_vcenters(
+                    vsphere_api, location, from_name, names, dry_run
+                )
+        except DeadlineExceeded:
+            logger.warning("Out of time, the network copy stopped before completion.")
+            raise
+        except Exception as e:
+            logger.error("There was an error during the network copy process.", e)
+            raise Exception(
+                f"There was an error during the network copy process. {str(e)}"
+            )
+
+        for name, result in copy_results.items():
+            results[device_numbers_by_host[(location, name)][0]] = result.to_dict()
+
+    logger.debug("Network copy complete.")
+    return {
+        device_number: results[device_number] for device_number in to_device_numbers
+    }
+
+
+def _copy_across_vcenters(vsphere_api, location, from_name, to_names, dry_run):
+    """
+    Copies to the destinations of another vCenter one at a time, over one
+    session of that vCenter. A failure on one destination, or to connect,
+    is its result rather than raised.
+    """
+    try:
+        to_vsphere_api = _connect(location)
+    except Exception as e:
+        return {name: NetworkCopyResult(name, error=str(e)) for name in to_names}
+
+    results = {}
+    for name in to_names:
+        try:
+            plan = to_vsphere_api.copy_networks_from(
+                vsphere_api,
+                from_name,
+                name,
+                dry_run=dry_run,
+                checkpoint_store=CHECKPOINT_STORE,
+            )
+            results[name] = NetworkCopyResult(name, plan=plan)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            results[name] = NetworkCopyResult(name, error=str(e))
+    return results
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from common import secrets
+
+# Seconds every simulated vCenter call takes, e.g. 0.05 for a remote vCenter
+SIMULATED_LATENCY = float(os.environ.get("VSPHERE_SIM_LATENCY", "0"))
+
+RESULTS = []
+
+
+@pytest.fixture(autouse=True)
+def monkeypatch_ssm(monkeypatch):
+    def mock_return(path):
+        return "SECRET"
+
+    monkeypatch.setattr(secrets, "get_parameter", mock_return)
+
+
+@pytest.fixture
+def latency():
+    return SIMULATED_LATENCY
+
+
+@pytest.fixture
+def bench_report():
+    def _report(name, **measures):
+        RESULTS.append((name, measures))
+
+    return _report
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not RESULTS:
+        return
+    terminalreporter.section("benchmarks")
+    terminalreporter.write_line(f"simulated latency per call: {SIMULATED_LATENCY}s")
+    for name, measures in RESULTS:
+        summary = ", ".join(f"{key}={value}" for key, value in measures.items())
+        terminalreporter.write_line(f"{name}: {summary}")
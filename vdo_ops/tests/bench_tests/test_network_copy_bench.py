@@ -0,0 +1,93 @@
+import math
+import time
+
+import pytest
+
+from tests.helper.vsphere_simulator import SimulatedVcenter
+
+VCENTER_HOST = "vcenter.simulated"
+SOURCE_HOST = "source.simulated"
+DESTINATION_HOST = "destination.simulated"
+
+# Round trips of a batched copy: content, host index (view, retrieve, destroy),
+# the two network snapshots and the content and Logout calls of the disconnect,
+# then the network system and UpdateNetworkConfig for every chunk of changes.
+FIXED_ROUND_TRIPS = 8
+ROUND_TRIPS_PER_UPDATE = 2
+
+
+def make_vcenter(portgroups, latency):
+    vcenter = SimulatedVcenter(latency=latency)
+    vcenter.add_host(
+        SOURCE_HOST,
+        vswitches=max(1, portgroups // 25),
+        portgroups=portgroups,
+        vnics=2,
+    )
+    vcenter.add_host(DESTINATION_HOST)
+    for index in range(50):
+        vcenter.add_host(f"esx{index}.simulated", vswitches=1, portgroups=1)
+    return vcenter
+
+
+@pytest.mark.parametrize("portgroups", [10, 100, 1000])
+@pytest.mark.parametrize("batch", [True, False], ids=["batch", "one_by_one"])
+def test_copy_networks_scale(get_handler, latency, bench_report, portgroups, batch):
+    vsphere_api = get_handler("common.vsphere_api")
+    vcenter = make_vcenter(portgroups, latency)
+
+    with vcenter.connect():
+        api = vsphere_api.VsphereApi(VCENTER_HOST)
+        start = time.perf_counter()
+        plan = api.copy_networks(SOURCE_HOST, DESTINATION_HOST, batch=batch)
+        elapsed = time.perf_counter() - start
+
+    metrics = api._client.metrics
+    destination = vcenter.hosts[DESTINATION_HOST]
+    assert len(plan.portgroups_to_add) == portgroups - 2
+    assert set(destination.portgroups) == {
+        change.name for change in plan.portgroups_to_add
+    }
+    assert vcenter.view_count() == 0
+
+    mode = "batch" if batch else "one_by_one"
+    bench_report(
+        f"copy_networks[{mode}-{portgroups}]",
+        seconds=round(elapsed, 4),
+        round_trips=metrics.round_trips(),
+    )
+
+    if batch:
+        changes = len(plan.vswitches_to_add) + len(plan.portgroups_to_add)
+        updates = math.ceil(changes / vsphere_api.MAX_CHANGES_PER_UPDATE)
+        assert metrics.round_trips("UpdateNetworkConfig") == updates
+        assert (
+            metrics.round_trips()
+            == FIXED_ROUND_TRIPS + ROUND_TRIPS_PER_UPDATE * updates
+        )
+    else:
+        assert metrics.round_trips("AddPortGroup") == portgroups - 2
+
+
+@pytest.mark.parametrize("destinations", [1, 8])
+def test_copy_networks_to_many_scale(get_handler, latency, bench_report, destinations):
+    vsphere_api = get_handler("common.vsphere_api")
+    vcenter = make_vcenter(100, latency)
+    names = [f"esx{index}.simulated" for index in range(destinations)]
+
+    with vcenter.connect():
+        api = vsphere_api.VsphereApi(VCENTER_HOST)
+        start = time.perf_counter()
+        results = api.copy_networks_to_many(SOURCE_HOST, names)
+        elapsed = time.perf_counter() - start
+
+    assert all(result.succeeded for result in results.values())
+    for name in names:
+        # VLAN100 was there already, VLAN101 has a vnic on the source
+        assert len(vcenter.hosts[name].portgroups) == 99
+
+    bench_report(
+        f"copy_networks_to_many[{destinations}]",
+        seconds=round(elapsed, 4),
+        round_trips=api._client.metrics.round_trips(),
+    )
@@ -0,0 +1,250 @@
+"""
+Benchmarks of the Zamboni client: the GOSS service value enrichment against
+the field by field lookup it replaced, the memory used to decode VM pages
+whole or streamed, the memory held by VM dicts and VmRecords, and paging
+through many vCenters one after the other or concurrently.
+"""
+import json
+import time
+import tracemalloc
+
+import pytest
+from mock import Mock, patch
+
+FIELD_COUNTS = [10, 50]
+VM_COUNT = 2000
+STREAMED_VM_COUNTS = [500, 2000]
+RECORD_VM_COUNT = 2000
+VCENTER_COUNT = 8
+PAGES_PER_VCENTER = 3
+PAGE_LATENCY = 0.02  # seconds Zamboni takes to return a page
+
+
+def legacy_service_value(vm, services_list):
+    """
+    The lookup used before: a scan of availableField for the key, then of
+    value for its value, for each service.
+    """
+
+    def get_custom_attribute_value(definition):
+        attr = next(
+            (f for f in vm.get("availableField", []) if f.get("name") == definition),
+            None,
+        )
+        if not attr:
+            return None
+        return next(
+            (v for v in vm.get("value", []) if v.get("key") == attr.get("key")), {}
+        ).get("value", None)
+
+    result = 0
+    for name, bit in services_list:
+        if get_custom_attribute_value(name) == "enrolled":
+            result |= bit
+    return result
+
+
+def make_vms(services_list, field_count):
+    # The service fields come last, the worst case for a linear scan
+    names = [f"custom.field.{index}" for index in range(field_count)]
+    names += [name for name, _ in services_list]
+    fields = [{"key": key, "name": name} for key, name in enumerate(names)]
+    vms = []
+    for index in range(VM_COUNT):
+        values = [
+            {"key": key, "value": "enrolled" if (index + key) % 3 else "value"}
+            for key in range(len(fields))
+        ]
+        vms.append({"location": "vcenter", "availableField": fields, "value": values})
+    return vms
+
+
+@pytest.mark.parametrize("field_count", FIELD_COUNTS)
+def test_apply_service_value(get_handler, bench_report, field_count):
+    zamboni = get_handler("common.clients.zamboni").Zamboni("endpoint", Mock())
+    vms = make_vms(zamboni.services_list, field_count)
+
+    start = time.perf_counter()
+    expected = [legacy_service_value(vm, zamboni.services_list) for vm in vms]
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    zamboni._apply_service_value(vms)
+    seconds = time.perf_counter() - start
+
+    assert [vm["service_value"] for vm in vms] == expected
+    bench_report(
+        f"apply_service_value[{VM_COUNT}x{field_count}]",
+        seconds=round(seconds, 4),
+        legacy_seconds=round(legacy_seconds, 4),
+        speedup=round(legacy_seconds / seconds, 1),
+    )
+
+
+def make_page_chunks(vm_count, chunk_size=64 * 1024):
+    from tests.helper import util
+
+    page = util.load_json_file("data/zamboni/get_vm_list.json")
+    vms = page["data"]
+    page["data"] = [dict(vms[index % len(vms)]) for index in range(vm_count)]
+    raw = json.dumps(page).encode("utf-8")
+    chunks = []
+    for start in range(0, len(raw), chunk_size):
+        end = start + chunk_size
+        chunks.append(raw[start:end])
+    return raw, chunks
+
+
+def peak_memory(f):
+    tracemalloc.start()
+    try:
+        f()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize("vm_count", STREAMED_VM_COUNTS)
+def test_stream_vms_memory(get_handler, bench_report, vm_count):
+    zamboni_module = get_handler("common.clients.zamboni")
+    zamboni = zamboni_module.Zamboni("endpoint", Mock())
+    raw, chunks = make_page_chunks(vm_count)
+
+    def whole():
+        data = json.loads(raw)["data"]
+        zamboni._apply_service_value(data)
+        zamboni._apply_org_to_metadata(data)
+        assert len(data) == vm_count
+
+    def streamed():
+        response = Mock(status_code=200)
+        response.iter_content.return_value = iter(chunks)
+        session = Mock(**{"get.return_value": response})
+        with patch.object(zamboni_module, "IdentitySession") as session_class:
+            session_class.return_value.__enter__.return_value = session
+            count = sum(1 for _ in zamboni.stream_vms_by_vcenter("vcenter"))
+        assert count == vm_count
+
+    whole_peak = peak_memory(whole)
+    streamed_peak = peak_memory(streamed)
+
+    # Streaming holds a chunk and a VM at a time, not the decoded page
+    assert streamed_peak < whole_peak / 4
+    bench_report(
+        f"zamboni_page_decode[{vm_count}]",
+        body_kib=len(raw) // 1024,
+        whole_peak_kib=whole_peak // 1024,
+        streamed_peak_kib=streamed_peak // 1024,
+    )
+
+
+def retained_memory(f):
+    tracemalloc.start()
+    try:
+        result = f()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def test_vm_records_memory(get_handler, bench_report):
+    vm_record = get_handler("common.clients.vm_record")
+    raw, _ = make_page_chunks(RECORD_VM_COUNT)
+    # Decoded one by one, as streamed, so no VM shares anything with another
+    encoded = [json.dumps(vm) for vm in json.loads(raw)["data"]]
+
+    dicts, dicts_bytes = retained_memory(lambda: [json.loads(vm) for vm in encoded])
+
+    def build_records():
+        tables = vm_record.FieldTables()
+        return [vm_record.VmRecord.from_dict(json.loads(vm), tables) for vm in encoded]
+
+    records, records_bytes = retained_memory(build_records)
+
+    name = "com.rackspace.goss.vm.services.patching"
+    start = time.perf_counter()
+    expected = [
+        next(
+            (
+                v.get("value")
+                for f in vm["availableField"]
+                if f["name"] == name
+                for v in vm["value"]
+                if v["key"] == f["key"]
+            ),
+            None,
+        )
+        for vm in dicts
+    ]
+    dict_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = [record.custom_attribute(name) for record in records]
+    record_seconds = time.perf_counter() - start
+
+    assert actual == expected
+    # availableField is held once per vCenter instead of once per VM
+    assert records_bytes < dicts_bytes * 3 / 4
+    bench_report(
+        f"vm_records[{RECORD_VM_COUNT}]",
+        dicts_kib=dicts_bytes // 1024,
+        records_kib=records_bytes // 1024,
+        dict_lookup_seconds=round(dict_seconds, 4),
+        record_lookup_seconds=round(record_seconds, 4),
+    )
+
+
+def test_get_vms_by_vcenters(get_handler, bench_report):
+    from tests.helper import util
+
+    zamboni_module = get_handler("common.clients.zamboni")
+    zamboni = zamboni_module.Zamboni("endpoint", Mock())
+    vms = util.load_json_file("data/zamboni/get_vm_list.json")["data"]
+    vcenters = [f"vcenter-{index}" for index in range(VCENTER_COUNT)]
+    # The last vCenter is four times slower than the others
+    latencies = {vcenter: PAGE_LATENCY for vcenter in vcenters}
+    latencies[vcenters[-1]] = PAGE_LATENCY * 4
+
+    def get(url, params):
+        time.sleep(latencies[params["filters[location]"]])
+        page_number = int(params.get("page", 1))
+        last_page = page_number == PAGES_PER_VCENTER
+        meta = {
+            "current_page": page_number,
+            "last_page": last_page,
+            "next_page": None if last_page else page_number + 1,
+            "next_token": None,
+        }
+        body = {"data": [dict(vm) for vm in vms], "meta": meta}
+        return Mock(status_code=200, **{"json.return_value": body})
+
+    with patch.object(zamboni_module, "IdentitySession") as session_class:
+        session_class.return_value.__enter__.return_value = Mock(
+            **{"get.side_effect": get}
+        )
+
+        start = time.perf_counter()
+        serial = [
+            (vcenter, page)
+            for vcenter in vcenters
+            for page in zamboni.get_vm_pages_by_vcenter(vcenter)
+        ]
+        serial_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        first_seconds = None
+        concurrent = []
+        for item in zamboni.get_vms_by_vcenters(vcenters):
+            if first_seconds is None:
+                first_seconds = time.perf_counter() - start
+            concurrent.append(item)
+        concurrent_seconds = time.perf_counter() - start
+
+    assert len(concurrent) == len(serial) == VCENTER_COUNT * PAGES_PER_VCENTER
+    assert concurrent_seconds < serial_seconds / 2
+    bench_report(
+        f"get_vms_by_vcenters[{VCENTER_COUNT}x{PAGES_PER_VCENTER}]",
+        serial_seconds=round(serial_seconds, 3),
+        concurrent_seconds=round(concurrent_seconds, 3),
+        first_page_seconds=round(first_seconds, 3),
+    )
@@ -5,6 +5,14 @@ from common import constants
 from common.clients.boto import ClientType
 
 
+@pytest.fixture(autouse=True)
+def clear_clients(get_handler):
+    boto = get_handler("common.clients.boto")
+    boto.clear_clients()
+    yield
+    boto.clear_clients()
+
+
 def test_get_boto_session(get_handler):
     boto = get_handler("common.clients.boto")
 
@@ -193,3 +201,43 @@ def test_get_state_machine_status(get_handler):
         batch_client_mock.describe_execution.assert_called_with(
             executionArn="execution_arn"
         )
+
+
+def test_get_client_with_deadline(get_handler):
+    from common.deadline import Deadline
+
+    boto = get_handler("common.clients.boto")
+    session_mock = mock.Mock()
+
+    with mock.patch.object(boto, "get_boto_session", return_value=session_mock):
+        with Deadline(10, margin=0).activate():
+            first = boto.get_client(ClientType.DDB)
+            second = boto.get_client(ClientType.DDB)
+        with Deadline(3, margin=0).activate():
+            boto.get_client(ClientType.DDB)
+
+    assert first is second
+    configs = [c[1]["config"] for c in session_mock.client.call_args_list]
+    assert [(c.connect_timeout, c.read_timeout) for c in configs] == [(5, 5), (2, 2)]
+
+
+def test_get_client_is_cached(get_handler):
+    boto = get_handler("common.clients.boto")
+
+    with mock.patch.object(boto, "get_boto_session") as get_boto_session_mock:
+        first = boto.get_client(ClientType.DDB)
+        second = boto.get_client(ClientType.DDB)
+
+    assert first is second
+    get_boto_session_mock.assert_called_once()
+
+
+def test_get_client_checks_deadline(get_handler):
+    from common.deadline import Deadline, DeadlineExceeded
+
+    boto = get_handler("common.clients.boto")
+
+    with mock.patch.object(boto, "get_boto_session"):
+        with Deadline(0.5, margin=0).activate():
+            with pytest.raises(DeadlineExceeded):
+                boto.get_client(ClientType.DDB)
@@ -0,0 +1,74 @@
+from tests.helper import util
+
+TARGET_MODULE = "common.clients.vm_record"
+
+SERVICES = [
+    ("com.rackspace.goss.vm.services.os.admin", 1),
+    ("com.rackspace.goss.vm.services.monitoring", 2),
+]
+
+
+def load_vms():
+    return util.load_json_file("data/zamboni/get_vm_list.json")["data"]
+
+
+def test_records_share_field_table(get_handler):
+    vm_record = get_handler(TARGET_MODULE)
+    tables = vm_record.FieldTables()
+
+    records = [vm_record.VmRecord.from_dict(vm, tables) for vm in load_vms()]
+
+    assert all(record.fields is records[0].fields for record in records)
+    assert all(record.location is records[0].location for record in records)
+    assert records[0].name == "Hounsou-Test-2012-Std"
+    assert records[0].custom_attribute("com.rackspace.deviceId") == "1098922"
+    assert records[0].custom_attribute("unknown") is None
+
+
+def test_record_with_other_fields_gets_own_table(get_handler):
+    vm_record = get_handler(TARGET_MODULE)
+    tables = vm_record.FieldTables()
+    vms = load_vms()
+    other = dict(vms[1], availableField=[{"key": 1, "name": "only"}])
+    other["value"] = [{"key": 1, "value": "enrolled"}]
+
+    first = vm_record.VmRecord.from_dict(vms[0], tables)
+    second = vm_record.VmRecord.from_dict(other, tables)
+    third = vm_record.VmRecord.from_dict(vms[2], tables)
+
+    assert second.fields is not first.fields
+    assert third.fields is first.fields
+    assert second.custom_attribute("only") == "enrolled"
+
+
+def test_field_table_service_keys(get_handler):
+    vm_record = get_handler(TARGET_MODULE)
+
+    table = vm_record.FieldTable(
+        [
+            {"key": 1, "name": SERVICES[0][0]},
+            {"key": 2, "name": SERVICES[0][0]},
+            {"key": 3, "name": "other"},
+        ]
+    )
+
+    assert table.service_keys(SERVICES) == {1: 1}
+    assert table.service_keys(SERVICES) is table.service_keys(SERVICES)
+
+
+def test_record_to_dict(get_handler):
+    vm_record = get_handler(TARGET_MODULE)
+    vm = load_vms()[0]
+
+    record = vm_record.VmRecord.from_dict(vm, vm_record.FieldTables())
+    record.service_value = 3
+    record.org_id = vm["provider_account_id"]
+    actual = record.to_dict()
+
+    assert actual["availableField"] == vm["availableField"]
+    assert actual["value"] == vm["value"]
+    assert actual["guest"] == vm["guest"]
+    assert actual["config$uuid"] == vm["config$uuid"]
+    assert actual["_metadata"]["orgId"] == vm["provider_account_id"]
+    assert actual["service_value"] == 3
+    assert "orgId" not in vm["_metadata"]
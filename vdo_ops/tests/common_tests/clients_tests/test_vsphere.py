@@ -1,6 +1,8 @@
+import threading
+
 import pytest
 from mock import mock, Mock
-from pyVmomi import vim
+from pyVmomi import vim, vmodl
 from common import secrets
 
 HOST = "test-vcenter-name"
@@ -26,6 +28,46 @@ def get_protected_value(obj, name):
     return getattr(obj, f"_{class_name}__{name}")
 
 
+def mock_inventory(si_mock, objects):
+    content = si_mock.RetrieveContent.return_value
+    content.viewManager.CreateContainerView.return_value = vim.view.ContainerView(
+        "view-1", Mock()
+    )
+    content.propertyCollector.RetrievePropertiesEx.return_value = Mock(
+        objects=[
+            Mock(obj=obj, propSet=[vmodl.DynamicProperty(name="name", val=obj.name)])
+            for obj in objects
+        ],
+        token=None,
+    )
+    return content
+
+
+def to_property(name, val):
+    prop = Mock(val=val)
+    prop.name = name
+    return prop
+
+
+def mock_host_network(si_mock, **network):
+    host = vim.HostSystem("host-1", Mock())
+    content = si_mock.RetrieveContent.return_value
+    content.viewManager.CreateContainerView.return_value = vim.view.ContainerView(
+        "view-1", Mock()
+    )
+
+    def retrieve(filter_specs, options):
+        if filter_specs[0].propSet[0].pathSet == ["name"]:
+            properties = {"name": "host"}
+        else:
+            properties = {f"config.network.{k}": v for k, v in network.items()}
+        prop_set = [to_property(k, v) for k, v in properties.items()]
+        return Mock(objects=[Mock(obj=host, propSet=prop_set)], token=None)
+
+    content.propertyCollector.RetrievePropertiesEx.side_effect = retrieve
+    return content
+
+
 @pytest.fixture
 def vmware_fixture(get_handler):
     vmware = get_handler("common.clients.vsphere")
@@ -62,6 +104,58 @@ def test_init_connection(vmware_fixture):
         assert get_protected_value(client, "local_data").si == si_mock
 
 
+def test_init_connection_with_session_pool(get_handler):
+    vmware = get_handler("common.clients.vsphere")
+    pool = Mock()
+    si_mock = Mock()
+    pool.acquire.return_value = si_mock
+    client = vmware.VsphereClient(HOST, session_pool=pool)
+
+    with mock.patch.object(vmware, "connect") as connect_mock:
+        with client.open_session():
+            assert get_protected_value(client, "local_data").si == si_mock
+
+        connect_mock.SmartConnectNoSSL.assert_not_called()
+        connect_mock.Disconnect.assert_not_called()
+
+    pool.acquire.assert_called_once_with(HOST)
+    pool.release.assert_called_once_with(HOST, si_mock)
+
+
+@pytest.mark.parametrize(
+    "error",
+    [vim.fault.NotAuthenticated(), ConnectionResetError(), TimeoutError()],
+)
+def test_open_session_discards_broken_session(get_handler, error):
+    vmware = get_handler("common.clients.vsphere")
+    pool = Mock()
+    si_mock = Mock()
+    pool.acquire.return_value = si_mock
+    client = vmware.VsphereClient(HOST, session_pool=pool)
+
+    with pytest.raises(type(error)):
+        with client.open_session():
+            raise error
+
+    pool.discard.assert_called_once_with(HOST, si_mock)
+    pool.release.assert_not_called()
+
+
+def test_open_session_releases_session_after_other_error(get_handler):
+    vmware = get_handler("common.clients.vsphere")
+    pool = Mock()
+    si_mock = Mock()
+    pool.acquire.return_value = si_mock
+    client = vmware.VsphereClient(HOST, session_pool=pool)
+
+    with pytest.raises(Exception, match="Host not found"):
+        with client.open_session():
+            raise Exception("Host not found")
+
+    pool.release.assert_called_once_with(HOST, si_mock)
+    pool.discard.assert_not_called()
+
+
 def test_close_connection(vmware_fixture):
     vmware_handler, client, si_mock = vmware_fixture
 
@@ -112,6 +206,61 @@ def test_open_session_with_exception(vmware_fixture):
         close_connection_mock.assert_called()
 
 
+def test_clone_session(vmware_fixture):
+    vmware_handler, client, si_mock = vmware_fixture
+
+    with mock.patch.object(vmware_handler, "connect") as connect_mock:
+        stub = Mock()
+        invoke_accessor = stub.InvokeAccessor
+        connect_mock.SmartStubAdapter.return_value = stub
+
+        actual = client._clone_session()
+
+        session_manager = si_mock.content.sessionManager
+        session_manager.AcquireCloneTicket.assert_called_once()
+        assert connect_mock.SmartStubAdapter.call_args[1]["host"] == HOST
+        assert actual._stub == stub
+        invoke_accessor.return_value.sessionManager.CloneSession.assert_called_with(
+            session_manager.AcquireCloneTicket.return_value
+        )
+
+
+def test_worker_thread_uses_cloned_session(vmware_fixture):
+    vmware_handler, client, si_mock = vmware_fixture
+
+    view1 = Mock(vim.View)
+    view1.name = "name1"
+    clone_si = Mock()
+    mock_inventory(clone_si, [view1])
+    results = []
+
+    with mock.patch.object(client, "_clone_session", return_value=clone_si):
+        worker = threading.Thread(
+            target=lambda: results.append(client.get_host_system("name1"))
+        )
+        worker.start()
+        worker.join()
+
+    assert results == [view1]
+    clone_si.RetrieveContent.assert_called_once()
+    si_mock.RetrieveContent.assert_not_called()
+    assert get_protected_value(client, "local_data").si == si_mock
+
+
+def test_close_connection_logs_out_clones(vmware_fixture):
+    vmware_handler, client, si_mock = vmware_fixture
+
+    clone_si = Mock()
+    get_protected_value(client, "clones").append(clone_si)
+
+    with mock.patch.object(vmware_handler, "connect") as connect_mock:
+        client.close_connection()
+
+        clone_si.content.sessionManager.Logout.assert_called_once()
+        connect_mock.Disconnect.assert_called_once_with(si_mock)
+        assert get_protected_value(client, "clones") == []
+
+
 def test__get_obj(vmware_fixture):
     vmware_handler, client, si_mock = vmware_fixture
 
@@ -121,14 +270,71 @@ def test__get_obj(vmware_fixture):
     view2.name = "name2"
     view3 = Mock(vim.View)
     view3.name = "name3"
-    container = Mock(view=[view1, view2, view3])
-    view_manager = Mock()
-    view_manager.CreateContainerView = Mock(return_value=container)
+    mock_inventory(si_mock, [view1, view2, view3])
 
-    si_mock.RetrieveContent.return_value.viewManager = view_manager
-    actual = client._get_obj("type", "name1")
+    actual = client._get_obj(vim.HostSystem, "name1")
     si_mock.RetrieveContent.assert_called()
     assert actual == view1
+    assert client._get_obj(vim.HostSystem, "name4") is None
+
+
+def test__get_obj_indexes_inventory_once(vmware_fixture):
+    vmware_handler, client, si_mock = vmware_fixture
+
+    view1 = Mock(vim.View)
+    view1.name = "name1"
+    view2 = Mock(vim.View)
+    view2.name = "name2"
+    content = mock_inventory(si_mock, [view1, view2])
+    container = content.viewManager.CreateContainerView.return_value
+
+    assert client._get_obj(vim.HostSystem, "name1") == view1
+    assert client._get_obj(vim.HostSystem, "name2") == view2
+    assert client.get_host_system("name1") == view1
+
+    si_mock.RetrieveContent.assert_called_once()
+    content.viewManager.CreateContainerView.assert_called_once_with(
+        content.rootFolder, [vim.HostSystem], True
+    )
+    content.propertyCollector.RetrievePropertiesEx.assert_called_once()
+    container._stub.InvokeMethod.assert_called_once()
+
+
+def test__get_obj_follows_continuation_token(vmware_fixture):
+    vmware_handler, client, si_mock = vmware_fixture
+
+    view1 = Mock(vim.View)
+    view1.name = "name1"
+    view2 = Mock(vim.View)
+    view2.name = "name2"
+    content = mock_inventory(si_mock, [view1])
+    collector = content.propertyCollector
+    collector.RetrievePropertiesEx.return_value.token = "token-1"
+    collector.ContinueRetrievePropertiesEx.return_value = Mock(
+        objects=[
+            Mock(obj=view2, propSet=[vmodl.DynamicProperty(name="name", val="name2")])
+        ],
+        token=None,
+    )
+
+    assert client._get_obj(vim.HostSystem, "name2") == view2
+    collector.ContinueRetrievePropertiesEx.assert_called_once_with("token-1")
+
+
+def test_close_connection_clears_inventory(vmware_fixture):
+    vmware_handler, client, si_mock = vmware_fixture
+
+    view1 = Mock(vim.View)
+    view1.name = "name1"
+    content = mock_inventory(si_mock, [view1])
+    client.get_host_system("name1")
+
+    with mock.patch.object(vmware_handler, "connect"):
+        client.close_connection()
+
+    assert get_protected_value(client, "local_data").inventory == {}
+    assert get_protected_value(client, "local_data").content is None
+    content.propertyCollector.RetrievePropertiesEx.assert_called_once()
 
 
 def test_get_host_system(vmware_fixture):
@@ -140,42 +346,156 @@ def test_get_host_system(vmware_fixture):
     view2.name = "host2"
     view3 = Mock(vim.View)
     view3.name = "name3"
-    container = Mock(view=[view1, view2, view3])
-    view_manager = Mock()
-    view_manager.CreateContainerView = Mock(return_value=container)
+    mock_inventory(si_mock, [view1, view2, view3])
 
-    si_mock.RetrieveContent.return_value.viewManager = view_manager
     actual = client.get_host_system("host2")
     si_mock.RetrieveContent.assert_called()
     assert actual == view2
 
 
+def test_get_host_network_snapshot(vmware_fixture):
+    vmware_handler, client, si_mock = vmware_fixture
+
+    switch = Mock()
+    switch.name = "s1"
+    portgroup = Mock(vswitch="ab-cd-s1")
+    portgroup.spec.name = "p1"
+    vnic = Mock(portgroup="p2")
+    content = mock_host_network(
+        si_mock, vswitch=[switch], portgroup=[portgroup], vnic=[vnic]
+    )
+
+    # when
+    actual = client.get_host_network_snapshot("host")
+
+    # then
+    assert actual.host_name == "host"
+    assert actual.vswitches == (switch,)
+    assert actual.portgroups == (portgroup,)
+    assert actual.vnics == (vnic,)
+    assert actual.console_vnics == ()
+
+    host_filter = content.propertyCollector.RetrievePropertiesEx.call_args[0][0][0]
+    assert host_filter.objectSet[0].obj == vim.HostSystem("host-1")
+    assert host_filter.propSet[0].pathSet == [
+        "config.network.vswitch",
+        "config.network.portgroup",
+        "config.network.vnic",
+        "config.network.consoleVnic",
+    ]
+
+
+def test_export_network_profile(vmware_fixture):
+    vmware_handler, client, si_mock = vmware_fixture
+
+    switch = vim.host.VirtualSwitch(
+        name="s1", spec=vim.host.VirtualSwitch.Specification(numPorts=64)
+    )
+    portgroups = [
+        vim.host.PortGroup(
+            spec=vim.host.PortGroup.Specification(name=name, vlanId=0),
+            vswitch="key-vim.host.VirtualSwitch-s1",
+        )
+        for name in ["p1", "p2"]
+    ]
+    mock_host_network(
+        si_mock,
+        vswitch=[switch],
+        portgroup=portgroups,
+        vnic=[Mock(portgroup="p2")],
+    )
+
+    # when
+    actual = client.export_network_profile("host")
+
+    # then
+    assert actual.host_name == "host"
+    assert actual.vswitch_names == {"s1"}
+    assert actual.portgroup_names == {"p1"}
+
+
+def test_get_cluster_network_snapshots(vmware_fixture):
+    vmware_handler, client, si_mock = vmware_fixture
+
+    cluster = Mock()
+    switch = Mock()
+    switch.name = "s1"
+    content = si_mock.RetrieveContent.return_value
+    content.viewManager.CreateContainerView.return_value = vim.view.ContainerView(
+        "view-1", Mock()
+    )
+    content.propertyCollector.RetrievePropertiesEx.side_effect = [
+        Mock(
+            objects=[Mock(obj=cluster, propSet=[to_property("name", "c1")])], token=None
+        ),
+        Mock(
+            objects=[
+                Mock(
+                    obj=Mock(),
+                    propSet=[
+                        to_property("name", "host1"),
+                        to_property("config.network.vswitch", [switch]),
+                    ],
+                ),
+                Mock(obj=Mock(), propSet=[to_property("name", "host2")]),
+            ],
+            token=None,
+        ),
+    ]
+
+    # when
+    actual = client.get_cluster_network_snapshots("c1")
+
+    # then
+    assert sorted(actual) == ["host1", "host2"]
+    assert actual["host1"].vswitches == (switch,)
+    assert actual["host2"].vswitches == ()
+    content.viewManager.CreateContainerView.assert_called_with(
+        cluster, [vim.HostSystem], True
+    )
+    host_filter = content.propertyCollector.RetrievePropertiesEx.call_args[0][0][0]
+    assert host_filter.propSet[0].pathSet == [
+        "name",
+        "config.network.vswitch",
+        "config.network.portgroup",
+        "config.network.vnic",
+        "config.network.consoleVnic",
+    ]
+
+
+def test_get_host_network_snapshot_unknown_host(vmware_fixture):
+    vmware_handler, client, si_mock = vmware_fixture
+    mock_host_network(si_mock)
+
+    with pytest.raises(Exception):
+        client.get_host_network_snapshot("unknown")
+
+
+def test_host_network_snapshot_is_immutable(get_handler):
+    vmware = get_handler("common.clients.vsphere")
+
+    snapshot = vmware.HostNetworkSnapshot("host")
+
+    with pytest.raises(AttributeError):
+        snapshot.vswitches = ()
+    with pytest.raises(AttributeError):
+        snapshot.extra = "value"
+
+
 def test_get_host_portgroups(vmware_fixture):
     vmware_handler, client, si_mock = vmware_fixture
     portgroup = Mock()
-    view1 = Mock(vim.View)
-    view1.name = "host"
-    view1.config = Mock(network=Mock(portgroup=portgroup))
-    container = Mock(view=[view1])
-    view_manager = Mock()
-    view_manager.CreateContainerView = Mock(return_value=container)
-    si_mock.RetrieveContent.return_value.viewManager = view_manager
+    mock_host_network(si_mock, portgroup=[portgroup])
 
-    assert client.get_host_portgroups("host") == portgroup
+    assert client.get_host_portgroups("host") == (portgroup,)
 
 
 def test_get_host_virtual_switches(vmware_fixture):
     vmware_handler, client, si_mock = vmware_fixture
     vswitch = Mock()
-    view1 = Mock(vim.View)
-    view1.name = "host"
-    view1.config = Mock(network=Mock(vswitch=vswitch))
-    container = Mock(view=[view1])
-    view_manager = Mock()
-    view_manager.CreateContainerView = Mock(return_value=container)
-    si_mock.RetrieveContent.return_value.viewManager = view_manager
+    mock_host_network(si_mock, vswitch=[vswitch])
 
-    assert client.get_host_virtual_switches("host") == vswitch
+    assert client.get_host_virtual_switches("host") == (vswitch,)
 
 
 def test_get_portgroup_by_vswitch(vmware_fixture):
@@ -184,14 +504,7 @@ def test_get_portgroup_by_vswitch(vmware_fixture):
     portgroup1 = Mock(vswitch="ab-cd-switch1")
     portgroup2 = Mock(vswitch="ab-cd-switch0")
     portgroup3 = Mock(vswitch="ab-cd-switch2")
-
-    view1 = Mock(vim.View)
-    view1.name = "host"
-    view1.config = Mock(network=Mock(portgroup=[portgroup1, portgroup2, portgroup3]))
-    container = Mock(view=[view1])
-    view_manager = Mock()
-    view_manager.CreateContainerView = Mock(return_value=container)
-    si_mock.RetrieveContent.return_value.viewManager = view_manager
+    mock_host_network(si_mock, portgroup=[portgroup1, portgroup2, portgroup3])
 
     assert client.get_portgroup_by_vswitch("host", "switch1") == [portgroup1]
 
@@ -203,16 +516,9 @@ def test_do_not_copy(vmware_fixture):
     vnic2 = Mock(portgroup="p2")
     console_vnic1 = Mock(portgroup="p3")
     console_vnic2 = Mock(portgroup="p4")
-
-    view1 = Mock(vim.View)
-    view1.name = "host"
-    view1.config = Mock(
-        network=Mock(vnic=[vnic1, vnic2], consoleVnic=[console_vnic1, console_vnic2])
+    mock_host_network(
+        si_mock, vnic=[vnic1, vnic2], consoleVnic=[console_vnic1, console_vnic2]
     )
-    container = Mock(view=[view1])
-    view_manager = Mock()
-    view_manager.CreateContainerView = Mock(return_value=container)
-    si_mock.RetrieveContent.return_value.viewManager = view_manager
 
     assert client.get_do_not_copy_list("host") == [
         vnic1,
@@ -232,14 +538,7 @@ def test_has_portgroup(vmware_fixture):
     spec = Mock()
     spec.name = "p1"
     vnic.spec = spec
-
-    view1 = Mock(vim.View)
-    view1.name = "host"
-    view1.config = Mock(network=Mock(portgroup=[vnic]))
-    container = Mock(view=[view1])
-    view_manager = Mock()
-    view_manager.CreateContainerView = Mock(return_value=container)
-    si_mock.RetrieveContent.return_value.viewManager = view_manager
+    mock_host_network(si_mock, portgroup=[vnic])
 
     assert client.has_portgroup("host", "p1") is True
     assert client.has_portgroup("host", "p187") is False
@@ -250,14 +549,7 @@ def test_has_vswitch(vmware_fixture):
 
     switch = Mock()
     switch.name = "s1"
-
-    view1 = Mock(vim.View)
-    view1.name = "host"
-    view1.config = Mock(network=Mock(vswitch=[switch]))
-    container = Mock(view=[view1])
-    view_manager = Mock()
-    view_manager.CreateContainerView = Mock(return_value=container)
-    si_mock.RetrieveContent.return_value.viewManager = view_manager
+    mock_host_network(si_mock, vswitch=[switch])
 
     assert client.has_virtual_switch("host", "s1") is True
     assert client.has_virtual_switch("host", "s3") is False
@@ -273,10 +565,7 @@ def test_add_host_portgroup(vmware_fixture):
     network_system.AddPortGroup = Mock(return_value=Mock())
     config_manager.networkSystem = network_system
     view1.configManager = config_manager
-    container = Mock(view=[view1])
-    view_manager = Mock()
-    view_manager.CreateContainerView = Mock(return_value=container)
-    si_mock.RetrieveContent.return_value.viewManager = view_manager
+    mock_inventory(si_mock, [view1])
     portgroup_spec = Mock()
 
     # when
@@ -284,3 +573,322 @@ def test_add_host_portgroup(vmware_fixture):
 
     # then
     network_system.AddPortGroup.assert_called_with(portgroup_spec)
+
+
+def test_session_pool_reuses_session(get_handler):
+    vmware = get_handler("common.clients.vsphere")
+    pool = vmware.VsphereSessionPool(max_sessions=2)
+
+    with mock.patch.object(vmware, "connect") as connect_mock:
+        si_mock = Mock()
+        connect_mock.SmartConnectNoSSL.return_value = si_mock
+
+        first = pool.acquire(HOST)
+        pool.release(HOST, first)
+        second = pool.acquire(HOST)
+
+        assert first is second is si_mock
+        connect_mock.SmartConnectNoSSL.assert_called_once()
+
+
+def test_session_pool_relogs_expired_session(get_handler):
+    vmware = get_handler("common.clients.vsphere")
+    pool = vmware.VsphereSessionPool(max_sessions=2)
+
+    with mock.patch.object(vmware, "connect") as connect_mock, mock.patch.object(
+        vmware, "SESSION_CHECK_INTERVAL", 0
+    ):
+        expired_si = Mock()
+        expired_si.content.sessionManager.currentSession = None
+        fresh_si = Mock()
+        connect_mock.SmartConnectNoSSL.side_effect = [expired_si, fresh_si]
+
+        pool.release(HOST, pool.acquire(HOST))
+        actual = pool.acquire(HOST)
+
+        assert actual is fresh_si
+        assert connect_mock.SmartConnectNoSSL.call_count == 2
+
+
+def test_session_pool_caps_sessions_per_vcenter(get_handler):
+    vmware = get_handler("common.clients.vsphere")
+    pool = vmware.VsphereSessionPool(max_sessions=1, acquire_timeout=0)
+
+    with mock.patch.object(vmware, "connect") as connect_mock:
+        connect_mock.SmartConnectNoSSL.side_effect = lambda **kwargs: Mock()
+
+        si_mock = pool.acquire(HOST)
+        with pytest.raises(Exception):
+            pool.acquire(HOST)
+
+        # other vCenters have their own limit
+        pool.acquire("other-vcenter")
+
+        pool.release(HOST, si_mock)
+        assert pool.acquire(HOST) is si_mock
+
+
+def test_session_pool_close(get_handler):
+    vmware = get_handler("common.clients.vsphere")
+    pool = vmware.VsphereSessionPool()
+
+    with mock.patch.object(vmware, "connect") as connect_mock:
+        si_mock = Mock()
+        connect_mock.SmartConnectNoSSL.return_value = si_mock
+        pool.release(HOST, pool.acquire(HOST))
+
+        pool.close()
+
+        connect_mock.Disconnect.assert_called_once_with(si_mock)
+
+
+def test_update_host_network(vmware_fixture):
+    vmware_handler, client, si_mock = vmware_fixture
+
+    view1 = Mock(vim.View)
+    view1.name = "host"
+    network_system = Mock()
+    view1.configManager = Mock(networkSystem=network_system)
+    mock_inventory(si_mock, [view1])
+    vswitch_spec = vim.host.VirtualSwitch.Specification(numPorts=128)
+    portgroup_spec = vim.host.PortGroup.Specification(
+        name="p1", vlanId=10, vswitchName="s1", policy=vim.host.NetworkPolicy()
+    )
+
+    # when
+    client.update_host_network("host", [("s1", vswitch_spec)], [portgroup_spec])
+
+    # then
+    config, change_mode = network_system.UpdateNetworkConfig.call_args[0]
+    assert change_mode == "modify"
+    assert [(v.changeOperation, v.name, v.spec) for v in config.vswitch] == [
+        ("add", "s1", vswitch_spec)
+    ]
+    assert [(p.changeOperation, p.spec) for p in config.portgroup] == [
+        ("add", portgroup_spec)
+    ]
+
+
+def test_update_host_network_is_limited(get_handler):
+    vmware = get_handler("common.clients.vsphere")
+    si_mock = Mock()
+    limiter = vmware.VcenterLimiter(HOST)
+    client = vmware.VsphereClient(HOST, si=si_mock, limiter=limiter)
+
+    view1 = Mock(vim.View)
+    view1.name = "host"
+    view1.configManager = Mock(networkSystem=Mock())
+    mock_inventory(si_mock, [view1])
+
+    # when
+    client.update_host_network("host", [], [])
+
+    # then
+    assert limiter.snapshot()["calls"]["reconfigure"]["count"] == 1
+
+
+def test_login_is_limited(get_handler):
+    vmware = get_handler("common.clients.vsphere")
+    limiter = vmware.VcenterLimiter(HOST)
+
+    with mock.patch.object(vmware, "connect") as connect_mock:
+        vmware._login(HOST, limiter)
+
+    connect_mock.SmartConnectNoSSL.assert_called_once()
+    assert limiter.snapshot()["calls"]["login"]["count"] == 1
+
+
+def make_change(name, val, op="assign"):
+    change = Mock(op=op, val=val)
+    change.name = name
+    return change
+
+
+def make_update_set(version, *object_updates, truncated=False):
+    return Mock(
+        version=version,
+        truncated=truncated,
+        filterSet=[Mock(objectSet=list(object_updates))],
+    )
+
+
+def test_inventory_cache(vmware_fixture, get_handler):
+    vmware_handler, client, si_mock = vmware_fixture
+
+    content = si_mock.RetrieveContent.return_value
+    view = vim.view.ContainerView("view-1", Mock())
+    content.viewManager.CreateContainerView.return_value = view
+    collector = content.propertyCollector.CreatePropertyCollector.return_value
+
+    host1 = Mock(_moId="host-1")
+    host2 = Mock(_moId="host-2")
+    portgroup = Mock()
+    portgroup.spec.name = "p1"
+    collector.WaitForUpdatesEx.side_effect = [
+        make_update_set(
+            "1",
+            Mock(
+                obj=host1,
+                kind="enter",
+                changeSet=[make_change("name", "host1")],
+            ),
+            truncated=True,
+        ),
+        make_update_set(
+            "2",
+            Mock(
+                obj=host2,
+                kind="enter",
+                changeSet=[make_change("name", "host2")],
+            ),
+        ),
+        make_update_set(
+            "3",
+            Mock(
+                obj=host1,
+                kind="modify",
+                changeSet=[make_change("config.network.portgroup", [portgroup])],
+            ),
+            Mock(obj=host2, kind="leave", changeSet=[]),
+        ),
+        None,
+    ]
+
+    # when
+    with vmware_handler.VsphereInventoryCache(client) as cache:
+        first_version = cache.version
+
+        # then
+        assert cache.get_host_system("host1") == host1
+        assert cache.get_host_system("host2") == host2
+        assert cache.has_portgroup("host1", "p1") is False
+
+        assert cache.refresh() > first_version
+        assert cache.has_portgroup("host1", "p1") is True
+        assert cache.get_host_system("host2") is None
+        with pytest.raises(Exception):
+            cache.get_host_network_snapshot("host2")
+
+        version = cache.version
+        assert cache.refresh() == version
+
+    versions = [c[0][0] for c in collector.WaitForUpdatesEx.call_args_list]
+    assert versions == ["", "1", "2", "3"]
+    collector.CreateFilter.assert_called_once()
+    collector.DestroyPropertyCollector.assert_called_once()
+    view._stub.InvokeMethod.assert_called_once()
+    content.propertyCollector.RetrievePropertiesEx.assert_not_called()
+
+
+def test_get_dvs_portgroups(vmware_fixture):
+    vmware_handler, client, si_mock = vmware_fixture
+
+    switch = vim.dvs.VmwareDistributedVirtualSwitch("dvs-1", Mock())
+    content = mock_inventory(si_mock, [])
+    config = Mock()
+    config.name = "p1"
+    content.propertyCollector.RetrievePropertiesEx.side_effect = [
+        Mock(
+            objects=[Mock(obj=switch, propSet=[to_property("name", "dvs")])],
+            token=None,
+        ),
+        Mock(objects=[Mock(propSet=[to_property("config", config)])], token=None),
+    ]
+
+    actual = client.get_dvs_portgroups("dvs")
+
+    assert actual == {"p1": config}
+    filter_spec = content.propertyCollector.RetrievePropertiesEx.call_args[0][0][0]
+    assert filter_spec.objectSet[0].obj == switch
+    assert filter_spec.objectSet[0].selectSet[0].path == "portgroup"
+    assert filter_spec.propSet[0].type == vim.dvs.DistributedVirtualPortgroup
+
+
+def test_wait_for_tasks(vmware_fixture):
+    vmware_handler, client, si_mock = vmware_fixture
+
+    collector = si_mock.RetrieveContent.return_value.propertyCollector
+    tasks = [vim.Task("task-1", Mock()), vim.Task("task-2", Mock())]
+    fault = vim.fault.DuplicateName(msg="duplicate")
+    collector.WaitForUpdatesEx.side_effect = [
+        make_update_set(
+            "1",
+            Mock(obj=tasks[0], changeSet=[make_change("info.state", "running")]),
+            Mock(
+                obj=tasks[1],
+                changeSet=[
+                    make_change("info.state", "error"),
+                    make_change("info.error", fault),
+                ],
+            ),
+        ),
+        None,
+        make_update_set(
+            "2", Mock(obj=tasks[0], changeSet=[make_change("info.state", "success")])
+        ),
+    ]
+
+    actual = client.wait_for_tasks(tasks)
+
+    assert actual == [None, fault]
+    collector.CreateFilter.assert_called_once()
+    filter_spec = collector.CreateFilter.call_args[0][0]
+    assert [spec.obj for spec in filter_spec.objectSet] == tasks
+    versions = [c[0][0] for c in collector.WaitForUpdatesEx.call_args_list]
+    assert versions == ["", "1", "1"]
+    collector.CreateFilter.return_value.DestroyPropertyFilter.assert_called_once()
+
+
+def test_wait_for_tasks_timeout(vmware_fixture):
+    vmware_handler, client, si_mock = vmware_fixture
+
+    collector = si_mock.RetrieveContent.return_value.propertyCollector
+
+    with pytest.raises(Exception):
+        client.wait_for_tasks([vim.Task("task-1", Mock())], timeout=0)
+
+    collector.CreateFilter.return_value.DestroyPropertyFilter.assert_called_once()
+
+
+class FakeSoapStub:
+    def __init__(self):
+        self.schemeArgs = {}
+        self.connection = Mock()
+        self.calls = []
+
+    def InvokeMethod(self, mo, info, args):
+        self.calls.append(info.wsdlName)
+
+    def GetConnection(self):
+        return self.connection
+
+
+def test_bind_deadline(get_handler):
+    vmware = get_handler("common.clients.vsphere")
+    from common.deadline import Deadline
+
+    stub = FakeSoapStub()
+    vmware._bind_deadline(stub)
+
+    with Deadline(10, margin=0).activate():
+        stub.InvokeMethod(Mock(), Mock(wsdlName="AddPortGroup"), [])
+        connection = stub.GetConnection()
+
+    assert stub.calls == ["AddPortGroup"]
+    assert 9 < stub.schemeArgs["timeout"] <= 10
+    assert connection.timeout == stub.schemeArgs["timeout"]
+    connection.sock.settimeout.assert_called_once_with(stub.schemeArgs["timeout"])
+
+
+def test_bind_deadline_expired(get_handler):
+    vmware = get_handler("common.clients.vsphere")
+    from common.deadline import Deadline, DeadlineExceeded
+
+    stub = FakeSoapStub()
+    vmware._bind_deadline(stub)
+
+    with Deadline(0, margin=0).activate():
+        with pytest.raises(DeadlineExceeded):
+            stub.InvokeMethod(Mock(), Mock(wsdlName="AddPortGroup"), [])
+
+    assert stub.calls == []
@@ -0,0 +1,210 @@
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+from mock import patch
+
+TARGET_MODULE = "common.clients.vsphere_limiter"
+
+
+@pytest.fixture
+def limiter_module(get_handler):
+    return get_handler(TARGET_MODULE)
+
+
+def test_token_bucket_allows_burst(limiter_module):
+    bucket = limiter_module.TokenBucket(rate=1, capacity=3)
+
+    assert [bucket.reserve(0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve(0) is None
+
+
+def test_token_bucket_spaces_out_calls(limiter_module):
+    bucket = limiter_module.TokenBucket(rate=10, capacity=1)
+
+    assert bucket.reserve(1) == 0.0
+    first_wait = bucket.reserve(1)
+    second_wait = bucket.reserve(1)
+
+    assert first_wait == pytest.approx(0.1, abs=0.01)
+    assert second_wait == pytest.approx(0.2, abs=0.01)
+
+
+def test_limiter_records_waits(limiter_module):
+    limiter = limiter_module.VcenterLimiter("vcenter", rate=20, burst=1)
+
+    for _ in range(3):
+        with limiter.limit("reconfigure"):
+            pass
+    with limiter.limit("login"):
+        pass
+
+    snapshot = limiter.snapshot()
+    assert snapshot["in_flight"] == 0
+    reconfigure = snapshot["calls"]["reconfigure"]
+    assert reconfigure["count"] == 3
+    assert reconfigure["rejected"] == 0
+    assert reconfigure["wait_seconds"] >= 0.09
+    assert snapshot["calls"]["login"]["count"] == 1
+
+
+def test_limiter_rejects_when_rate_exceeded(limiter_module):
+    limiter = limiter_module.VcenterLimiter(
+        "vcenter", rate=0.1, burst=1, wait_timeout=0.5
+    )
+
+    with limiter.limit("reconfigure"):
+        pass
+    with pytest.raises(Exception, match="Call rate to vCenter vcenter exceeded"):
+        with limiter.limit("reconfigure"):
+            pass
+
+    assert limiter.snapshot()["calls"]["reconfigure"]["rejected"] == 1
+
+
+def test_limiter_caps_concurrent_calls(limiter_module):
+    limiter = limiter_module.VcenterLimiter(
+        "vcenter", rate=1000, burst=100, max_concurrent=2
+    )
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def call():
+        with limiter.limit("reconfigure"):
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.pop()
+
+    threads = [threading.Thread(target=call) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(peak) == 2
+    assert limiter.snapshot()["calls"]["reconfigure"]["count"] == 6
+
+
+def test_limiter_rejects_when_busy(limiter_module):
+    limiter = limiter_module.VcenterLimiter(
+        "vcenter", max_concurrent=1, wait_timeout=0.05
+    )
+
+    with limiter.limit("reconfigure"):
+        with pytest.raises(Exception, match="Too many concurrent calls"):
+            with limiter.limit("reconfigure"):
+                pass
+
+
+def test_get_limiter_is_shared_per_vcenter(limiter_module):
+    first = limiter_module.get_limiter("vcenter-a")
+
+    assert limiter_module.get_limiter("vcenter-a") is first
+    assert limiter_module.get_limiter("vcenter-b") is not first
+
+
+class FakeLimiterTable:
+    """
+    The DynamoDB calls of the limit store, against one in-memory table.
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.Lock()
+        self.update_calls = 0
+
+    def get_item(self, TableName, Key, ConsistentRead):
+        with self.lock:
+            item = self.items.get(Key["vcenter"]["S"])
+            return {"Item": {"leases": {"SS": sorted(item)}}} if item else {}
+
+    def update_item(
+        self,
+        TableName,
+        Key,
+        UpdateExpression,
+        ExpressionAttributeValues,
+        ConditionExpression=None,
+    ):
+        with self.lock:
+            self.update_calls += 1
+            leases = self.items.setdefault(Key["vcenter"]["S"], set())
+            if UpdateExpression.startswith("DELETE"):
+                leases -= set(ExpressionAttributeValues[":leases"]["SS"])
+                return
+            if ConditionExpression and len(leases) >= int(
+                ExpressionAttributeValues[":max"]["N"]
+            ):
+                raise ClientError(
+                    {"Error": {"Code": "ConditionalCheckFailedException"}},
+                    "UpdateItem",
+                )
+            leases |= set(ExpressionAttributeValues[":lease"]["SS"])
+
+
+@pytest.fixture
+def shared_store(limiter_module):
+    table = FakeLimiterTable()
+    store = limiter_module.DynamoDbLimitStore("table")
+    with patch.object(store, "_get_client", return_value=table):
+        yield store, table
+
+
+def test_shared_limiter_caps_operations_across_containers(limiter_module, shared_store):
+    store, table = shared_store
+    # Limiters of two containers, sharing the store
+    first, second = [
+        limiter_module.VcenterLimiter(
+            "vcenter", wait_timeout=0.3, store=store, max_operations=1
+        )
+        for _ in range(2)
+    ]
+
+    with first.operation("copy_networks"):
+        with pytest.raises(Exception, match="Too many operations on vCenter vcenter"):
+            with second.operation("copy_networks"):
+                pass
+    with second.operation("copy_networks"):
+        pass
+
+    assert second.snapshot()["calls"]["copy_networks"]["rejected"] == 1
+    assert table.items["vcenter"] == set()
+
+
+def test_shared_limiter_is_not_used_per_call(limiter_module, shared_store):
+    store, table = shared_store
+    limiter = limiter_module.VcenterLimiter("vcenter", store=store)
+
+    with limiter.operation("copy_networks"):
+        for _ in range(5):
+            with limiter.limit("reconfigure"):
+                pass
+
+    # One update to take the slot and one to give it back
+    assert table.update_calls == 2
+
+
+def test_shared_limiter_reclaims_expired_lease(limiter_module, shared_store):
+    store, table = shared_store
+    table.items["vcenter"] = {f"{time.time() - 1:.3f}:dead"}
+
+    lease = store.acquire("vcenter", 1, 0)
+
+    assert table.items["vcenter"] == {lease}
+
+
+def test_shared_limiter_fails_open(limiter_module, shared_store):
+    store, table = shared_store
+    limiter = limiter_module.VcenterLimiter("vcenter", store=store)
+    error = ClientError({"Error": {"Code": "ResourceNotFoundException"}}, "UpdateItem")
+
+    with patch.object(table, "update_item", side_effect=error):
+        with limiter.operation("copy_networks"):
+            pass
+
+    assert limiter.snapshot()["calls"]["copy_networks"]["count"] == 1
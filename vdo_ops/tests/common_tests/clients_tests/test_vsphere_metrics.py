@@ -0,0 +1,120 @@
+import pytest
+from mock import Mock
+
+
+@pytest.fixture
+def metrics_module(get_handler):
+    return get_handler("common.clients.vsphere_metrics")
+
+
+class FakeStub:
+    def __init__(self):
+        self.request = b"<request/>"
+
+    def SerializeRequest(self, mo, info, args):
+        return self.request
+
+    def InvokeMethod(self, mo, info, args):
+        self.SerializeRequest(mo, info, args)
+        return info.wsdlName
+
+    def InvokeAccessor(self, mo, info):
+        # pyVmomi reads properties through a RetrieveProperties method call
+        return self.InvokeMethod(mo, make_info("RetrieveProperties"), [])
+
+
+def make_info(wsdl_name, name=None):
+    info = Mock()
+    info.wsdlName = wsdl_name
+    info.name = name or wsdl_name
+    return info
+
+
+def test_counts_method_calls(metrics_module):
+    metrics = metrics_module.SoapMetrics()
+    stub = FakeStub()
+    metrics_module.instrument_stub(stub, metrics)
+
+    stub.InvokeMethod(Mock(), make_info("AddPortGroup"), [])
+    stub.InvokeMethod(Mock(), make_info("AddPortGroup"), [])
+    stub.InvokeMethod(Mock(), make_info("CreateContainerView"), [])
+
+    snapshot = metrics.snapshot()
+    assert snapshot["AddPortGroup"]["count"] == 2
+    assert snapshot["AddPortGroup"]["request_bytes"] == 2 * len(stub.request)
+    assert snapshot["CreateContainerView"]["count"] == 1
+    assert metrics.round_trips() == 3
+    assert metrics.round_trips("AddPortGroup") == 2
+    assert metrics.round_trips("AddVirtualSwitch") == 0
+
+
+def test_property_read_is_one_round_trip(metrics_module):
+    metrics = metrics_module.SoapMetrics()
+    stub = FakeStub()
+    metrics_module.instrument_stub(stub, metrics)
+
+    stub.InvokeAccessor(Mock(), make_info("content"))
+
+    assert metrics.round_trips() == 1
+    assert metrics.round_trips("RetrieveProperties") == 0
+    (name,) = metrics.snapshot()
+    assert name.endswith(".content")
+
+
+def test_instrument_twice_switches_metrics(metrics_module):
+    first = metrics_module.SoapMetrics()
+    second = metrics_module.SoapMetrics()
+    stub = FakeStub()
+
+    metrics_module.instrument_stub(stub, first)
+    metrics_module.instrument_stub(stub, second)
+    stub.InvokeMethod(Mock(), make_info("AddPortGroup"), [])
+
+    assert first.round_trips() == 0
+    assert second.round_trips("AddPortGroup") == 1
+
+
+def test_operation_summary(metrics_module):
+    metrics = metrics_module.SoapMetrics()
+    stub = FakeStub()
+    metrics_module.instrument_stub(stub, metrics)
+    stub.InvokeMethod(Mock(), make_info("RetrieveContent"), [])
+
+    with metrics.operation("copy_networks") as summary:
+        stub.InvokeMethod(Mock(), make_info("AddPortGroup"), [])
+        stub.InvokeMethod(Mock(), make_info("AddPortGroup"), [])
+
+    assert summary["operation"] == "copy_networks"
+    assert summary["round_trips"] == 2
+    assert list(summary["calls"]) == ["AddPortGroup"]
+    assert summary["calls"]["AddPortGroup"]["count"] == 2
+    assert metrics.operations()["copy_networks"]["count"] == 1
+
+
+def test_operation_summary_on_error(metrics_module):
+    metrics = metrics_module.SoapMetrics()
+
+    with pytest.raises(Exception):
+        with metrics.operation("copy_networks") as summary:
+            raise Exception("Failed")
+
+    assert summary["round_trips"] == 0
+
+
+def test_counts_response_bytes(metrics_module):
+    metrics = metrics_module.SoapMetrics()
+    stub = FakeStub()
+    connection = Mock()
+    connection.getresponse.return_value.read.return_value = b"<response/>"
+    stub.GetConnection = Mock(return_value=connection)
+
+    def invoke(mo, info, args):
+        return stub.GetConnection().getresponse().read()
+
+    stub.InvokeMethod = invoke
+    metrics_module.instrument_stub(stub, metrics)
+
+    stub.InvokeMethod(Mock(), make_info("RetrievePropertiesEx"), [])
+
+    stats = metrics.snapshot()["RetrievePropertiesEx"]
+    assert stats["response_bytes"] == len(b"<response/>")
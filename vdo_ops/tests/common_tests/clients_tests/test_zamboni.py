@@ -1,4 +1,10 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+
 import pytest
+import requests
 from mock import patch, Mock
 
 from tests.helper import util
@@ -99,3 +105,819 @@ def test_get_hyps_by_device_id(zamboni_fixture):
 
     assert len(actual) == 5
     assert actual["name"] == "364027-hyp90.ord1.rvi.local"
+
+
+def make_page(data, current_page, next_token=None, next_page=None):
+    page = util.load_json_file("data/zamboni/get_vm_list.json")
+    page["data"] = data
+    page["meta"].update(
+        current_page=current_page,
+        last_page=next_token is None and next_page is None,
+        next_token=next_token,
+        next_page=next_page,
+    )
+    return util.to_mock({"json()": page, "status_code": 200})
+
+
+def test_get_vm_pages_by_vcenter(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup
+    vms = util.load_json_file("data/zamboni/get_vm_list.json")["data"]
+    session_mock.get.side_effect = [
+        make_page(vms[:2], 1, next_token="token-2"),
+        make_page(vms[2:4], 2, next_page=3),
+        make_page(vms[4:], 3),
+    ]
+
+    # when
+    pages = zamboni_subject.get_vm_pages_by_vcenter("vcenter")
+    first = next(pages)
+    rest = list(pages)
+
+    # then
+    assert [len(page) for page in [first, *rest]] == [2, 2, 1]
+    assert all("service_value" in vm for vm in first)
+    assert first[0]["_metadata"]["orgId"] == vms[0]["provider_account_id"]
+    params = [c[1]["params"] for c in session_mock.get.call_args_list]
+    assert "next_token" not in params[0]
+    assert params[1]["next_token"] == "token-2"
+    assert params[2]["page"] == 3
+    assert all(p["filters[location]"] == "vcenter" for p in params)
+
+
+def test_get_vm_pages_prefetches_next_page(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup
+    vms = util.load_json_file("data/zamboni/get_vm_list.json")["data"]
+    session_mock.get.side_effect = [
+        make_page(vms[:2], 1, next_token="token-2"),
+        make_page(vms[2:], 2),
+    ]
+
+    # when
+    pages = zamboni_subject.get_vm_pages_by_vcenter("vcenter")
+    next(pages)
+
+    # then the second page is requested before it is asked for
+    for _ in range(100):
+        if session_mock.get.call_count == 2:
+            break
+        time.sleep(0.01)
+    assert session_mock.get.call_count == 2
+    pages.close()
+
+
+def test_get_vms_by_vcenter_reads_every_page(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup
+    vms = util.load_json_file("data/zamboni/get_vm_list.json")["data"]
+    session_mock.get.side_effect = [
+        make_page(vms[:3], 1, next_token="token-2"),
+        make_page(vms[3:], 2),
+    ]
+
+    # when
+    actual = zamboni_subject.get_vms_by_vcenter("vcenter")
+
+    # then
+    assert [vm["name"] for vm in actual] == [vm["name"] for vm in vms]
+
+
+def test_get_vm_pages_missing_page(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup
+    vms = util.load_json_file("data/zamboni/get_vm_list.json")["data"]
+    session_mock.get.side_effect = [
+        make_page(vms, 1, next_token="expired"),
+        Mock(status_code=404),
+    ]
+
+    # when
+    pages = zamboni_subject.get_vm_pages_by_vcenter("vcenter")
+    next(pages)
+
+    # then
+    with pytest.raises(Exception, match="not found"):
+        next(pages)
+
+
+def test_apply_service_value(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup
+    fields = [
+        {"key": 1, "name": "com.rackspace.goss.vm.services.os.admin"},
+        {"key": 2, "name": "com.rackspace.goss.vm.services.monitoring"},
+        {"key": 3, "name": "com.rackspace.goss.vm.services.patching"},
+        {"key": 4, "name": "Last Backup"},
+    ]
+    vms = [
+        {
+            "location": "vcenter",
+            "availableField": fields,
+            "value": [
+                {"key": 1, "value": "enrolled"},
+                {"key": 3, "value": "enrolled"},
+                {"key": 4, "value": "enrolled"},
+            ],
+        },
+        {
+            "location": "vcenter",
+            "availableField": fields,
+            "value": [{"key": 2, "value": "enrolled"}, {"key": 3, "value": "no"}],
+        },
+        {"location": "other", "availableField": [], "value": []},
+        {
+            "location": "other",
+            "availableField": [{"key": 9, "name": "Last Backup"}],
+            "value": [{"key": 2, "value": "enrolled"}, {"key": 9, "value": "enrolled"}],
+        },
+        {
+            "location": "third",
+            "availableField": [{"key": 9, "name": fields[1]["name"]}],
+            "value": [{"key": 2, "value": "enrolled"}, {"key": 9, "value": "enrolled"}],
+        },
+    ]
+
+    # when
+    with patch.object(
+        zamboni_subject,
+        "_get_service_keys",
+        wraps=zamboni_subject._get_service_keys,
+    ) as get_service_keys:
+        zamboni_subject._apply_service_value(vms)
+
+    # then
+    assert [vm["service_value"] for vm in vms] == [5, 2, 0, 0, 2]
+    # Once per vCenter, even for a vCenter without any GOSS field, and per VM
+    # until one lists the custom fields
+    assert get_service_keys.call_count == 4
+
+
+def test_apply_service_value_first_vm_without_fields(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup
+    fields = [{"key": 7, "name": "com.rackspace.goss.vm.services.patching"}]
+    enrolled = [{"key": 7, "value": "enrolled"}]
+    vms = [
+        {"location": "vcenter", "value": enrolled},
+        {"location": "vcenter", "availableField": fields, "value": enrolled},
+        {"location": "vcenter", "value": enrolled},
+    ]
+    service_keys_by_location = {}
+
+    # when
+    zamboni_subject._apply_service_value(vms, service_keys_by_location)
+
+    # then
+    assert [vm["service_value"] for vm in vms] == [0, 4, 4]
+    assert service_keys_by_location == {"vcenter": {7: 4}}
+
+
+def make_hyp(device_id):
+    return {"name": f"{device_id}-hyp", "_rackspace": {"deviceId": device_id}}
+
+
+def test_get_hyps_by_device_ids(zamboni_fixture, get_handler):
+    zamboni = get_handler(TARGET_MODULE)
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup
+    def get(url, params):
+        device_ids = params["filters[body._rackspace.deviceId]"].split(",")
+        return util.to_mock(
+            {
+                "json()": {
+                    "meta": {"last_page": True},
+                    "data": [make_hyp(d) for d in device_ids if d != "404"],
+                },
+                "status_code": 200,
+            }
+        )
+
+    session_mock.get.side_effect = get
+
+    # when
+    with patch.object(zamboni, "MAX_IDS_PER_REQUEST", 2):
+        actual = zamboni_subject.get_hyps_by_device_ids(["1", 2, "3", "1", "404", "5"])
+
+    # then
+    assert list(actual) == ["1", "2", "3", "404", "5"]
+    assert actual["2"]["name"] == "2-hyp"
+    assert actual["404"] is None
+    filters = sorted(
+        c[1]["params"]["filters[body._rackspace.deviceId]"]
+        for c in session_mock.get.call_args_list
+    )
+    assert filters == ["1,2", "3,404", "5"]
+    assert all(
+        c[0][0] == "test-endpoint/managedvirt/vsphere/host_systems"
+        for c in session_mock.get.call_args_list
+    )
+
+
+def test_get_hyps_by_device_ids_duplicate(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup
+    session_mock.get.return_value = util.to_mock(
+        {
+            "json()": {
+                "meta": {"last_page": True},
+                "data": [make_hyp("1"), make_hyp("1")],
+            },
+            "status_code": 200,
+        }
+    )
+
+    # when
+    with pytest.raises(Exception, match="More than one Hypervisor"):
+        zamboni_subject.get_hyps_by_device_ids(["1"])
+
+
+def test_get_hyps_by_device_ids_follows_pages(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup
+    session_mock.get.side_effect = [
+        util.to_mock(
+            {
+                "json()": {
+                    "meta": {"last_page": False, "next_token": "token-2"},
+                    "data": [make_hyp("1")],
+                },
+                "status_code": 200,
+            }
+        ),
+        util.to_mock(
+            {
+                "json()": {"meta": {"last_page": True}, "data": [make_hyp("2")]},
+                "status_code": 200,
+            }
+        ),
+    ]
+
+    # when
+    actual = zamboni_subject.get_hyps_by_device_ids(["1", "2"])
+
+    # then
+    assert actual["1"]["name"] == "1-hyp"
+    assert actual["2"]["name"] == "2-hyp"
+    assert session_mock.get.call_args[1]["params"]["next_token"] == "token-2"
+
+
+def test_get_hyps_by_device_ids_query_string(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup
+    session_mock.get.return_value = util.to_mock(
+        {
+            "json()": {"meta": {"last_page": True}, "data": [make_hyp("1")]},
+            "status_code": 200,
+        }
+    )
+
+    # when
+    zamboni_subject.get_hyps_by_device_ids(["1", "2"])
+
+    # then
+    url = session_mock.get.call_args[0][0]
+    params = session_mock.get.call_args[1]["params"]
+    request = requests.Request("GET", f"https://{url}", params=params).prepare()
+    assert request.url == (
+        "https://test-endpoint/managedvirt/vsphere/host_systems"
+        "?filters%5Bbody._rackspace.deviceId%5D=1%2C2"
+        "&fields=id%2Clocation%2Cresource_id%2Cbody.name%2Cbody._rackspace"
+    )
+
+
+def test_get_hyps_by_device_ids_no_fallback_when_none_found(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup
+    session_mock.get.return_value = util.to_mock(
+        {"json()": {"meta": {"last_page": True}, "data": []}, "status_code": 200}
+    )
+
+    # when
+    actual = zamboni_subject.get_hyps_by_device_ids(["1", "2"])
+
+    # then
+    assert actual == {"1": None, "2": None}
+    assert session_mock.get.call_count == 1
+
+
+def test_get_hyps_by_device_ids_ignored_filter(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup, a Zamboni that only applies the filter to a single value
+    def get(url, params):
+        device_id = params["filters[body._rackspace.deviceId]"]
+        device_ids = ["1", "2", "3"] if "," in device_id else [device_id]
+        return util.to_mock(
+            {
+                "json()": {
+                    "meta": {"last_page": True},
+                    "data": [make_hyp(d) for d in device_ids],
+                },
+                "status_code": 200,
+            }
+        )
+
+    session_mock.get.side_effect = get
+
+    # when
+    actual = zamboni_subject.get_hyps_by_device_ids(["1", "2"])
+
+    # then
+    assert actual["1"]["name"] == "1-hyp"
+    assert actual["2"]["name"] == "2-hyp"
+    filters = sorted(
+        c[1]["params"]["filters[body._rackspace.deviceId]"]
+        for c in session_mock.get.call_args_list
+    )
+    assert filters == ["1", "1,2", "2"]
+
+
+def test_get_hyps_by_device_ids_empty(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    assert zamboni_subject.get_hyps_by_device_ids([]) == {}
+    session_mock.get.assert_not_called()
+
+
+@pytest.fixture
+def cached_zamboni_fixture(get_handler):
+    zamboni = get_handler(TARGET_MODULE)
+
+    with patch(f"{TARGET_MODULE}.IdentitySession") as identity_session_module_mock:
+        session_mock = Mock()
+        identity_session_module_mock.return_value.__enter__.return_value = session_mock
+
+        def make_client(**cache_options):
+            cache = zamboni.ResponseCache(**cache_options)
+            return zamboni.Zamboni("test-endpoint", Mock(), cache=cache), cache
+
+        yield make_client, session_mock
+
+
+def make_response(body, status_code=200, headers=None):
+    return util.to_mock(
+        {
+            "json()": body,
+            "status_code": status_code,
+            "content": json.dumps(body).encode("utf-8"),
+            "headers": headers or {},
+        }
+    )
+
+
+def test_cache_hit(cached_zamboni_fixture):
+    make_client, session_mock = cached_zamboni_fixture
+    zamboni_subject, cache = make_client()
+
+    # setup
+    data = util.load_json_file("data/zamboni/get_host_system.json")
+    session_mock.get.return_value = make_response(data)
+
+    # when
+    first = zamboni_subject.get_hyps_by_device_id("364027")
+    second = zamboni_subject.get_hyps_by_device_id("364027")
+    zamboni_subject.get_hyps_by_device_id("364026")
+
+    # then
+    assert first == second
+    assert session_mock.get.call_count == 2
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 2)
+    assert stats["bytes"] == 2 * len(json.dumps(data).encode("utf-8"))
+
+
+def test_cache_hit_returns_own_copy(cached_zamboni_fixture):
+    make_client, session_mock = cached_zamboni_fixture
+    zamboni_subject, _ = make_client()
+
+    # setup
+    data = util.load_json_file("data/zamboni/get_host_system.json")
+    session_mock.get.return_value = make_response(data)
+
+    # when
+    first = zamboni_subject.get_hyps_by_device_id("364027")
+    first["location"] = "changed"
+    second = zamboni_subject.get_hyps_by_device_id("364027")
+
+    # then
+    assert first is not second
+    assert second["location"] == data["data"][0]["location"]
+
+
+def test_cache_revalidates_expired_entry(cached_zamboni_fixture):
+    make_client, session_mock = cached_zamboni_fixture
+    zamboni_subject, cache = make_client(ttl=0)
+
+    # setup
+    data = util.load_json_file("data/zamboni/get_host_system.json")
+    session_mock.get.side_effect = [
+        make_response(
+            data,
+            headers={"ETag": '"v1"', "Last-Modified": "Wed, 21 Oct 2020 07:28:00 GMT"},
+        ),
+        make_response(None, status_code=304),
+    ]
+
+    # when
+    first = zamboni_subject.get_hyps_by_device_id("364027")
+    second = zamboni_subject.get_hyps_by_device_id("364027")
+
+    # then
+    assert first == second
+    headers = session_mock.get.call_args[1]["headers"]
+    assert headers == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Wed, 21 Oct 2020 07:28:00 GMT",
+    }
+    assert cache.stats()["revalidated"] == 1
+
+
+def test_cache_replaces_changed_entry(cached_zamboni_fixture):
+    make_client, session_mock = cached_zamboni_fixture
+    zamboni_subject, cache = make_client(ttl=0)
+
+    # setup
+    data = util.load_json_file("data/zamboni/get_host_system.json")
+    changed = util.load_json_file("data/zamboni/get_host_system.json")
+    changed["data"][0]["location"] = "vcenter-2"
+    session_mock.get.side_effect = [
+        make_response(data, headers={"ETag": '"v1"'}),
+        make_response(changed, headers={"ETag": '"v2"'}),
+    ]
+
+    # when
+    zamboni_subject.get_hyps_by_device_id("364027")
+    actual = zamboni_subject.get_hyps_by_device_id("364027")
+
+    # then
+    assert actual["location"] == "vcenter-2"
+    assert cache.stats()["entries"] == 1
+
+
+def test_cache_evicts_least_recently_used(get_handler):
+    zamboni = get_handler(TARGET_MODULE)
+    cache = zamboni.ResponseCache(max_bytes=250)
+
+    cache.put("a", b"a" * 100)
+    cache.put("b", b"b" * 100)
+    cache.get("a")
+    cache.put("c", b"c" * 100)
+    cache.put("too big", b"x" * 1000)
+
+    assert cache.get("b") == (None, False)
+    assert cache.get("a")[1] is True
+    assert cache.get("c")[1] is True
+    assert cache.get("too big") == (None, False)
+    stats = cache.stats()
+    assert (stats["evictions"], stats["bytes"]) == (1, 200)
+
+
+def test_no_cache_by_default(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup
+    data = util.load_json_file("data/zamboni/get_host_system.json")
+    session_mock.get.return_value = util.to_mock({"json()": data})
+
+    # when
+    zamboni_subject.get_hyps_by_device_id("364027")
+    zamboni_subject.get_hyps_by_device_id("364027")
+
+    # then
+    assert session_mock.get.call_count == 2
+
+
+def make_stream_response(body, status_code=200):
+    raw = json.dumps(body).encode("utf-8")
+    chunks = []
+    for start in range(0, len(raw), 10):
+        end = start + 10
+        chunks.append(raw[start:end])
+    response = Mock(status_code=status_code)
+    response.iter_content.side_effect = lambda size: iter(chunks)
+    return response
+
+
+def test_stream_vms_by_vcenter(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup
+    page = util.load_json_file("data/zamboni/get_vm_list.json")
+    first = dict(page, data=page["data"][:3])
+    first["meta"] = dict(page["meta"], last_page=False, next_token="token-2")
+    second = dict(page, data=page["data"][3:])
+    responses = [make_stream_response(first), make_stream_response(second)]
+    session_mock.get.side_effect = responses
+
+    # when
+    actual = list(zamboni_subject.stream_vms_by_vcenter("vcenter"))
+
+    # then
+    assert [vm["name"] for vm in actual] == [vm["name"] for vm in page["data"]]
+    assert set(actual[0]) == {
+        "id",
+        "name",
+        "location",
+        "provider_account_id",
+        "_rackspace",
+        "_metadata",
+        "config$instanceUuid",
+        "config$uuid",
+        "service_value",
+    }
+    assert actual[0]["_metadata"]["orgId"] == page["data"][0]["provider_account_id"]
+    assert session_mock.get.call_args_list[0][1]["stream"] is True
+    assert session_mock.get.call_args_list[1][1]["params"]["next_token"] == "token-2"
+    assert all(response.close.called for response in responses)
+
+
+def test_stream_vms_by_vcenter_keeps_every_field(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup
+    page = util.load_json_file("data/zamboni/get_vm_list.json")
+    session_mock.get.return_value = make_stream_response(page)
+
+    # when
+    actual = next(zamboni_subject.stream_vms_by_vcenter("vcenter", keep_fields=None))
+
+    # then
+    assert "availableField" in actual
+    assert "guest" in actual
+    assert "service_value" in actual
+
+
+def test_stream_vms_by_vcenter_not_found(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup
+    session_mock.get.return_value = Mock(status_code=404)
+
+    # when
+    actual = list(zamboni_subject.stream_vms_by_vcenter("vcenter"))
+
+    # then
+    assert actual == []
+    session_mock.get.return_value.close.assert_called()
+
+
+def test_stream_vm_records_by_vcenter(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup
+    page = util.load_json_file("data/zamboni/get_vm_list.json")
+    fields = page["data"][0]["availableField"]
+    keys = {field["name"]: field["key"] for field in fields}
+    page["data"][0]["value"].append(
+        {"key": keys["com.rackspace.goss.vm.services.patching"], "value": "enrolled"}
+    )
+    session_mock.get.return_value = make_stream_response(page)
+
+    # when
+    actual = list(zamboni_subject.stream_vm_records_by_vcenter("vcenter"))
+
+    # then
+    assert len(actual) == 5
+    assert actual[0].service_value == 4
+    assert actual[1].service_value == 0
+    assert actual[0].org_id == page["data"][0]["provider_account_id"]
+    assert actual[1].fields is actual[0].fields
+
+
+def test_sync_vms_lists_every_vm_first(zamboni_fixture, get_handler, tmp_path):
+    zamboni_subject, session_mock = zamboni_fixture
+    vm_inventory = get_handler("common.vm_inventory")
+    store = vm_inventory.FileInventoryStore(str(tmp_path))
+
+    # setup
+    page = util.load_json_file("data/zamboni/get_vm_list.json")
+    session_mock.get.return_value = util.to_mock({"json()": page})
+
+    # when
+    actual = zamboni_subject.sync_vms("vcenter", store=store)
+
+    # then
+    params = session_mock.get.call_args[1]["params"]
+    assert "filters[updated_at][gte]" not in params
+    assert len(actual.vms) == 5
+    assert actual.watermark is not None
+    assert store.load("vcenter").vms == actual.vms
+
+
+def test_sync_vms_merges_changes(zamboni_fixture, get_handler, tmp_path):
+    zamboni_subject, session_mock = zamboni_fixture
+    vm_inventory = get_handler("common.vm_inventory")
+    store = vm_inventory.FileInventoryStore(str(tmp_path))
+
+    # setup
+    vms = util.load_json_file("data/zamboni/get_vm_list.json")["data"]
+    inventory = vm_inventory.VmInventory("vcenter", watermark="2020-06-01T00:00:00")
+    inventory.replace(vms)
+    store.save(inventory)
+    changed = util.load_json_file("data/zamboni/modified_vm_list.json")
+    present = [{"id": vm["id"]} for vm in vms[:3]]
+
+    def get(url, params):
+        data = changed if "filters[updated_at][gte]" in params else present
+        return make_page(data, 1)
+
+    session_mock.get.side_effect = get
+
+    # when
+    actual = zamboni_subject.sync_vms("vcenter", store=store)
+
+    # then
+    changes_params = session_mock.get.call_args_list[1][1]["params"]
+    assert changes_params["filters[updated_at][gte]"] == "2020-06-01T00:00:00"
+    assert session_mock.get.call_args_list[0][1]["params"]["fields"] == "id"
+    assert set(actual.vms) == {vm["id"] for vm in vms[:3]}
+    assert actual.vms[vms[0]["id"]]["name"] == "some-test"
+    assert actual.watermark > "2020-06-01T00:00:00"
+    assert set(store.load("vcenter").vms) == set(actual.vms)
+
+
+def test_sync_vms_warns_when_every_vm_changed(zamboni_fixture, get_handler, tmp_path):
+    zamboni_subject, session_mock = zamboni_fixture
+    vm_inventory = get_handler("common.vm_inventory")
+    store = vm_inventory.FileInventoryStore(str(tmp_path))
+
+    # setup, a Zamboni ignoring the modified since filter
+    vms = util.load_json_file("data/zamboni/get_vm_list.json")["data"]
+    inventory = vm_inventory.VmInventory("vcenter", watermark="2020-06-01T00:00:00")
+    inventory.replace(vms)
+    store.save(inventory)
+    present = [{"id": vm["id"]} for vm in vms]
+
+    def get(url, params):
+        return make_page(vms if "filters[updated_at][gte]" in params else present, 1)
+
+    session_mock.get.side_effect = get
+
+    # when
+    with patch(f"{TARGET_MODULE}.logger") as logger_mock:
+        zamboni_subject.sync_vms("vcenter", store=store)
+
+    # then
+    logger_mock.warning.assert_called_once()
+    assert logger_mock.warning.call_args[1]["vms"] == len(vms)
+
+
+def test_sync_vms_no_warning_for_some_changes(zamboni_fixture, get_handler, tmp_path):
+    zamboni_subject, session_mock = zamboni_fixture
+    vm_inventory = get_handler("common.vm_inventory")
+    store = vm_inventory.FileInventoryStore(str(tmp_path))
+
+    # setup
+    vms = util.load_json_file("data/zamboni/get_vm_list.json")["data"]
+    inventory = vm_inventory.VmInventory("vcenter", watermark="2020-06-01T00:00:00")
+    inventory.replace(vms)
+    store.save(inventory)
+    present = [{"id": vm["id"]} for vm in vms]
+
+    def get(url, params):
+        return make_page(
+            vms[:1] if "filters[updated_at][gte]" in params else present, 1
+        )
+
+    session_mock.get.side_effect = get
+
+    # when
+    with patch(f"{TARGET_MODULE}.logger") as logger_mock:
+        zamboni_subject.sync_vms("vcenter", store=store)
+
+    # then
+    logger_mock.warning.assert_not_called()
+
+
+def test_sync_vms_since_overrides_watermark(zamboni_fixture, get_handler, tmp_path):
+    zamboni_subject, session_mock = zamboni_fixture
+    vm_inventory = get_handler("common.vm_inventory")
+    store = vm_inventory.FileInventoryStore(str(tmp_path))
+    store.save(vm_inventory.VmInventory("vcenter", watermark="2020-06-01T00:00:00"))
+    session_mock.get.return_value = make_page([], 1)
+
+    zamboni_subject.sync_vms(
+        "vcenter", since=datetime(2020, 5, 1, tzinfo=timezone.utc), store=store
+    )
+
+    params = session_mock.get.call_args[1]["params"]
+    assert params["filters[updated_at][gte]"] == "2020-05-01T00:00:00+00:00"
+
+
+def vm_pages_by_location(pages_by_vcenter):
+    def get(url, params):
+        vcenter = params["filters[location]"]
+        page_number = int(params.get("page", 1))
+        pages = pages_by_vcenter[vcenter]
+        if callable(pages):
+            return pages(page_number)
+        next_page = page_number + 1 if page_number < len(pages) else None
+        return make_page(pages[page_number - 1], page_number, next_page=next_page)
+
+    return get
+
+
+def test_get_vms_by_vcenters(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    # setup
+    vms = util.load_json_file("data/zamboni/get_vm_list.json")["data"]
+    session_mock.get.side_effect = vm_pages_by_location(
+        {"vcenter-a": [vms[:2], vms[2:3]], "vcenter-b": [vms[3:]]}
+    )
+
+    # when
+    actual = list(zamboni_subject.get_vms_by_vcenters(["vcenter-a", "vcenter-b"]))
+
+    # then
+    names = {}
+    for vcenter, page in actual:
+        names.setdefault(vcenter, []).extend(vm["name"] for vm in page)
+    assert names == {
+        "vcenter-a": [vm["name"] for vm in vms[:3]],
+        "vcenter-b": [vm["name"] for vm in vms[3:]],
+    }
+    assert all("service_value" in vm for _, page in actual for vm in page)
+
+
+def test_get_vms_by_vcenters_slow_vcenter(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+    vms = util.load_json_file("data/zamboni/get_vm_list.json")["data"]
+    release = threading.Event()
+
+    def slow(page_number):
+        assert release.wait(5)
+        return make_page(vms[:1], page_number)
+
+    session_mock.get.side_effect = vm_pages_by_location(
+        {"slow": slow, "fast": [vms[1:2], vms[2:3], vms[3:4]]}
+    )
+
+    stream = zamboni_subject.get_vms_by_vcenters(["slow", "fast"])
+    first = [next(stream) for _ in range(3)]
+    release.set()
+    rest = list(stream)
+
+    assert [vcenter for vcenter, _ in first] == ["fast"] * 3
+    assert [vcenter for vcenter, _ in rest] == ["slow"]
+
+
+def test_get_vms_by_vcenters_limits_concurrency(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+    vms = util.load_json_file("data/zamboni/get_vm_list.json")["data"]
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def page(page_number):
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.pop()
+        return make_page(vms[:1], page_number)
+
+    vcenters = [f"vcenter-{index}" for index in range(6)]
+    session_mock.get.side_effect = vm_pages_by_location(
+        {vcenter: page for vcenter in vcenters}
+    )
+
+    actual = list(zamboni_subject.get_vms_by_vcenters(vcenters, max_concurrency=2))
+
+    assert sorted(vcenter for vcenter, _ in actual) == vcenters
+    assert max(peak) == 2
+
+
+def test_get_vms_by_vcenters_raises_first_error(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+    vms = util.load_json_file("data/zamboni/get_vm_list.json")["data"]
+
+    def broken(page_number):
+        raise Exception("Zamboni is down")
+
+    session_mock.get.side_effect = vm_pages_by_location(
+        {"broken": broken, "vcenter": [vms]}
+    )
+
+    with pytest.raises(Exception, match="Zamboni is down"):
+        list(zamboni_subject.get_vms_by_vcenters(["broken", "vcenter"]))
+
+
+def test_get_vms_by_vcenters_empty(zamboni_fixture):
+    zamboni_subject, session_mock = zamboni_fixture
+
+    assert list(zamboni_subject.get_vms_by_vcenters([])) == []
+    session_mock.get.assert_not_called()
@@ -0,0 +1,63 @@
+import pytest
+from mock import Mock
+
+TARGET_MODULE = "common.deadline"
+
+
+def test_no_deadline(get_handler):
+    deadline = get_handler(TARGET_MODULE)
+
+    assert deadline.current() is None
+    assert deadline.timeout() == deadline.DEFAULT_TIMEOUT
+    assert deadline.clamp(5) == 5
+    deadline.check()
+
+
+def test_deadline_remaining(get_handler):
+    deadline = get_handler(TARGET_MODULE)
+
+    subject = deadline.Deadline(10, margin=2)
+
+    assert 7 < subject.remaining() <= 8
+    assert subject.expired is False
+    subject.check()
+
+
+def test_activate(get_handler):
+    deadline = get_handler(TARGET_MODULE)
+
+    with deadline.Deadline(10, margin=0).activate() as subject:
+        assert deadline.current() is subject
+        assert 9 < deadline.timeout() <= 10
+        assert deadline.clamp(5) == 5
+        assert 9 < deadline.clamp(60) <= 10
+
+    assert deadline.current() is None
+
+
+def test_expired_deadline(get_handler):
+    deadline = get_handler(TARGET_MODULE)
+
+    with deadline.Deadline(deadline.MIN_CALL_TIME, margin=1).activate() as subject:
+        assert subject.expired is True
+        with pytest.raises(deadline.DeadlineExceeded):
+            deadline.check("copy")
+        with pytest.raises(deadline.DeadlineExceeded):
+            deadline.timeout()
+        with pytest.raises(deadline.DeadlineExceeded):
+            deadline.clamp(5)
+
+
+def test_lambda_deadline(get_handler):
+    deadline = get_handler(TARGET_MODULE)
+
+    context = Mock(**{"get_remaining_time_in_millis.return_value": 30000})
+
+    with deadline.lambda_deadline(context) as subject:
+        assert deadline.current() is subject
+        remaining = 30 - deadline.SAFETY_MARGIN
+        assert remaining - 1 < subject.remaining() <= remaining
+
+    with deadline.lambda_deadline(None) as subject:
+        assert subject is None
+        assert deadline.current() is None
@@ -0,0 +1,121 @@
+import pytest
+from mock import Mock, patch
+
+from common import secrets
+
+TARGET_MODULE = "common.network_checkpoint"
+
+
+@pytest.fixture(autouse=True)
+def monkeypatch_ssm(monkeypatch):
+    def mock_return(path):
+        return "SECRET"
+
+    monkeypatch.setattr(secrets, "get_parameter", mock_return)
+
+
+def make_switch(name):
+    switch = Mock()
+    switch.name = name
+    return switch
+
+
+def make_portgroup(name):
+    portgroup = Mock()
+    portgroup.spec.name = name
+    return portgroup
+
+
+def make_plan():
+    from common.network_plan import (
+        NetworkCopyPlan,
+        PortgroupChange,
+        SkippedPortgroup,
+        SkipReason,
+        VswitchChange,
+    )
+
+    return NetworkCopyPlan(
+        "from",
+        "to",
+        vswitches_to_add=[VswitchChange("s1", Mock())],
+        portgroups_to_add=[
+            PortgroupChange("p1", "s1", Mock()),
+            PortgroupChange("p2", "s1", Mock()),
+        ],
+        portgroups_skipped=[SkippedPortgroup("vmk", SkipReason.DO_NOT_COPY)],
+    )
+
+
+def test_checkpoint_round_trip(get_handler):
+    network_checkpoint = get_handler(TARGET_MODULE)
+
+    checkpoint = network_checkpoint.NetworkCopyCheckpoint.from_plan(make_plan())
+    checkpoint.mark_applied(["s1"], ["p1"])
+
+    actual = network_checkpoint.NetworkCopyCheckpoint.from_json(checkpoint.to_json())
+
+    assert actual == checkpoint
+
+
+def test_checkpoint_to_plan(get_handler):
+    network_checkpoint = get_handler(TARGET_MODULE)
+
+    checkpoint = network_checkpoint.NetworkCopyCheckpoint.from_plan(make_plan())
+    checkpoint.mark_applied(["s1"], ["p1"])
+    source = Mock(
+        vswitches=[make_switch("s1")],
+        portgroups=[make_portgroup("p1"), make_portgroup("p2")],
+    )
+
+    plan = checkpoint.to_plan(source)
+    remaining = checkpoint.remaining(plan)
+
+    assert plan.to_dict() == make_plan().to_dict()
+    assert plan.portgroups_to_add[1].spec == source.portgroups[1].spec
+    assert remaining.vswitches_to_add == []
+    assert [change.name for change in remaining.portgroups_to_add] == ["p2"]
+
+
+def test_checkpoint_to_plan_source_changed(get_handler):
+    network_checkpoint = get_handler(TARGET_MODULE)
+
+    checkpoint = network_checkpoint.NetworkCopyCheckpoint.from_plan(make_plan())
+    source = Mock(vswitches=[make_switch("s1")], portgroups=[make_portgroup("p1")])
+
+    assert checkpoint.to_plan(source) is None
+
+
+def test_dynamodb_checkpoint_store(get_handler):
+    network_checkpoint = get_handler(TARGET_MODULE)
+
+    checkpoint = network_checkpoint.NetworkCopyCheckpoint.from_plan(make_plan())
+    ddb_mock = Mock()
+    ddb_mock.get_item.return_value = {
+        "Item": {"checkpoint": {"S": checkpoint.to_json()}}
+    }
+
+    with patch.object(network_checkpoint.boto, "get_client", return_value=ddb_mock):
+        store = network_checkpoint.DynamoDbCheckpointStore("table")
+        store.save(checkpoint)
+        actual = store.load("from", "to")
+        store.delete("from", "to")
+
+    item = ddb_mock.put_item.call_args[1]["Item"]
+    assert item["copy_key"] == {"S": "from/to"}
+    assert int(item["expires_at"]["N"]) > 0
+    assert ddb_mock.get_item.call_args[1]["Key"] == {"copy_key": {"S": "from/to"}}
+    assert actual == checkpoint
+    ddb_mock.delete_item.assert_called_once_with(
+        TableName="table", Key={"copy_key": {"S": "from/to"}}
+    )
+
+
+def test_dynamodb_checkpoint_store_missing(get_handler):
+    network_checkpoint = get_handler(TARGET_MODULE)
+
+    ddb_mock = Mock(**{"get_item.return_value": {}})
+    with patch.object(network_checkpoint.boto, "get_client", return_value=ddb_mock):
+        store = network_checkpoint.DynamoDbCheckpointStore("table")
+
+        assert store.load("from", "to") is None
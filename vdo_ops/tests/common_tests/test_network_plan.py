@@ -0,0 +1,174 @@
+import pytest
+from mock import Mock
+
+from common import secrets
+
+TARGET_MODULE = "common.network_plan"
+
+
+@pytest.fixture(autouse=True)
+def monkeypatch_ssm(monkeypatch):
+    def mock_return(path):
+        return "SECRET"
+
+    monkeypatch.setattr(secrets, "get_parameter", mock_return)
+
+
+@pytest.fixture
+def snapshot_class(get_handler):
+    return get_handler("common.clients.vsphere").HostNetworkSnapshot
+
+
+def make_switch(name):
+    switch = Mock()
+    switch.name = name
+    return switch
+
+
+def make_portgroup(name, switch_name):
+    portgroup = Mock(vswitch=f"key-vim.host.VirtualSwitch-{switch_name}")
+    portgroup.spec.name = name
+    return portgroup
+
+
+def test_plan_network_copy(get_handler, snapshot_class):
+    network_plan = get_handler(TARGET_MODULE)
+
+    # setup
+    source = snapshot_class(
+        "from",
+        vswitches=[make_switch("s1"), make_switch("s2")],
+        portgroups=[
+            make_portgroup("p1", "s1"),
+            make_portgroup("vmk", "s2"),
+            make_portgroup("p2", "s2"),
+            make_portgroup("p3", "s1"),
+        ],
+        console_vnics=[Mock(portgroup="vmk")],
+    )
+    destination = snapshot_class(
+        "to", vswitches=[make_switch("s1")], portgroups=[make_portgroup("p1", "s1")]
+    )
+
+    # when
+    actual = network_plan.plan_network_copy(source, destination)
+
+    # then
+    assert actual.source_host == "from"
+    assert actual.destination_host == "to"
+    assert actual.vswitches_to_add == [
+        network_plan.VswitchChange("s2", source.vswitches[1].spec)
+    ]
+    assert actual.portgroups_to_add == [
+        network_plan.PortgroupChange("p3", "s1", source.portgroups[3].spec),
+        network_plan.PortgroupChange("p2", "s2", source.portgroups[2].spec),
+    ]
+    assert actual.portgroups_skipped == [
+        network_plan.SkippedPortgroup("p1", network_plan.SkipReason.ALREADY_EXISTS),
+        network_plan.SkippedPortgroup("vmk", network_plan.SkipReason.DO_NOT_COPY),
+    ]
+    assert actual.is_empty is False
+    assert actual.to_dict() == {
+        "source_host": "from",
+        "destination_host": "to",
+        "vswitches_to_add": ["s2"],
+        "portgroups_to_add": [
+            {"name": "p3", "vswitch_name": "s1"},
+            {"name": "p2", "vswitch_name": "s2"},
+        ],
+        "portgroups_skipped": [
+            {"name": "p1", "reason": "already_exists"},
+            {"name": "vmk", "reason": "do_not_copy"},
+        ],
+    }
+
+
+def test_plan_network_copy_nothing_missing(get_handler, snapshot_class):
+    network_plan = get_handler(TARGET_MODULE)
+
+    snapshot = snapshot_class(
+        "host", vswitches=[make_switch("s1")], portgroups=[make_portgroup("p1", "s1")]
+    )
+
+    actual = network_plan.plan_network_copy(snapshot, snapshot)
+
+    assert actual.is_empty is True
+    assert actual.vswitches_to_add == []
+    assert actual.portgroups_to_add == []
+
+
+def test_diff_networks(get_handler, snapshot_class):
+    network_plan = get_handler(TARGET_MODULE)
+
+    reference = snapshot_class(
+        "reference",
+        vswitches=[make_switch("s1"), make_switch("s2")],
+        portgroups=[
+            make_portgroup("p1", "s1"),
+            make_portgroup("p2", "s2"),
+            make_portgroup("vmk-ref", "s1"),
+        ],
+        vnics=[Mock(portgroup="vmk-ref")],
+    )
+    host = snapshot_class(
+        "host",
+        vswitches=[make_switch("s1"), make_switch("s3")],
+        portgroups=[
+            make_portgroup("p1", "s1"),
+            make_portgroup("p4", "s3"),
+            make_portgroup("vmk-host", "s1"),
+        ],
+        vnics=[Mock(portgroup="vmk-host")],
+    )
+
+    actual = network_plan.diff_networks(reference, host)
+
+    assert actual.host_name == "host"
+    assert actual.conformant is False
+    assert actual.missing_vswitches == ["s2"]
+    assert actual.extra_vswitches == ["s3"]
+    assert actual.missing_portgroups == ["p2"]
+    assert actual.extra_portgroups == ["p4"]
+    assert network_plan.diff_networks(reference, reference).conformant is True
+
+
+def make_dvs_portgroup(name, vlan_id, uplink=False):
+    from pyVmomi import vim
+
+    vlan_spec = vim.dvs.VmwareDistributedVirtualSwitch.VlanIdSpec(vlanId=vlan_id)
+    return vim.dvs.DistributedVirtualPortgroup.ConfigInfo(
+        key=f"dvportgroup-{name}",
+        name=name,
+        type="earlyBinding",
+        uplink=uplink,
+        configVersion="1",
+        defaultPortConfig=vim.dvs.VmwareDistributedVirtualSwitch.VmwarePortConfigPolicy(
+            vlan=vlan_spec
+        ),
+    )
+
+
+def test_plan_dvs_portgroup_copy(get_handler):
+    network_plan = get_handler(TARGET_MODULE)
+
+    source = {
+        "uplinks": make_dvs_portgroup("uplinks", 0, uplink=True),
+        "p1": make_dvs_portgroup("p1", 101),
+        "p2": make_dvs_portgroup("p2", 102),
+        "p3": make_dvs_portgroup("p3", 103),
+    }
+    destination = {
+        "p1": make_dvs_portgroup("p1", 101),
+        "p2": make_dvs_portgroup("p2", 202),
+    }
+
+    plan = network_plan.plan_dvs_portgroup_copy("dvs1", "dvs2", source, destination)
+
+    assert [change.name for change in plan.portgroups_to_create] == ["p3"]
+    assert plan.portgroups_to_create[0].current_config is None
+    assert [change.name for change in plan.portgroups_to_reconfigure] == ["p2"]
+    assert plan.portgroups_to_reconfigure[0].current_config == destination["p2"]
+    assert plan.to_dict()["portgroups_skipped"] == [
+        {"name": "p1", "reason": "already_exists"},
+        {"name": "uplinks", "reason": "uplink"},
+    ]
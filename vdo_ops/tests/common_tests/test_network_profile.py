@@ -0,0 +1,163 @@
+import pytest
+from mock import Mock, patch
+from pyVmomi import vim
+
+from common import secrets
+
+TARGET_MODULE = "common.network_profile"
+
+
+@pytest.fixture(autouse=True)
+def monkeypatch_ssm(monkeypatch):
+    def mock_return(path):
+        return "SECRET"
+
+    monkeypatch.setattr(secrets, "get_parameter", mock_return)
+
+
+def make_snapshot(portgroup_count=3):
+    from common.clients.vsphere import HostNetworkSnapshot
+
+    vswitch = vim.host.VirtualSwitch(
+        name="vSwitch1",
+        spec=vim.host.VirtualSwitch.Specification(
+            numPorts=128,
+            bridge=vim.host.VirtualSwitch.BondBridge(nicDevice=["vmnic1"]),
+        ),
+    )
+    portgroups = [
+        vim.host.PortGroup(
+            spec=vim.host.PortGroup.Specification(
+                name=f"VLAN{index}",
+                vlanId=index,
+                vswitchName="vSwitch1",
+                policy=vim.host.NetworkPolicy(),
+            ),
+            vswitch="key-vim.host.VirtualSwitch-vSwitch1",
+        )
+        for index in range(portgroup_count)
+    ]
+    return HostNetworkSnapshot(
+        "source",
+        vswitches=[vswitch],
+        portgroups=portgroups,
+        vnics=[Mock(portgroup="VLAN0")],
+    )
+
+
+def test_profile_leaves_out_do_not_copy_portgroups(get_handler):
+    network_profile = get_handler(TARGET_MODULE)
+
+    profile = network_profile.NetworkProfile.from_snapshot(make_snapshot())
+
+    assert profile.host_name == "source"
+    assert profile.vswitch_names == {"vSwitch1"}
+    assert profile.portgroup_names == {"VLAN1", "VLAN2"}
+    assert profile.is_in_do_not_copy_list("VLAN0") is False
+
+
+def test_profile_round_trip(get_handler):
+    network_profile = get_handler(TARGET_MODULE)
+    profile = network_profile.NetworkProfile.from_snapshot(make_snapshot())
+
+    actual = network_profile.NetworkProfile.loads(profile.dumps())
+
+    assert actual.host_name == profile.host_name
+    assert actual.captured_at == profile.captured_at
+    (vswitch,) = actual.vswitches
+    assert vswitch.name == "vSwitch1"
+    assert vswitch.spec.numPorts == 128
+    assert vswitch.spec.bridge.nicDevice == ["vmnic1"]
+    assert [p.spec.vlanId for p in actual.portgroups] == [1, 2]
+    assert [p.vswitch for p in actual.portgroups] == [
+        "key-vim.host.VirtualSwitch-vSwitch1"
+    ] * 2
+
+
+def test_profile_is_compact(get_handler):
+    network_profile = get_handler(TARGET_MODULE)
+
+    profile = network_profile.NetworkProfile.from_snapshot(make_snapshot(200))
+
+    assert len(profile.dumps()) < network_profile.SSM_MAX_VALUE_SIZE
+
+
+def test_profile_version_mismatch(get_handler):
+    network_profile = get_handler(TARGET_MODULE)
+    values = network_profile.NetworkProfile.from_snapshot(make_snapshot()).to_dict()
+    values["version"] = network_profile.PROFILE_VERSION + 1
+
+    with pytest.raises(Exception, match="Unsupported network profile version"):
+        network_profile.NetworkProfile.from_dict(values)
+
+
+def test_profile_plans_like_a_snapshot(get_handler):
+    from common.clients.vsphere import HostNetworkSnapshot
+    from common.network_plan import plan_network_copy
+
+    network_profile = get_handler(TARGET_MODULE)
+    profile = network_profile.NetworkProfile.loads(
+        network_profile.NetworkProfile.from_snapshot(make_snapshot()).dumps()
+    )
+
+    plan = plan_network_copy(profile, HostNetworkSnapshot("destination"))
+
+    assert [change.name for change in plan.vswitches_to_add] == ["vSwitch1"]
+    assert [change.name for change in plan.portgroups_to_add] == ["VLAN1", "VLAN2"]
+    assert plan.portgroups_skipped == []
+
+
+def test_file_store(get_handler, tmp_path):
+    network_profile = get_handler(TARGET_MODULE)
+    store = network_profile.FileProfileStore(str(tmp_path / "profiles"))
+    profile = network_profile.NetworkProfile.from_snapshot(make_snapshot())
+
+    store.save("golden", profile)
+    actual = store.load("golden")
+
+    assert actual.portgroup_names == profile.portgroup_names
+
+
+def test_ssm_store(get_handler, monkeypatch):
+    network_profile = get_handler(TARGET_MODULE)
+    store = network_profile.SsmProfileStore("/rpcv/dev/network_profiles")
+    profile = network_profile.NetworkProfile.from_snapshot(make_snapshot())
+    ssm_mock = Mock()
+
+    with patch.object(network_profile.boto, "get_client", return_value=ssm_mock):
+        store.save("golden", profile)
+
+    kwargs = ssm_mock.put_parameter.call_args[1]
+    assert kwargs["Name"] == "/rpcv/dev/network_profiles/golden"
+    assert kwargs["Overwrite"] is True
+
+    monkeypatch.setattr(secrets, "get_parameter", lambda path: kwargs["Value"])
+    assert store.load("golden").portgroup_names == profile.portgroup_names
+
+
+def test_ssm_store_rejects_large_profile(get_handler):
+    network_profile = get_handler(TARGET_MODULE)
+    store = network_profile.SsmProfileStore("/rpcv/dev/network_profiles")
+    profile = Mock()
+    profile.dumps.return_value = "x" * (network_profile.SSM_MAX_VALUE_SIZE + 1)
+    ssm_mock = Mock()
+
+    with patch.object(network_profile.boto, "get_client", return_value=ssm_mock):
+        with pytest.raises(Exception, match="over the 8192 bytes"):
+            store.save("golden", profile)
+
+    ssm_mock.put_parameter.assert_not_called()
+
+
+def test_profile_round_trip_portgroup_without_vswitch(get_handler):
+    network_profile = get_handler(TARGET_MODULE)
+    snapshot = make_snapshot()
+    snapshot.portgroups[1].vswitch = None
+    profile = network_profile.NetworkProfile.from_snapshot(snapshot)
+
+    actual = network_profile.NetworkProfile.loads(profile.dumps())
+
+    assert [p.vswitch for p in actual.portgroups] == [
+        None,
+        "key-vim.host.VirtualSwitch-vSwitch1",
+    ]
@@ -0,0 +1,67 @@
+import pytest
+
+from tests.helper import util
+
+TARGET_MODULE = "common.vm_inventory"
+
+
+def load_vms():
+    return util.load_json_file("data/zamboni/get_vm_list.json")["data"]
+
+
+def test_merge(get_handler):
+    vm_inventory = get_handler(TARGET_MODULE)
+    vms = load_vms()
+    inventory = vm_inventory.VmInventory("vcenter")
+    inventory.replace(vms[:4])
+    changed = util.load_json_file("data/zamboni/modified_vm_list.json")
+    changed.append(vms[4])
+
+    actual = inventory.merge(changed, [vm["id"] for vm in vms[:2]])
+
+    assert actual == {"added": 1, "updated": 1, "removed": 2}
+    assert set(inventory.vms) == {vms[0]["id"], vms[1]["id"], vms[4]["id"]}
+    assert inventory.vms[vms[0]["id"]]["name"] == "some-test"
+
+
+def test_replace(get_handler):
+    vm_inventory = get_handler(TARGET_MODULE)
+    vms = load_vms()
+    inventory = vm_inventory.VmInventory("vcenter")
+    inventory.replace(vms[:3])
+
+    actual = inventory.replace(vms[2:])
+
+    assert actual == {"added": 2, "updated": 1, "removed": 2}
+    assert len(inventory.vm_list()) == 3
+
+
+def test_file_store(get_handler, tmp_path):
+    vm_inventory = get_handler(TARGET_MODULE)
+    store = vm_inventory.FileInventoryStore(str(tmp_path / "inventories"))
+    inventory = vm_inventory.VmInventory("vcenter", watermark="2020-06-01T00:00:00")
+    inventory.replace(load_vms())
+
+    assert store.load("vcenter") is None
+    store.save(inventory)
+    actual = store.load("vcenter")
+
+    assert actual.watermark == inventory.watermark
+    assert actual.vms == inventory.vms
+
+
+def test_file_store_ignores_unreadable_inventory(get_handler, tmp_path):
+    vm_inventory = get_handler(TARGET_MODULE)
+    store = vm_inventory.FileInventoryStore(str(tmp_path))
+    (tmp_path / f"vcenter{vm_inventory.INVENTORY_FILE_SUFFIX}").write_text("garbage")
+
+    assert store.load("vcenter") is None
+
+
+def test_inventory_version_mismatch(get_handler):
+    vm_inventory = get_handler(TARGET_MODULE)
+    values = vm_inventory.VmInventory("vcenter").to_dict()
+    values["version"] = vm_inventory.INVENTORY_VERSION + 1
+
+    with pytest.raises(Exception, match="Unsupported VM inventory version"):
+        vm_inventory.VmInventory.from_dict(values)
@@ -1,7 +1,7 @@
 import mock
 import pytest
 from mock import Mock, patch
-from unittest.mock import call
+from unittest.mock import ANY, call
 from common import secrets
 
 VCENTER_HOST = "123.123.123.123"
@@ -28,7 +28,41 @@ def test_vcenter_init(get_handler):
 
     with mock.patch.object(handler, "VsphereClient") as vsphere_client:
         handler.VsphereApi(VCENTER_HOST)
-        vsphere_client.assert_called_with(VCENTER_HOST)
+        vsphere_client.assert_called_with(VCENTER_HOST, session_pool=None)
+
+
+def make_switch(name):
+    switch = Mock()
+    switch.name = name
+    return switch
+
+
+def make_portgroup(name, switch_name):
+    portgroup = Mock(vswitch=f"key-vim.host.VirtualSwitch-{switch_name}")
+    portgroup.spec.name = name
+    return portgroup
+
+
+def make_snapshots():
+    from common.clients.vsphere import HostNetworkSnapshot
+
+    source = HostNetworkSnapshot(
+        "from",
+        vswitches=[make_switch("from1"), make_switch("from2")],
+        portgroups=[
+            make_portgroup("p1", "from1"),
+            make_portgroup("p2", "from1"),
+            make_portgroup("p3", "from2"),
+            make_portgroup("vmk", "from2"),
+        ],
+        vnics=[Mock(portgroup="vmk")],
+    )
+    destination = HostNetworkSnapshot(
+        "to",
+        vswitches=[make_switch("from1")],
+        portgroups=[make_portgroup("p1", "from1")],
+    )
+    return source, destination
 
 
 @patch("common.vsphere_api.VsphereClient")
@@ -38,45 +72,550 @@ def test_copy_networks(client_mock, get_handler):
     client_mock.open_session.return_value = TestSessionManager()
 
     # setup
-    spec = Mock()
-    from_switch1 = Mock()
-    from_switch1.name = "from1"
-    from_switch2 = Mock()
-    from_switch2.name = "from2"
-    from_switch2.spec = spec
-    client_mock.get_host_virtual_switches.return_value = [from_switch1, from_switch2]
-    client_mock.has_virtual_switch.side_effect = [True, False]
+    source, destination = make_snapshots()
+    client_mock.get_host_network_snapshot.side_effect = [source, destination]
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
+
+    # when
+    vsphere_api.copy_networks("from", "to")
 
-    client_mock.add_host_vswitch.return_value = Mock()
+    # then
+    client_mock.open_session.assert_called()
+    client_mock.get_host_network_snapshot.assert_has_calls([call("from"), call("to")])
+    client_mock.update_host_network.assert_called_once_with(
+        "to",
+        [("from2", source.vswitches[1].spec)],
+        [source.portgroups[1].spec, source.portgroups[2].spec],
+    )
+    client_mock.add_host_vswitch.assert_not_called()
+    client_mock.add_host_portgroup.assert_not_called()
 
-    portgroup = Mock()
-    portgroup_spec = Mock()
-    portgroup_spec.name = "p1"
-    portgroup.spec = portgroup_spec
-    portgroup1 = Mock()
-    portgroup_spec1 = Mock()
-    portgroup_spec1.name = "p2"
-    portgroup1.spec = portgroup_spec1
-    client_mock.get_portgroup_by_vswitch.return_value = [portgroup, portgroup1]
-    client_mock.is_in_do_not_copy_list.side_effect = [True, False, True, False]
-    client_mock.has_portgroup.side_effect = [False, False]
 
-    client_mock.add_host_portgroup.return_value = Mock()
+@patch("common.vsphere_api.VsphereClient")
+def test_copy_networks_from_other_vcenter(client_mock, get_handler):
+    import threading
+    from contextlib import contextmanager
+
+    vsphere_api_handler = get_handler("common.vsphere_api")
+    source, destination = make_snapshots()
+    # Both sessions have to be open at the same time to get past the barrier
+    logins = threading.Barrier(2, timeout=5)
+
+    @contextmanager
+    def open_session():
+        logins.wait()
+        yield
+
+    source_client = mock.MagicMock(open_session=open_session)
+    source_client.get_host_network_snapshot.return_value = source
+    destination_client = mock.MagicMock(open_session=open_session)
+    destination_client.get_host_network_snapshot.return_value = destination
+
+    source_api = vsphere_api_handler.VsphereApi("source-vcenter")
+    source_api._client = source_client
+    destination_api = vsphere_api_handler.VsphereApi("destination-vcenter")
+    destination_api._client = destination_client
+
+    # when
+    plan = destination_api.copy_networks_from(source_api, "from", "to")
+
+    # then
+    assert [c.name for c in plan.portgroups_to_add] == ["p2", "p3"]
+    source_client.get_host_network_snapshot.assert_called_once_with("from")
+    destination_client.get_host_network_snapshot.assert_called_once_with("to")
+    destination_client.update_host_network.assert_called_once_with(
+        "to",
+        [("from2", source.vswitches[1].spec)],
+        [source.portgroups[1].spec, source.portgroups[2].spec],
+    )
+    source_client.update_host_network.assert_not_called()
+
+
+@patch("common.vsphere_api.VsphereClient")
+def test_copy_networks_nothing_missing(client_mock, get_handler):
+    vsphere_api_handler = get_handler("common.vsphere_api")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    source, destination = make_snapshots()
+    client_mock.get_host_network_snapshot.side_effect = [destination, destination]
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
+
+    vsphere_api.copy_networks("from", "to")
+
+    client_mock.update_host_network.assert_not_called()
+    client_mock.add_host_vswitch.assert_not_called()
+    client_mock.add_host_portgroup.assert_not_called()
+
+
+@patch("common.vsphere_api.VsphereClient")
+def test_copy_networks_falls_back_when_batch_rejected(client_mock, get_handler):
+    from pyVmomi import vim
+
+    vsphere_api_handler = get_handler("common.vsphere_api")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    source, destination = make_snapshots()
+    client_mock.get_host_network_snapshot.side_effect = [
+        source,
+        destination,
+        destination,
+    ]
+    client_mock.update_host_network.side_effect = vim.fault.PlatformConfigFault(
+        msg="rejected"
+    )
 
     vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
     vsphere_api._client = client_mock
 
-    # when
     vsphere_api.copy_networks("from", "to")
 
+    client_mock.add_host_vswitch.assert_called_once_with(
+        "to", "from2", source.vswitches[1].spec
+    )
+    client_mock.add_host_portgroup.assert_has_calls(
+        [call("to", source.portgroups[1].spec), call("to", source.portgroups[2].spec)]
+    )
+    assert client_mock.add_host_portgroup.call_count == 2
+
+
+@patch("common.vsphere_api.VsphereClient")
+def test_copy_networks_without_batch(client_mock, get_handler):
+    vsphere_api_handler = get_handler("common.vsphere_api")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    source, destination = make_snapshots()
+    client_mock.get_host_network_snapshot.side_effect = [source, destination]
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
+
+    vsphere_api.copy_networks("from", "to", batch=False)
+
+    client_mock.update_host_network.assert_not_called()
+    client_mock.add_host_vswitch.assert_called_once_with(
+        "to", "from2", source.vswitches[1].spec
+    )
+    assert client_mock.add_host_portgroup.call_count == 2
+
+
+@patch("common.vsphere_api.VsphereClient")
+def test_copy_networks_dry_run(client_mock, get_handler):
+    vsphere_api_handler = get_handler("common.vsphere_api")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    source, destination = make_snapshots()
+    client_mock.get_host_network_snapshot.side_effect = [source, destination]
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
+
+    actual = vsphere_api.copy_networks("from", "to", dry_run=True)
+
+    assert [change.name for change in actual.vswitches_to_add] == ["from2"]
+    assert [change.name for change in actual.portgroups_to_add] == ["p2", "p3"]
+    client_mock.update_host_network.assert_not_called()
+    client_mock.add_host_vswitch.assert_not_called()
+    client_mock.add_host_portgroup.assert_not_called()
+
+
+@patch("common.vsphere_api.VsphereClient")
+def test_copy_networks_saves_checkpoint(client_mock, get_handler):
+    vsphere_api_handler = get_handler("common.vsphere_api")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    source, destination = make_snapshots()
+    client_mock.get_host_network_snapshot.side_effect = [source, destination]
+    store = Mock(**{"load.return_value": None})
+    saved = []
+    store.save.side_effect = lambda checkpoint: saved.append(checkpoint.to_json())
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
+
+    vsphere_api.copy_networks("from", "to", checkpoint_store=store)
+
+    store.load.assert_called_once_with("from", "to")
+    client_mock.update_host_network.assert_called_once()
+    # Once for the plan, then the finished copy is deleted
+    assert len(saved) == 1
+    assert '"applied_portgroups":[]' in saved[0]
+    store.delete.assert_called_once_with("from", "to")
+
+
+@patch("common.vsphere_api.VsphereClient")
+def test_copy_networks_saves_checkpoint_every_batch(client_mock, get_handler):
+    vsphere_api_handler = get_handler("common.vsphere_api")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    source, destination = make_snapshots()
+    client_mock.get_host_network_snapshot.side_effect = [source, destination]
+    store = Mock(**{"load.return_value": None})
+    saved = []
+    store.save.side_effect = lambda checkpoint: saved.append(checkpoint.to_json())
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
+
+    with patch.object(vsphere_api_handler, "CHECKPOINT_EVERY", 2):
+        vsphere_api.copy_networks("from", "to", batch=False, checkpoint_store=store)
+
+    assert len(saved) == 2
+    assert '"applied_vswitches":["from2"]' in saved[1]
+    assert '"applied_portgroups":["p2"]' in saved[1]
+
+
+@patch("common.vsphere_api.VsphereClient")
+def test_copy_networks_saves_checkpoint_on_failure(client_mock, get_handler):
+    from common import deadline
+
+    vsphere_api_handler = get_handler("common.vsphere_api")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    source, destination = make_snapshots()
+    client_mock.get_host_network_snapshot.side_effect = [source, destination]
+    client_mock.add_host_portgroup.side_effect = [
+        None,
+        deadline.DeadlineExceeded("Not enough time left"),
+    ]
+    store = Mock(**{"load.return_value": None})
+    saved = []
+
+    def save(checkpoint):
+        saved.append((checkpoint.to_json(), deadline.current()))
+
+    store.save.side_effect = save
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
+
+    with pytest.raises(deadline.DeadlineExceeded):
+        vsphere_api.copy_networks("from", "to", batch=False, checkpoint_store=store)
+
+    assert len(saved) == 2
+    checkpoint_json, grace = saved[1]
+    assert '"applied_portgroups":["p2"]' in checkpoint_json
+    # Saved within a grace period of its own, the copy deadline being spent
+    assert grace is not None and grace.remaining() > 1
+    store.delete.assert_not_called()
+
+
+@patch("common.vsphere_api.VsphereClient")
+def test_copy_networks_resumes_from_checkpoint(client_mock, get_handler):
+    from common.network_checkpoint import NetworkCopyCheckpoint
+    from common.network_plan import plan_network_copy
+
+    vsphere_api_handler = get_handler("common.vsphere_api")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    source, destination = make_snapshots()
+    checkpoint = NetworkCopyCheckpoint.from_plan(plan_network_copy(source, destination))
+    checkpoint.mark_applied(["from2"], ["p2"])
+    client_mock.get_host_network_snapshot.side_effect = [source]
+    store = Mock(**{"load.return_value": checkpoint})
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
+
+    actual = vsphere_api.copy_networks("from", "to", checkpoint_store=store)
+
+    # The destination is not read again, only what is left is applied
+    client_mock.get_host_network_snapshot.assert_called_once_with("from")
+    client_mock.update_host_network.assert_called_once_with(
+        "to", [], [source.portgroups[2].spec]
+    )
+    assert [change.name for change in actual.portgroups_to_add] == ["p2", "p3"]
+    assert checkpoint.applied_portgroups == {"p2", "p3"}
+    store.delete.assert_called_once_with("from", "to")
+
+
+@patch("common.vsphere_api.VsphereClient")
+def test_copy_networks_to_many(client_mock, get_handler):
+    vsphere_api_handler = get_handler("common.vsphere_api")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    source, destination = make_snapshots()
+
+    def get_snapshot(host_name):
+        if host_name == "broken":
+            raise Exception("Boom!")
+        if host_name == "from":
+            return source
+        return type(destination)(
+            host_name,
+            vswitches=destination.vswitches,
+            portgroups=destination.portgroups,
+        )
+
+    client_mock.get_host_network_snapshot.side_effect = get_snapshot
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
+
+    # when
+    actual = vsphere_api.copy_networks_to_many(
+        "from", ["to1", "broken", "to2"], max_workers=2
+    )
+
     # then
-    client_mock.open_session.assert_called()
+    assert list(actual) == ["to1", "broken", "to2"]
+    assert actual["to1"].succeeded is True
+    assert actual["to2"].succeeded is True
+    assert actual["broken"].succeeded is False
+    assert actual["broken"].error == "Boom!"
+    assert [c.name for c in actual["to1"].plan.portgroups_to_add] == ["p2", "p3"]
+
+    source_reads = [
+        c
+        for c in client_mock.get_host_network_snapshot.call_args_list
+        if c == call("from")
+    ]
+    assert len(source_reads) == 1
+    client_mock.open_session.assert_called_once()
+    client_mock.update_host_network.assert_has_calls(
+        [
+            call("to1", [("from2", source.vswitches[1].spec)], ANY),
+            call("to2", [("from2", source.vswitches[1].spec)], ANY),
+        ],
+        any_order=True,
+    )
+
+
+@patch("common.vsphere_api.VsphereClient")
+def test_audit_cluster_networks(client_mock, get_handler):
+    vsphere_api_handler = get_handler("common.vsphere_api")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    source, destination = make_snapshots()
+    client_mock.get_cluster_network_snapshots.return_value = {
+        "to": destination,
+        "from": source,
+    }
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
+
+    actual = vsphere_api.audit_cluster_networks("from", "cluster")
+
+    client_mock.get_cluster_network_snapshots.assert_called_once_with("cluster")
+    client_mock.get_host_network_snapshot.assert_not_called()
+    assert list(actual) == ["to"]
+    assert actual["to"].missing_vswitches == ["from2"]
+    assert actual["to"].missing_portgroups == ["p2", "p3"]
+
+
+@patch("common.vsphere_api.VsphereClient")
+def test_audit_cluster_networks_reference_outside_cluster(client_mock, get_handler):
+    vsphere_api_handler = get_handler("common.vsphere_api")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    source, destination = make_snapshots()
+    client_mock.get_cluster_network_snapshots.return_value = {"to": destination}
+    client_mock.get_host_network_snapshot.return_value = source
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
+
+    actual = vsphere_api.audit_cluster_networks("from", "cluster")
+
+    client_mock.get_host_network_snapshot.assert_called_once_with("from")
+    assert actual["to"].conformant is False
+
+
+def make_dvs_change(name, current_config=None):
+    from common.network_plan import DvsPortgroupChange
+
+    return DvsPortgroupChange(name, Mock(), current_config)
+
+
+@patch("common.vsphere_api.plan_dvs_portgroup_copy")
+@patch("common.vsphere_api.VsphereClient")
+def test_copy_dvs_portgroups(client_mock, plan_mock, get_handler):
+    from common.network_plan import DvsPortgroupCopyPlan
+
+    vsphere_api_handler = get_handler("common.vsphere_api")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    current = Mock()
+    plan = DvsPortgroupCopyPlan(
+        "dvs1",
+        "dvs2",
+        portgroups_to_create=[make_dvs_change(f"p{i}") for i in range(3)],
+        portgroups_to_reconfigure=[make_dvs_change("p3", current)],
+    )
+    plan_mock.return_value = plan
+    client_mock.wait_for_tasks.side_effect = lambda tasks: [None] * len(tasks)
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
+
+    actual = vsphere_api.copy_dvs_portgroups("dvs1", "dvs2", batch_size=2)
+
+    assert actual == plan
+    client_mock.get_dvs_portgroups.assert_has_calls([call("dvs1"), call("dvs2")])
+    assert client_mock.create_dvs_portgroup.call_count == 3
+    client_mock.reconfigure_dvs_portgroup.assert_called_once_with(
+        current, plan.portgroups_to_reconfigure[0].config
+    )
+    # Two batches of two tasks, each waited for with a single call
+    assert [len(c[0][0]) for c in client_mock.wait_for_tasks.call_args_list] == [2, 2]
+
+
+@patch("common.vsphere_api.plan_dvs_portgroup_copy")
+@patch("common.vsphere_api.VsphereClient")
+def test_copy_dvs_portgroups_failed_task(client_mock, plan_mock, get_handler):
+    from common.network_plan import DvsPortgroupCopyPlan
+
+    vsphere_api_handler = get_handler("common.vsphere_api")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    plan_mock.return_value = DvsPortgroupCopyPlan(
+        "dvs1",
+        "dvs2",
+        portgroups_to_create=[make_dvs_change("p1"), make_dvs_change("p2")],
+    )
+    client_mock.wait_for_tasks.return_value = [None, Mock(msg="duplicate")]
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
 
-    client_mock.get_host_virtual_switches.assert_called_with("from")
-    calls = [
-        call("to", "from1"),
-        call("to", "from2"),
+    with pytest.raises(Exception, match="p2"):
+        vsphere_api.copy_dvs_portgroups("dvs1", "dvs2")
+
+
+@patch("common.vsphere_api.plan_dvs_portgroup_copy")
+@patch("common.vsphere_api.VsphereClient")
+def test_copy_dvs_portgroups_submit_error(client_mock, plan_mock, get_handler):
+    from common.network_plan import DvsPortgroupCopyPlan
+
+    vsphere_api_handler = get_handler("common.vsphere_api")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    plan_mock.return_value = DvsPortgroupCopyPlan(
+        "dvs1",
+        "dvs2",
+        portgroups_to_create=[make_dvs_change(f"p{i}") for i in range(3)],
+    )
+    client_mock.create_dvs_portgroup.side_effect = [
+        "task0",
+        "task1",
+        Exception("Boom!"),
     ]
-    client_mock.has_virtual_switch.assert_has_calls(calls, any_order=True)
-    client_mock.add_host_vswitch.assert_called_with("to", "from2", spec)
-    client_mock.add_host_portgroup.assert_called_with("to", portgroup_spec1)
+    client_mock.wait_for_tasks.return_value = [None, Mock(msg="duplicate")]
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
+
+    with pytest.raises(Exception) as e:
+        vsphere_api.copy_dvs_portgroups("dvs1", "dvs2")
+
+    # The tasks submitted before the error are still waited for
+    client_mock.wait_for_tasks.assert_called_once_with(["task0", "task1"])
+    assert str(e.value) == (
+        "Failed to copy portgroup p2 to dvs2: Boom!. Copied: p0. Failed: p1"
+    )
+
+
+@patch("common.vsphere_api.plan_dvs_portgroup_copy")
+@patch("common.vsphere_api.VsphereClient")
+def test_copy_dvs_portgroups_out_of_time(client_mock, plan_mock, get_handler):
+    from common.deadline import DeadlineExceeded
+    from common.network_plan import DvsPortgroupCopyPlan
+
+    vsphere_api_handler = get_handler("common.vsphere_api")
+    deadline = get_handler("common.deadline")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    plan_mock.return_value = DvsPortgroupCopyPlan(
+        "dvs1",
+        "dvs2",
+        portgroups_to_create=[make_dvs_change("p1"), make_dvs_change("p2")],
+    )
+    client_mock.create_dvs_portgroup.side_effect = ["task1", DeadlineExceeded()]
+    remaining = []
+
+    def wait_for_tasks(tasks):
+        remaining.append(deadline.current().remaining())
+        return [None]
+
+    client_mock.wait_for_tasks.side_effect = wait_for_tasks
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
+
+    with pytest.raises(DeadlineExceeded):
+        vsphere_api.copy_dvs_portgroups("dvs1", "dvs2")
+
+    # Waited for within the grace period
+    assert remaining[0] > 1
+
+
+@patch("common.vsphere_api.VsphereClient")
+def test_copy_dvs_portgroups_dry_run(client_mock, get_handler):
+    vsphere_api_handler = get_handler("common.vsphere_api")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    client_mock.get_dvs_portgroups.side_effect = [{"p1": Mock(uplink=False)}, {}]
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
+
+    plan = vsphere_api.copy_dvs_portgroups("dvs1", "dvs2", dry_run=True)
+
+    assert [change.name for change in plan.portgroups_to_create] == ["p1"]
+    client_mock.create_dvs_portgroup.assert_not_called()
+    client_mock.wait_for_tasks.assert_not_called()
+
+
+@patch("common.vsphere_api.VsphereClient")
+def test_capture_network_profile(client_mock, get_handler):
+    vsphere_api_handler = get_handler("common.vsphere_api")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    store = Mock()
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
+
+    profile = vsphere_api.capture_network_profile("from", "golden", store)
+
+    client_mock.export_network_profile.assert_called_once_with("from")
+    assert profile is client_mock.export_network_profile.return_value
+    store.save.assert_called_once_with("golden", profile)
+
+
+@patch("common.vsphere_api.VsphereClient")
+def test_apply_network_profile(client_mock, get_handler):
+    from common.network_profile import NetworkProfile
+
+    vsphere_api_handler = get_handler("common.vsphere_api")
+
+    client_mock.open_session.return_value = TestSessionManager()
+    source, destination = make_snapshots()
+    profile = NetworkProfile(
+        "from",
+        vswitches=source.vswitches,
+        portgroups=[
+            p
+            for p in source.portgroups
+            if not source.is_in_do_not_copy_list(p.spec.name)
+        ],
+    )
+    client_mock.get_host_network_snapshot.side_effect = lambda host_name: type(
+        destination
+    )(host_name, vswitches=destination.vswitches, portgroups=destination.portgroups)
+
+    vsphere_api = vsphere_api_handler.VsphereApi(VCENTER_HOST)
+    vsphere_api._client = client_mock
+
+    actual = vsphere_api.apply_network_profile(profile, ["to1", "to2"])
+
+    assert all(result.succeeded for result in actual.values())
+    assert [c.name for c in actual["to2"].plan.portgroups_to_add] == ["p2", "p3"]
+    client_mock.get_host_network_snapshot.assert_has_calls(
+        [call("to1"), call("to2")], any_order=True
+    )
+    assert call("from") not in client_mock.get_host_network_snapshot.call_args_list
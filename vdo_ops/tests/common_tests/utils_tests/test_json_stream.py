@@ -0,0 +1,99 @@
+import json
+import random
+
+import pytest
+
+from tests.helper import util
+
+TARGET_MODULE = "common.utils.json_stream"
+
+
+def to_chunks(data, size):
+    chunks = []
+    for start in range(0, len(data), size):
+        end = start + size
+        chunks.append(data[start:end])
+    return chunks
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024, 1_000_000])
+def test_iter_array_items(get_handler, chunk_size):
+    json_stream = get_handler(TARGET_MODULE)
+    page = util.load_json_file("data/zamboni/get_vm_list.json")
+    raw = json.dumps(page, indent=2).encode("utf-8")
+
+    other_values = {}
+    actual = list(
+        json_stream.iter_array_items(to_chunks(raw, chunk_size), "data", other_values)
+    )
+
+    assert actual == page["data"]
+    assert other_values == {"meta": page["meta"]}
+
+
+def test_iter_array_items_values_after_array(get_handler):
+    json_stream = get_handler(TARGET_MODULE)
+    raw = '{"data": [{"name": "é"}, 12345, []], "count": 123456, "meta": {}}'
+    chunks = to_chunks(raw.encode("utf-8"), 2)
+
+    other_values = {}
+    items = json_stream.iter_array_items(chunks, "data", other_values)
+
+    assert next(items) == {"name": "é"}
+    assert other_values == {}
+    assert list(items) == [12345, []]
+    assert other_values == {"count": 123456, "meta": {}}
+
+
+@pytest.mark.parametrize("raw", ['{"data": []}', "{}", '{"meta": 1}'])
+def test_iter_array_items_empty(get_handler, raw):
+    json_stream = get_handler(TARGET_MODULE)
+
+    assert list(json_stream.iter_array_items([raw.encode("utf-8")], "data")) == []
+
+
+@pytest.mark.parametrize(
+    "raw", ['{"data": [{"name": "vm"}', '{"data": [1 2]}', "[1, 2]"]
+)
+def test_iter_array_items_invalid(get_handler, raw):
+    json_stream = get_handler(TARGET_MODULE)
+
+    with pytest.raises(json_stream.JsonStreamError):
+        list(json_stream.iter_array_items(to_chunks(raw.encode("utf-8"), 3), "data"))
+
+
+@pytest.mark.parametrize("chunks", [[b'{"data":[1.', b"5]}"], [b'{"data":[1e', b"5]}"]])
+def test_iter_array_items_number_split_after_marker(get_handler, chunks):
+    json_stream = get_handler(TARGET_MODULE)
+
+    actual = list(json_stream.iter_array_items(chunks, "data"))
+
+    assert actual == [json.loads(b"".join(chunks))["data"][0]]
+
+
+def test_iter_array_items_random_chunk_boundaries(get_handler):
+    json_stream = get_handler(TARGET_MODULE)
+    rng = random.Random(42)
+    data = [
+        1.5,
+        -0.25,
+        1e5,
+        -2.5e-3,
+        123456789,
+        0,
+        True,
+        None,
+        "1.5",
+        {"value": 6.02e23, "list": [3.14159, -1]},
+    ]
+    raw = json.dumps({"data": data, "count": 10.75}).encode("utf-8")
+
+    for _ in range(500):
+        cuts = sorted(rng.sample(range(1, len(raw)), rng.randint(1, 20)))
+        chunks = [raw[start:end] for start, end in zip([0] + cuts, cuts + [len(raw)])]
+        other_values = {}
+
+        actual = list(json_stream.iter_array_items(chunks, "data", other_values))
+
+        assert actual == data
+        assert other_values == {"count": 10.75}
@@ -0,0 +1,357 @@
+"""
+In-process stand-in for a vCenter, for tests and benchmarks of the vSphere
+path without a lab.
+
+SimulatedVcenter serves real pyVmomi managed objects bound to a fake stub, so
+VsphereClient runs unchanged on top of it: every managed method call and
+property read goes through the stub, which answers it from an in-memory
+inventory of synthetic hosts after an optional per-call latency.
+
+Only the calls the vdo_ops vSphere client makes are implemented; anything else
+raises vmodl.fault.NotSupported.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from itertools import count
+from typing import Any, Dict, List
+
+from mock import patch
+from pyVmomi import vim, vmodl
+
+VSWITCH_KEY_PREFIX = "key-vim.host.VirtualSwitch-"
+PORTGROUP_KEY_PREFIX = "key-vim.host.PortGroup-"
+
+
+class SimulatedHost:
+    def __init__(self, mo: vim.HostSystem, name: str, cluster: str = None):
+        self.mo = mo
+        self.name = name
+        self.cluster = cluster
+        self.network_system = None
+        self.vswitches: Dict[str, vim.host.VirtualSwitch] = {}
+        self.portgroups: Dict[str, vim.host.PortGroup] = {}
+        self.vnics: List[vim.host.VirtualNic] = []
+
+    def add_vswitch(self, name: str, spec: vim.host.VirtualSwitch.Specification):
+        if name in self.vswitches:
+            raise vim.fault.AlreadyExists(name=name)
+        self.vswitches[name] = vim.host.VirtualSwitch(
+            name=name,
+            key=f"{VSWITCH_KEY_PREFIX}{name}",
+            numPorts=spec.numPorts,
+            spec=spec,
+            portgroup=[],
+        )
+
+    def add_portgroup(self, spec: vim.host.PortGroup.Specification):
+        if spec.name in self.portgroups:
+            raise vim.fault.AlreadyExists(name=spec.name)
+        vswitch = self.vswitches.get(spec.vswitchName)
+        if vswitch is None:
+            raise vim.fault.NotFound(msg=f"vSwitch {spec.vswitchName} not found")
+        key = f"{PORTGROUP_KEY_PREFIX}{spec.name}"
+        self.portgroups[spec.name] = vim.host.PortGroup(
+            key=key, spec=spec, vswitch=vswitch.key
+        )
+        vswitch.portgroup = [*vswitch.portgroup, key]
+
+    def add_vnic(self, device: str, portgroup: str):
+        self.vnics.append(
+            vim.host.VirtualNic(
+                device=device,
+                key=f"key-vim.host.VirtualNic-{device}",
+                portgroup=portgroup,
+                spec=vim.host.VirtualNic.Specification(),
+            )
+        )
+
+    def get_property(self, path: str) -> Any:
+        if path == "name":
+            return self.name
+        if path == "config.network.vswitch":
+            return vim.host.VirtualSwitch.Array(list(self.vswitches.values()))
+        if path == "config.network.portgroup":
+            return vim.host.PortGroup.Array(list(self.portgroups.values()))
+        if path == "config.network.vnic":
+            return vim.host.VirtualNic.Array(list(self.vnics))
+        if path == "config.network.consoleVnic":
+            return vim.host.VirtualNic.Array()
+        raise vmodl.fault.InvalidProperty(name=path)
+
+
+class SimulatedStub:
+    """
+    pyVmomi stub answering from a SimulatedVcenter. Sessions share the stub.
+    """
+
+    def __init__(self, vcenter: "SimulatedVcenter"):
+        self.vcenter = vcenter
+
+    def InvokeMethod(self, mo: Any, info: Any, args: Any) -> Any:
+        self.vcenter.wait()
+        handler = self.vcenter.methods.get(info.wsdlName)
+        if handler is None:
+            raise vmodl.fault.NotSupported(msg=f"{info.wsdlName} is not simulated")
+        return handler(mo, *args)
+
+    def InvokeAccessor(self, mo: Any, info: Any) -> Any:
+        self.vcenter.wait()
+        return self.vcenter.get_property(mo, info.name)
+
+    def DropConnections(self) -> None:
+        pass
+
+
+class SimulatedVcenter:
+    """
+    A vCenter with synthetic host systems.
+
+    :param latency: seconds every call sleeps for, to mimic the network
+    :param page_size: objects per RetrievePropertiesEx page
+    """
+
+    def __init__(self, latency: float = 0.0, page_size: int = 100):
+        self.latency = latency
+        self.page_size = page_size
+        self.stub = SimulatedStub(self)
+        self.lock = threading.Lock()
+        self.logins = 0
+        self.__ids = count(1)
+        self.__views: Dict[str, Any] = {}
+        self.__pages: Dict[str, List[Any]] = {}
+        self.hosts: Dict[str, SimulatedHost] = {}
+        self.__hosts_by_moid: Dict[str, SimulatedHost] = {}
+        self.clusters: Dict[str, vim.ClusterComputeResource] = {}
+
+        self.si = vim.ServiceInstance("ServiceInstance", self.stub)
+        self.content = vim.ServiceInstanceContent(
+            rootFolder=vim.Folder("group-d1", self.stub),
+            propertyCollector=vmodl.query.PropertyCollector(
+                "propertyCollector", self.stub
+            ),
+            viewManager=vim.view.ViewManager("ViewManager", self.stub),
+            sessionManager=vim.SessionManager("SessionManager", self.stub),
+        )
+        self.methods = {
+            "RetrieveServiceContent": lambda mo: self.content,
+            "CreateContainerView": self._create_container_view,
+            "DestroyView": self._destroy_view,
+            "RetrievePropertiesEx": self._retrieve_properties,
+            "ContinueRetrievePropertiesEx": self._continue_retrieve_properties,
+            "AddVirtualSwitch": self._add_virtual_switch,
+            "AddPortGroup": self._add_portgroup,
+            "UpdateNetworkConfig": self._update_network_config,
+            "AcquireCloneTicket": lambda mo: f"ticket-{next(self.__ids)}",
+            "CloneSession": lambda mo, ticket: self._login(),
+            "Logout": lambda mo: None,
+        }
+
+    def wait(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _next_id(self, prefix: str) -> str:
+        return f"{prefix}-{next(self.__ids)}"
+
+    def _login(self) -> vim.UserSession:
+        with self.lock:
+            self.logins += 1
+        return vim.UserSession(key=self._next_id("session"), userName="simulator")
+
+    # INVENTORY
+    def add_cluster(self, name: str) -> vim.ClusterComputeResource:
+        cluster = vim.ClusterComputeResource(self._next_id("domain-c"), self.stub)
+        self.clusters[name] = cluster
+        return cluster
+
+    def add_host(
+        self,
+        name: str,
+        vswitches: int = 0,
+        portgroups: int = 0,
+        vnics: int = 0,
+        cluster: str = None,
+    ) -> SimulatedHost:
+        """
+        Adds a host system with synthetic networks. Port groups are spread over
+        the virtual switches and the first vnics port groups get a virtual nic,
+        so they are never copied.
+        """
+        if cluster is not None and cluster not in self.clusters:
+            self.add_cluster(cluster)
+
+        host = SimulatedHost(
+            vim.HostSystem(self._next_id("host"), self.stub), name, cluster
+        )
+        host.network_system = vim.host.NetworkSystem(
+            f"networkSystem-{host.mo._moId}", self.stub
+        )
+        for index in range(vswitches):
+            host.add_vswitch(
+                f"vSwitch{index}", vim.host.VirtualSwitch.Specification(numPorts=128)
+            )
+        for index in range(portgroups):
+            host.add_portgroup(
+                vim.host.PortGroup.Specification(
+                    name=f"VLAN{index + 100}",
+                    vlanId=index + 100,
+                    vswitchName=f"vSwitch{index % vswitches}",
+                    policy=vim.host.NetworkPolicy(),
+                )
+            )
+        for index, portgroup in enumerate(list(host.portgroups)[:vnics]):
+            host.add_vnic(f"vmk{index}", portgroup)
+
+        self.hosts[name] = host
+        self.__hosts_by_moid[host.mo._moId] = host
+        self.__hosts_by_moid[host.network_system._moId] = host
+        return host
+
+    def _host_by_mo(self, mo: Any) -> SimulatedHost:
+        host = self.__hosts_by_moid.get(mo._moId)
+        if host is None:
+            raise vmodl.fault.ManagedObjectNotFound(obj=mo)
+        return host
+
+    def get_property(self, mo: Any, name: str) -> Any:
+        if isinstance(mo, vim.ServiceInstance) and name == "content":
+            return self.content
+        if isinstance(mo, vim.SessionManager) and name == "currentSession":
+            return vim.UserSession(key="current", userName="simulator")
+        if isinstance(mo, vim.HostSystem) and name == "configManager":
+            return vim.host.ConfigManager(
+                networkSystem=self._host_by_mo(mo).network_system
+            )
+        if isinstance(mo, vim.HostSystem) and name == "name":
+            return self._host_by_mo(mo).name
+        raise vmodl.fault.NotSupported(
+            msg=f"{type(mo).__name__}.{name} is not simulated"
+        )
+
+    # VIEWS AND PROPERTY COLLECTOR
+    def _create_container_view(self, mo, container, types, recursive):
+        view = vim.view.ContainerView(self._next_id("session[0]view"), self.stub)
+        with self.lock:
+            self.__views[view._moId] = (container, list(types))
+        return view
+
+    def _destroy_view(self, mo):
+        with self.lock:
+            self.__views.pop(mo._moId, None)
+
+    def view_count(self) -> int:
+        return len(self.__views)
+
+    def _view_objects(self, view) -> List[Any]:
+        container, types = self.__views[view._moId]
+        objects = []
+        if vim.HostSystem in types:
+            objects.extend(
+                host.mo
+                for host in self.hosts.values()
+                if isinstance(container, vim.Folder)
+                or self.clusters.get(host.cluster) == container
+            )
+        if vim.ClusterComputeResource in types:
+            objects.extend(self.clusters.values())
+        return objects
+
+    def _object_content(
+        self, obj, path_set
+    ) -> vmodl.query.PropertyCollector.ObjectContent:
+        if isinstance(obj, vim.ClusterComputeResource):
+            name = next(key for key, value in self.clusters.items() if value == obj)
+            values = {"name": name}
+            prop_set = [
+                vmodl.DynamicProperty(name=path, val=values[path]) for path in path_set
+            ]
+        else:
+            host = self._host_by_mo(obj)
+            prop_set = [
+                vmodl.DynamicProperty(name=path, val=host.get_property(path))
+                for path in path_set
+            ]
+        return vmodl.query.PropertyCollector.ObjectContent(obj=obj, propSet=prop_set)
+
+    def _retrieve_properties(self, mo, spec_set, options):
+        contents = []
+        for filter_spec in spec_set:
+            path_set = [path for spec in filter_spec.propSet for path in spec.pathSet]
+            for object_spec in filter_spec.objectSet:
+                if isinstance(object_spec.obj, vim.view.ContainerView):
+                    objects = self._view_objects(object_spec.obj)
+                else:
+                    objects = [object_spec.obj]
+                contents.extend(self._object_content(obj, path_set) for obj in objects)
+        return self._page(contents, options.maxObjects or self.page_size)
+
+    def _continue_retrieve_properties(self, mo, token):
+        with self.lock:
+            contents, page_size = self.__pages.pop(token)
+        return self._page(contents, page_size)
+
+    def _page(self, contents, page_size):
+        token = None
+        if len(contents) > page_size:
+            token = self._next_id("token")
+            with self.lock:
+                self.__pages[token] = (contents[page_size:], page_size)
+        return vmodl.query.PropertyCollector.RetrieveResult(
+            objects=contents[:page_size], token=token
+        )
+
+    # HOST NETWORK SYSTEM
+    def _add_virtual_switch(self, mo, vswitch_name, spec):
+        with self.lock:
+            self._host_by_mo(mo).add_vswitch(vswitch_name, spec)
+
+    def _add_portgroup(self, mo, spec):
+        with self.lock:
+            self._host_by_mo(mo).add_portgroup(spec)
+
+    def _update_network_config(self, mo, config, change_mode):
+        with self.lock:
+            host = self._host_by_mo(mo)
+            # vCenter applies a configuration as a whole or not at all
+            vswitch_names = set(host.vswitches)
+            portgroup_names = set(host.portgroups)
+            for vswitch in config.vswitch:
+                if vswitch.name in vswitch_names:
+                    raise vim.fault.AlreadyExists(name=vswitch.name)
+                vswitch_names.add(vswitch.name)
+            for portgroup in config.portgroup:
+                if portgroup.spec.name in portgroup_names:
+                    raise vim.fault.AlreadyExists(name=portgroup.spec.name)
+                if portgroup.spec.vswitchName not in vswitch_names:
+                    raise vim.fault.NotFound(
+                        msg=f"vSwitch {portgroup.spec.vswitchName} not found"
+                    )
+                portgroup_names.add(portgroup.spec.name)
+
+            for vswitch in config.vswitch:
+                host.add_vswitch(vswitch.name, vswitch.spec)
+            for portgroup in config.portgroup:
+                host.add_portgroup(portgroup.spec)
+        return vim.host.NetworkConfig.Result()
+
+    @contextmanager
+    def connect(self):
+        """
+        Routes the logins and session clones of the vSphere client module to
+        this vCenter. Clients get a limiter that never holds a call back, so
+        benchmarks measure the calls themselves.
+        """
+        from common.clients import vsphere
+
+        def login(host_name, limiter=None):
+            self._login()
+            return self.si
+
+        limiter = vsphere.VcenterLimiter(
+            "simulator", rate=1e9, burst=1_000_000, max_concurrent=1_000
+        )
+        with patch.object(vsphere, "_login", login), patch.object(
+            vsphere.connect, "SmartStubAdapter", lambda **kwargs: self.stub
+        ), patch.object(vsphere, "get_limiter", lambda host_name: limiter):
+            yield self
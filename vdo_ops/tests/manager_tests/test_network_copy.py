@@ -15,6 +15,19 @@ def monkeypatch_ssm(monkeypatch):
     monkeypatch.setattr(secrets, "get_parameter", mock_return)
 
 
+def zamboni_mock(*hyps):
+    """
+    Zamboni client resolving the requested device IDs, in order, to the hyps.
+    """
+    return Mock(
+        **{
+            "get_hyps_by_device_ids.side_effect": lambda device_ids: dict(
+                zip([str(device_id) for device_id in device_ids], hyps)
+            )
+        }
+    )
+
+
 @patch(f"{TARGET_MODULE}.CLIENTS")
 def test_lambda_handler(clients_mock, get_handler):
     lambda_handler = get_handler(TARGET_MODULE)
@@ -27,13 +40,9 @@ def test_lambda_handler(clients_mock, get_handler):
 
     hyp_data_1 = util.load_json_file("data/zamboni/get_host_system.json")
     hyp_data_2 = util.load_json_file("data/zamboni/get_host_system_2.json")
-    zamboni_client_mock = Mock(
-        **{
-            "get_hyps_by_device_id.side_effect": [
-                hyp_data_1.get("data")[0],
-                hyp_data_2.get("data")[0],
-            ]
-        }
+    zamboni_client_mock = zamboni_mock(
+        hyp_data_1.get("data")[0],
+        hyp_data_2.get("data")[0],
     )
     clients_mock.zamboni_client = zamboni_client_mock
 
@@ -41,12 +50,233 @@ def test_lambda_handler(clients_mock, get_handler):
     vsphere_mock.copy_networks.return_value = Mock()
 
     # when
-    with mock.patch.object(lambda_handler, "VsphereApi", return_value=vsphere_mock):
+    with mock.patch.object(
+        lambda_handler, "VsphereApi", return_value=vsphere_mock
+    ) as vsphere_api_mock:
         lambda_handler.handler(event, None)
 
         # then
+        vsphere_api_mock.assert_called_with(
+            "vs710.lab.ord1.rvi.rax.io", session_pool=lambda_handler.SESSION_POOL
+        )
         vsphere_mock.copy_networks.assert_called_with(
-            "364027-hyp90.ord1.rvi.local", "364026-hyp90.ord1.rvi.local"
+            "364027-hyp90.ord1.rvi.local",
+            "364026-hyp90.ord1.rvi.local",
+            dry_run=False,
+            checkpoint_store=lambda_handler.CHECKPOINT_STORE,
+        )
+        zamboni_client_mock.get_hyps_by_device_ids.assert_called_once_with(
+            ["364027", "364026"]
+        )
+
+
+@patch(f"{TARGET_MODULE}.CLIENTS")
+def test_lambda_handler_dry_run(clients_mock, get_handler):
+    lambda_handler = get_handler(TARGET_MODULE)
+
+    # setup
+    event = {"from_device": "364027", "to_device": "364026", "dry_run": True}
+
+    hyp_data_1 = util.load_json_file("data/zamboni/get_host_system.json")
+    hyp_data_2 = util.load_json_file("data/zamboni/get_host_system_2.json")
+    clients_mock.zamboni_client = zamboni_mock(
+        hyp_data_1.get("data")[0],
+        hyp_data_2.get("data")[0],
+    )
+
+    vsphere_mock = mock.Mock()
+    vsphere_mock.copy_networks.return_value.to_dict.return_value = {"plan": "data"}
+
+    # when
+    with mock.patch.object(lambda_handler, "VsphereApi", return_value=vsphere_mock):
+        actual = lambda_handler.handler(event, None)
+
+    # then
+    vsphere_mock.copy_networks.assert_called_with(
+        "364027-hyp90.ord1.rvi.local",
+        "364026-hyp90.ord1.rvi.local",
+        dry_run=True,
+        checkpoint_store=lambda_handler.CHECKPOINT_STORE,
+    )
+    assert actual == {"plan": "data"}
+
+
+@patch(f"{TARGET_MODULE}.CLIENTS")
+def test_lambda_handler_across_vcenters(clients_mock, get_handler):
+    lambda_handler = get_handler(TARGET_MODULE)
+
+    # setup
+    event = {"from_device": "364027", "to_device": "364026"}
+
+    hyp_data_1 = util.load_json_file("data/zamboni/get_host_system.json")
+    hyp_data_2 = util.load_json_file("data/zamboni/get_host_system_2.json")
+    clients_mock.zamboni_client = zamboni_mock(
+        hyp_data_1.get("data")[0],
+        dict(hyp_data_2.get("data")[0], location="vs720.lab.ord1.rvi.rax.io"),
+    )
+
+    source_api = Mock()
+    destination_api = Mock()
+    destination_api.copy_networks_from.return_value.to_dict.return_value = {
+        "plan": "data"
+    }
+
+    # when
+    with mock.patch.object(
+        lambda_handler, "VsphereApi", side_effect=[source_api, destination_api]
+    ) as vsphere_api_mock:
+        actual = lambda_handler.handler(event, None)
+
+    # then
+    vsphere_api_mock.assert_has_calls(
+        [
+            mock.call(
+                "vs710.lab.ord1.rvi.rax.io", session_pool=lambda_handler.SESSION_POOL
+            ),
+            mock.call(
+                "vs720.lab.ord1.rvi.rax.io", session_pool=lambda_handler.SESSION_POOL
+            ),
+        ]
+    )
+    destination_api.copy_networks_from.assert_called_with(
+        source_api,
+        "364027-hyp90.ord1.rvi.local",
+        "364026-hyp90.ord1.rvi.local",
+        dry_run=False,
+        checkpoint_store=lambda_handler.CHECKPOINT_STORE,
+    )
+    source_api.copy_networks.assert_not_called()
+    assert actual == {"plan": "data"}
+
+
+@patch(f"{TARGET_MODULE}.CLIENTS")
+def test_lambda_handler_to_many(clients_mock, get_handler):
+    lambda_handler = get_handler(TARGET_MODULE)
+    network_plan = get_handler("common.network_plan")
+
+    # setup
+    event = {"from_device": "364027", "to_devices": ["364026", "364028", "1"]}
+
+    hyp_data_1 = util.load_json_file("data/zamboni/get_host_system.json")
+    hyp_data_2 = util.load_json_file("data/zamboni/get_host_system_2.json")
+    hyp_data_3 = dict(hyp_data_2.get("data")[0], name="364028-hyp91.ord1.rvi.local")
+    clients_mock.zamboni_client = zamboni_mock(
+        hyp_data_1.get("data")[0],
+        hyp_data_2.get("data")[0],
+        hyp_data_3,
+        None,
+    )
+
+    vsphere_mock = mock.Mock()
+    vsphere_mock.copy_networks_to_many.return_value = {
+        "364026-hyp90.ord1.rvi.local": network_plan.NetworkCopyResult(
+            "364026-hyp90.ord1.rvi.local", error="Boom!"
+        ),
+        "364028-hyp91.ord1.rvi.local": network_plan.NetworkCopyResult(
+            "364028-hyp91.ord1.rvi.local",
+            plan=network_plan.NetworkCopyPlan("from", "364028-hyp91.ord1.rvi.local"),
+        ),
+    }
+
+    # when
+    with mock.patch.object(lambda_handler, "VsphereApi", return_value=vsphere_mock):
+        actual = lambda_handler.handler(event, None)
+
+    # then
+    vsphere_mock.copy_networks_to_many.assert_called_with(
+        "364027-hyp90.ord1.rvi.local",
+        ["364026-hyp90.ord1.rvi.local", "364028-hyp91.ord1.rvi.local"],
+        dry_run=False,
+    )
+    assert actual["364026"]["succeeded"] is False
+    assert actual["364026"]["error"] == "Boom!"
+    assert actual["364028"]["succeeded"] is True
+    assert actual["1"]["succeeded"] is False
+    assert actual["1"]["host_name"] == "1"
+
+
+@patch(f"{TARGET_MODULE}.CLIENTS")
+def test_lambda_handler_to_many_across_vcenters(clients_mock, get_handler):
+    lambda_handler = get_handler(TARGET_MODULE)
+    network_plan = get_handler("common.network_plan")
+
+    # setup
+    event = {"from_device": "364027", "to_devices": ["364026", "364028"]}
+
+    hyp_data_1 = util.load_json_file("data/zamboni/get_host_system.json")
+    hyp_data_2 = util.load_json_file("data/zamboni/get_host_system_2.json")
+    hyp_data_3 = dict(
+        hyp_data_2.get("data")[0],
+        name="364028-hyp91.ord1.rvi.local",
+        location="vs720.lab.ord1.rvi.rax.io",
+    )
+    clients_mock.zamboni_client = zamboni_mock(
+        hyp_data_1.get("data")[0], hyp_data_2.get("data")[0], hyp_data_3
+    )
+
+    source_api = Mock()
+    source_api.copy_networks_to_many.return_value = {
+        "364026-hyp90.ord1.rvi.local": network_plan.NetworkCopyResult(
+            "364026-hyp90.ord1.rvi.local",
+            plan=network_plan.NetworkCopyPlan("from", "364026-hyp90.ord1.rvi.local"),
+        ),
+    }
+    destination_api = Mock()
+    destination_api.copy_networks_from.return_value = network_plan.NetworkCopyPlan(
+        "from", "364028-hyp91.ord1.rvi.local"
+    )
+
+    # when
+    with mock.patch.object(
+        lambda_handler, "VsphereApi", side_effect=[source_api, destination_api]
+    ) as vsphere_api_mock:
+        actual = lambda_handler.handler(event, None)
+
+    # then
+    assert vsphere_api_mock.call_args[0][0] == "vs720.lab.ord1.rvi.rax.io"
+    source_api.copy_networks_to_many.assert_called_with(
+        "364027-hyp90.ord1.rvi.local", ["364026-hyp90.ord1.rvi.local"], dry_run=False
+    )
+    destination_api.copy_networks_from.assert_called_with(
+        source_api,
+        "364027-hyp90.ord1.rvi.local",
+        "364028-hyp91.ord1.rvi.local",
+        dry_run=False,
+        checkpoint_store=lambda_handler.CHECKPOINT_STORE,
+    )
+    assert actual["364026"]["succeeded"] is True
+    assert actual["364028"]["succeeded"] is True
+    assert actual["364028"]["host_name"] == "364028-hyp91.ord1.rvi.local"
+
+
+@patch(f"{TARGET_MODULE}.CLIENTS")
+def test_lambda_handler_to_many_duplicate_host(clients_mock, get_handler):
+    lambda_handler = get_handler(TARGET_MODULE)
+
+    # setup
+    event = {"from_device": "364027", "to_devices": ["364026", "364028"]}
+
+    hyp_data_1 = util.load_json_file("data/zamboni/get_host_system.json")
+    hyp_data_2 = util.load_json_file("data/zamboni/get_host_system_2.json")
+    clients_mock.zamboni_client = zamboni_mock(
+        hyp_data_1.get("data")[0],
+        hyp_data_2.get("data")[0],
+        hyp_data_2.get("data")[0],
+    )
+
+    vsphere_mock = mock.Mock()
+
+    # when
+    with mock.patch.object(lambda_handler, "VsphereApi", return_value=vsphere_mock):
+        actual = lambda_handler.handler(event, None)
+
+    # then
+    vsphere_mock.copy_networks_to_many.assert_not_called()
+    for device_number in ["364026", "364028"]:
+        assert actual[device_number]["succeeded"] is False
+        assert actual[device_number]["error"] == (
+            "Devices 364026, 364028 resolve to the same host "
+            "364026-hyp90.ord1.rvi.local"
         )
 
 
@@ -62,13 +292,9 @@ def test_lambda_handler_vcenter_login(clients_mock, get_handler):
 
     hyp_data_1 = util.load_json_file("data/zamboni/get_host_system.json")
     hyp_data_2 = util.load_json_file("data/zamboni/get_host_system_2.json")
-    zamboni_client_mock = Mock(
-        **{
-            "get_hyps_by_device_id.side_effect": [
-                hyp_data_1.get("data")[0],
-                hyp_data_2.get("data")[0],
-            ]
-        }
+    zamboni_client_mock = zamboni_mock(
+        hyp_data_1.get("data")[0],
+        hyp_data_2.get("data")[0],
     )
     clients_mock.zamboni_client = zamboni_client_mock
 
@@ -81,6 +307,25 @@ def test_lambda_handler_vcenter_login(clients_mock, get_handler):
             lambda_handler.handler(event, None)
 
 
+@patch(f"{TARGET_MODULE}.CLIENTS")
+def test_lambda_handler_hyp_not_found(clients_mock, get_handler):
+    lambda_handler = get_handler(TARGET_MODULE)
+
+    # setup
+    event = {"from_device": "364027", "to_device": "364026"}
+
+    hyp_data_1 = util.load_json_file("data/zamboni/get_host_system.json")
+    clients_mock.zamboni_client = zamboni_mock(hyp_data_1.get("data")[0], None)
+
+    # when
+    with mock.patch.object(lambda_handler, "VsphereApi") as vsphere_api_mock:
+        with pytest.raises(Exception, match="No hypervisor found for device 364026"):
+            lambda_handler.handler(event, None)
+
+    # then
+    vsphere_api_mock.assert_not_called()
+
+
 @patch(f"{TARGET_MODULE}.CLIENTS")
 def test_lambda_handler_copy_error(clients_mock, get_handler):
     lambda_handler = get_handler(TARGET_MODULE)
@@ -93,13 +338,9 @@ def test_lambda_handler_copy_error(clients_mock, get_handler):
 
     hyp_data_1 = util.load_json_file("data/zamboni/get_host_system.json")
     hyp_data_2 = util.load_json_file("data/zamboni/get_host_system_2.json")
-    zamboni_client_mock = Mock(
-        **{
-            "get_hyps_by_device_id.side_effect": [
-                hyp_data_1.get("data")[0],
-                hyp_data_2.get("data")[0],
-            ]
-        }
+    zamboni_client_mock = zamboni_mock(
+        hyp_data_1.get("data")[0],
+        hyp_data_2.get("data")[0],
     )
     clients_mock.zamboni_client = zamboni_client_mock
 
@@ -110,3 +351,43 @@ def test_lambda_handler_copy_error(clients_mock, get_handler):
     with mock.patch.object(lambda_handler, "VsphereApi", return_value=vsphere_mock):
         with pytest.raises(Exception):
             lambda_handler.handler(event, None)
+
+
+@patch(f"{TARGET_MODULE}.CLIENTS")
+def test_lambda_handler_out_of_time(clients_mock, get_handler):
+    from common.deadline import DeadlineExceeded
+
+    lambda_handler = get_handler(TARGET_MODULE)
+
+    # setup
+    event = {
+        "from_device": "364027",
+        "to_device": "364026",
+    }
+    context = Mock(**{"get_remaining_time_in_millis.return_value": 30000})
+
+    hyp_data_1 = util.load_json_file("data/zamboni/get_host_system.json")
+    hyp_data_2 = util.load_json_file("data/zamboni/get_host_system_2.json")
+    clients_mock.zamboni_client = zamboni_mock(
+        hyp_data_1.get("data")[0],
+        hyp_data_2.get("data")[0],
+    )
+
+    deadlines = []
+
+    def copy_networks(*args, **kwargs):
+        from common import deadline
+
+        deadlines.append(deadline.current())
+        raise DeadlineExceeded("Not enough time left")
+
+    vsphere_mock = mock.Mock(**{"copy_networks.side_effect": copy_networks})
+
+    # when
+    with mock.patch.object(lambda_handler, "VsphereApi", return_value=vsphere_mock):
+        with pytest.raises(DeadlineExceeded):
+            lambda_handler.handler(event, context)
+
+    # then
+    assert deadlines[0] is not None
+    assert deadlines[0].remaining() <= 30